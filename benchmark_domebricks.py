@@ -0,0 +1,76 @@
+"""Benchmark of the whole pipeline for a large (kiln or room-sized) dome.
+
+Usage: python benchmark_domebricks.py [--inner_radius 5000] [--height 4000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from domebricks import (
+    get_dome_geometry, optimize_bricks_amounts, get_row_templates,
+    get_bill_of_materials, verify_rows, get_thrust_line, build_gltf,
+    render_templates_pdf, build_svg)
+
+
+def measure(title, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    print('{:<24} {:>8.3f} s'.format(title, time.perf_counter() - start))
+    return result
+
+
+def main(brick_width, brick_height, brick_depth, surface_inner_radius,
+         height, first_row_height, seam):
+    params = dict(
+        brick_width=brick_width, brick_height=brick_height,
+        brick_depth=brick_depth, surface_inner_radius=surface_inner_radius,
+        height=height, first_row_height=first_row_height, seam=seam)
+    start = time.perf_counter()
+    geometry = measure(
+        'geometry', get_dome_geometry, bricks_amount=1, **params)
+    bricks_amounts = measure(
+        'optimize_bricks_amounts', optimize_bricks_amounts, geometry)
+    geometry.rows = measure(
+        'row templates', get_row_templates, geometry,
+        bricks_amounts=bricks_amounts)
+    bom = measure('bill of materials', get_bill_of_materials, geometry)
+    measure('verify_rows', verify_rows, geometry)
+    measure('thrust line', get_thrust_line, geometry)
+    measure('gltf', build_gltf, geometry)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as path:
+        os.chdir(path)
+        try:
+            measure('templates pdf', render_templates_pdf, geometry)
+            measure(
+                'svg and pdf', build_svg, bricks_amounts=bricks_amounts,
+                **params)
+        finally:
+            os.chdir(cwd)
+
+    print('rows: {}, bricks: {}, largest row: {} bricks'.format(
+        len(geometry.rows) + 1, bom['totals']['bricks'],
+        max(x['bricks'] for x in bom['rows'])))
+    print('total: {:.3f} s'.format(time.perf_counter() - start))
+    try:
+        import resource
+        print('peak memory: {:.0f} MB'.format(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+    except ImportError:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--brick_width', default=250, type=float)
+    parser.add_argument('--brick_height', default=65, type=float)
+    parser.add_argument('--brick_depth', default=120, type=float)
+    parser.add_argument('--inner_radius', default=5000, type=float)
+    parser.add_argument('--height', default=4000, type=float)
+    parser.add_argument('--first_row_height', default=300, type=float)
+    parser.add_argument('--seam', default=3, type=float)
+    args = parser.parse_args()
+    main(args.brick_width, args.brick_height, args.brick_depth,
+         args.inner_radius, args.height, args.first_row_height, args.seam)
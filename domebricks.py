@@ -1,12 +1,204 @@
 # encoding=utf-8
 import argparse
+import ast
+import asyncio
+import bisect
+import collections
+import contextlib
+import contextvars
+import copy
+import functools
+import inspect
+import io
+import itertools
+import json
 import math
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
 from uuid import uuid4
 
 from reportlab.pdfgen import canvas
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.lib.units import mm
 from reportlab.lib.pagesizes import A4
 
+# Levels of detail of svg elements: outlines only (previews and
+# thumbnails), outlines with distances and everything including point
+# markers and labels.
+DETAIL_OUTLINE = 0
+DETAIL_DIMENSIONS = 1
+DETAIL_FULL = 2
+DETAIL_LEVELS = {
+    'outline': DETAIL_OUTLINE,
+    'dimensions': DETAIL_DIMENSIONS,
+    'full': DETAIL_FULL,
+}
+# Detail of svg elements rendered in the current context, see svg_detail.
+SVG_DETAIL = contextvars.ContextVar('svg_detail', default=DETAIL_FULL)
+
+
+@contextlib.contextmanager
+def svg_detail(level):
+    """Renders svg elements in the block with the level of detail.
+
+    The level is local to the thread (or asyncio task), so concurrent
+    builds do not affect each other.
+    """
+    token = SVG_DETAIL.set(level)
+    try:
+        yield
+    finally:
+        SVG_DETAIL.reset(token)
+
+
+# Approximate size of svg text of the default font (16px) per character.
+CHAR_WIDTH = 9.6
+TEXT_HEIGHT = 16.0
+# Placer of labels in the current context, see label_placement.
+LABEL_PLACER = contextvars.ContextVar('label_placer', default=None)
+
+
+class LabelPlacer():
+
+    """Places label boxes without overlaps using a uniform grid index.
+
+    Every box is stored in the grid cells it covers, so checking a
+    candidate box only looks at boxes of a few cells and placing n labels
+    takes O(n) time for labels smaller than a cell.
+    """
+
+    def __init__(self, cell_size=64.0):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(list)
+        self.boxes = 0
+
+    def get_cells(self, box):
+        left, top, right, bottom = box
+        size = self.cell_size
+        return itertools.product(
+            range(int(math.floor(left / size)),
+                  int(math.floor(right / size)) + 1),
+            range(int(math.floor(top / size)),
+                  int(math.floor(bottom / size)) + 1))
+
+    def get_overlaps(self, box):
+        """Returns weight of placed labels overlapping the box."""
+        left, top, right, bottom = box
+        overlaps = {}
+        for cell in self.get_cells(box):
+            for other in self.cells.get(cell, ()):
+                if left < other[2] and other[0] < right \
+                        and top < other[3] and other[1] < bottom:
+                    overlaps[other[4]] = other[5]
+        return sum(overlaps.values())
+
+    def add(self, box, weight=1, key=None):
+        """Adds the box of a label.
+
+        Boxes added with the same key are one label for get_overlaps,
+        labels of lower weight are rather overlapped by place.
+        """
+        if key is None:
+            key = self.boxes
+        self.boxes += 1
+        box = tuple(box) + (key, weight)
+        for cell in self.get_cells(box[:4]):
+            self.cells[cell].append(box)
+
+    def place(self, candidates):
+        """Adds and returns index of the first free candidate box.
+
+        The candidate with the least overlaps is taken if all overlap.
+        """
+        best = best_overlaps = None
+        for index, box in enumerate(candidates):
+            overlaps = self.get_overlaps(box)
+            if best is None or overlaps < best_overlaps:
+                best, best_overlaps = index, overlaps
+            if not overlaps:
+                break
+        self.add(candidates[best])
+        return best
+
+
+@contextlib.contextmanager
+def label_placement(cell_size=64.0):
+    """Places Point and Path labels rendered in the block without overlaps.
+
+    Yields:
+        LabelPlacer: index of placed labels, local to the thread (or
+            asyncio task).
+    """
+    token = LABEL_PLACER.set(LabelPlacer(cell_size=cell_size))
+    try:
+        yield LABEL_PLACER.get()
+    finally:
+        LABEL_PLACER.reset(token)
+
+
+def get_text_box(x, y, text):
+    """Returns (left, top, right, bottom) of svg text at (x, y) baseline."""
+    return (x, y - TEXT_HEIGHT,
+            x + CHAR_WIDTH * len(str(text).strip()), y + TEXT_HEIGHT / 4)
+
+
+def get_text_path_boxes(p1, p2, dy, text, font_size=14, rotate=0):
+    """Returns boxes covering svg text laid along the path from p1 to p2.
+
+    The text starts at p1 and its baseline is dy away from the path, text
+    going past the path end isn't rendered. Slanted text is covered by a
+    box per font_size of its length, so boxes stay close to the text.
+    rotate (degrees) turns the text around its center.
+    """
+    length = math.hypot(p2.x - p1.x, p2.y - p1.y)
+    if not length:
+        return []
+    ux, uy = (p2.x - p1.x) / length, (p2.y - p1.y) / length
+    text_length = min(
+        CHAR_WIDTH * font_size / TEXT_HEIGHT * len(str(text).strip()),
+        length)
+    # Middle of the glyphs is above the baseline.
+    middle = dy - font_size * 0.35
+    center_x = p1.x + ux * text_length / 2 - uy * middle
+    center_y = p1.y + uy * text_length / 2 + ux * middle
+    cos = math.cos(math.radians(rotate))
+    sin = math.sin(math.radians(rotate))
+    chunks = max(1, int(math.ceil(text_length / font_size)))
+    boxes = []
+    for index in range(chunks):
+        along = (index + 0.5) * text_length / chunks - text_length / 2
+        x, y = ux * along, uy * along
+        x, y = center_x + x * cos - y * sin, center_y + x * sin + y * cos
+        boxes.append((
+            x - font_size / 2, y - font_size / 2,
+            x + font_size / 2, y + font_size / 2))
+    return boxes
+
+
+# Segments of paths rendered in the current context, see plot_recording.
+PLOT_SEGMENTS = contextvars.ContextVar('plot_segments', default=None)
+
+
+@contextlib.contextmanager
+def plot_recording():
+    """Records line segments of visible Paths rendered in the block.
+
+    Yields:
+        list: (stroke, (x1, y1), (x2, y2)) of every Path in the order they
+            were rendered, local to the thread (or asyncio task).
+    """
+    token = PLOT_SEGMENTS.set([])
+    try:
+        yield PLOT_SEGMENTS.get()
+    finally:
+        PLOT_SEGMENTS.reset(token)
+
 
 class Point():
     """Point on the x/y plain."""
@@ -25,8 +217,25 @@ class Point():
         return (self.x, self.y)
 
     def as_csv(self, fill='green'):
+        if SVG_DETAIL.get() < DETAIL_FULL:
+            return ''
+        text_x = self.x - 20
+        text_y = self.y - 10
+        placer = LABEL_PLACER.get()
+        if placer is not None:
+            # Default position first, then around the marker.
+            width = CHAR_WIDTH * len(str(self.title))
+            offsets = [
+                (-20, -10), (6, -6), (6, 18), (-20, 22), (-width - 6, -6),
+                (-width - 6, 18), (-width / 2, -26), (-width / 2, 38)]
+            index = placer.place([
+                get_text_box(self.x + dx, self.y + dy, self.title)
+                for dx, dy in offsets])
+            text_x = self.x + offsets[index][0]
+            text_y = self.y + offsets[index][1]
+            placer.add((self.x - 3, self.y - 3, self.x + 3, self.y + 3))
         return f'''
-            <text fill="{fill}" x="{self.x - 20}" y="{self.y - 10}">
+            <text fill="{fill}" x="{text_x}" y="{text_y}">
                 {self.title}
             </text>
             <circle cx="{self.x}"
@@ -39,18 +248,40 @@ class Point():
 class Path():
     """Path from one point to another."""
     def __init__(self, p1, p2, distance=None):
-        self.path_id = f'path-{uuid4().hex}'
+        self._path_id = None
         self.p1 = p1
         self.p2 = p2
         if distance is None:
             distance = get_distance(p1, p2)
         self.distance = distance
 
+    @property
+    def path_id(self):
+        # Only distance text refers the path, so the id is created lazily.
+        if self._path_id is None:
+            self._path_id = f'path-{uuid4().hex}'
+        return self._path_id
+
     def as_csv(self, y_offset=0, stroke='black', inner_text=False,
                rotate=0, dasharray=False, opacity=None,
                outside_path=False, move_bottom=False, move_left=False,
                x_offset=0, distance_fill=None):
 
+        segments = PLOT_SEGMENTS.get()
+        if segments is not None and opacity != 0:
+            segments.append(
+                (stroke, self.p1.as_tuple(), self.p2.as_tuple()))
+
+        if SVG_DETAIL.get() == DETAIL_OUTLINE:
+            # Invisible paths only hold the distance text.
+            if opacity == 0:
+                return ''
+            dash = ' stroke-dasharray="6"' if dasharray else ''
+            return (
+                f'<path stroke-width="2" stroke="{stroke}"{dash}'
+                f' d="M{self.p1.x},{self.p1.y} L{self.p2.x},{self.p2.y}"'
+                f' fill="none" />')
+
         if not distance_fill:
             distance_fill = stroke
 
@@ -102,6 +333,17 @@ class Path():
                 text_x += x_offset
             if y_offset:
                 text_y += y_offset
+            placer = LABEL_PLACER.get()
+            if placer is not None:
+                # Move the text along the path side it belongs to.
+                shifts = [0]
+                for step in range(1, 4):
+                    shifts.extend([
+                        -step * (TEXT_HEIGHT + 4), step * (TEXT_HEIGHT + 4)])
+                index = placer.place([
+                    get_text_box(text_x, text_y + x, self.distance)
+                    for x in shifts])
+                text_y += shifts[index]
             text = f'''
                 <text
                     dx="{text_x}"
@@ -113,6 +355,13 @@ class Path():
                 </text>
                 '''
         else:
+            placer = LABEL_PLACER.get()
+            if placer is not None:
+                # Text follows the path, only keep other labels off it
+                # where there is room.
+                for box in get_text_path_boxes(
+                        self.p1, self.p2, dy, self.distance, rotate=rotate):
+                    placer.add(box, weight=0.5, key=self.path_id)
             text = f'''
                 <text
                     dx="0"
@@ -142,13 +391,17 @@ class Row():
             bottom_radian_point, number, brick_height=65,
             outer_height=208,
             bottom_seam=6.0, vertical=False, brick_width=250,
-            brick_depth=120):
+            brick_depth=120, top_radian_hint=None):
         """
         Args:
             bottom_radian: previous brick radian.
             bottom_radian_point: previous brick radian point.
+            top_radian_hint: top_radian_index of the similar vertical row
+                to start search of the top radian from.
         """
         self.vertical = vertical
+        self.top_radian_hint = top_radian_hint
+        self.top_radian_index = None
         self.brick_height = brick_height
         self.brick_depth = brick_depth
         self.number = number
@@ -182,23 +435,35 @@ class Row():
             #     circle_center_point=self.surface_circle_center_point,
             #     distance=self.brick_height, radius=self.outer_radius)
             # return radian, new_point
-            step = 0.0001
-            radian = self.bottom_radian
-            new_x = self.bottom_outer_point.x
-            safety_counter = 10000
-            while True:
-                safety_counter -= 1
-                if safety_counter <= 0:
-                    raise RuntimeError(
-                        'Could not find vertical brick radian and point.')
-                radian -= step
+            # Radian is moved by step until the brick height is reached.
+            # Distance grows while radian moves, so the radian is found with
+            # binary search over radians accumulated the same way as in the
+            # loop (starting from top_radian_hint if given). Steps are shared
+            # by all rows, so they are added to the bottom radian.
+            steps = get_accumulated_radians(0.0001)
+            # The loop gave up after that many steps.
+            max_steps = 9999
+
+            def get_radian(index):
+                return self.bottom_radian - steps[index + 1]
+
+            def get_point(index):
                 new_y = self.surface_circle_center_point.y \
                     - self.outer_radius\
-                    * math.sin(radian)
-                new_point = Point(f'#{self.number}-TOP', new_x, new_y)
-                if get_distance(new_point, self.bottom_outer_point) \
-                        >= self.outer_height:
-                    return radian, new_point
+                    * math.sin(get_radian(index))
+                return Point(
+                    f'#{self.number}-TOP', self.bottom_outer_point.x, new_y)
+
+            index = get_first_index(
+                0, max_steps,
+                lambda x: get_distance(get_point(x), self.bottom_outer_point)
+                >= self.outer_height,
+                hint=self.top_radian_hint)
+            if index >= max_steps:
+                raise RuntimeError(
+                    'Could not find vertical brick radian and point.')
+            self.top_radian_index = index
+            return get_radian(index), get_point(index)
         else:
             radian, new_point = move_along_radius(
                 radian_point=self.bottom_radian_point,
@@ -266,12 +531,197 @@ class Row():
         return elems
 
 
+class RowTemplate():
+
+    """Cut sizes of a brick of the dome row (A-H template)."""
+
+    def __init__(
+            self, row, bricks_amount, vertical_seam,
+            a_point, b_point, c_point, d_point,
+            e_point, f_point, g_point, h_point,
+            inner_outer_diff, horizontal_top_outer_radius):
+        """
+        Args:
+            row(Row): row the template is computed for.
+            bricks_amount(int): amount of bricks in the row.
+            vertical_seam(float): seam between bricks of the row.
+            a_point, b_point: bottom outer side of the brick.
+            c_point, d_point: bottom inner side of the brick.
+            e_point, f_point: top outer side of the brick.
+            g_point, h_point: top inner side of the brick.
+            inner_outer_diff(float): outer height minus inner height.
+            horizontal_top_outer_radius(float): distance from the top
+                outer point to the dome center line.
+        """
+        self.row = row
+        self.number = row.number
+        self.bricks_amount = bricks_amount
+        self.vertical_seam = vertical_seam
+        self.a_point = a_point
+        self.b_point = b_point
+        self.c_point = c_point
+        self.d_point = d_point
+        self.e_point = e_point
+        self.f_point = f_point
+        self.g_point = g_point
+        self.h_point = h_point
+        self.inner_outer_diff = inner_outer_diff
+        self.horizontal_top_outer_radius = horizontal_top_outer_radius
+
+    def __repr__(self):
+        return '#{}'.format(self.number)
+
+    @property
+    def bottom_outer_width(self):
+        return get_distance(self.a_point, self.b_point)
+
+    @property
+    def bottom_inner_width(self):
+        return get_distance(self.c_point, self.d_point)
+
+    @property
+    def top_outer_width(self):
+        return get_distance(self.e_point, self.f_point)
+
+    @property
+    def top_inner_width(self):
+        return get_distance(self.g_point, self.h_point)
+
+    @property
+    def outer_height(self):
+        return self.row.outer_height
+
+    @property
+    def inner_height(self):
+        return self.row.outer_height - self.inner_outer_diff
+
+    @property
+    def bevel_angle(self):
+        # Degree of C and D corners of the template, see
+        # render_row_brick_template.
+        length_diff = (self.b_point.x - self.a_point.x) \
+            - (self.f_point.x - self.e_point.x)
+        return get_degree(
+            (-length_diff / 2, -self.row.brick_height), (0, 0),
+            (self.top_outer_width, 0))
+
+
+class DomeGeometry():
+
+    """Computed geometry of the dome (no rendering)."""
+
+    def __init__(
+            self, surface_circle_center_point, height_inner_point,
+            height_outer_point, dome_radius, dome_circle_center_point,
+            first_row_radian_point, first_row, rows, brick_width=250.0,
+            brick_height=65.0, brick_depth=120.0,
+            surface_inner_radius=503.0, height=440.0,
+            first_row_height=125.0, seam=3.0):
+        self.surface_circle_center_point = surface_circle_center_point
+        self.height_inner_point = height_inner_point
+        self.height_outer_point = height_outer_point
+        self.dome_radius = dome_radius
+        self.dome_circle_center_point = dome_circle_center_point
+        self.first_row_radian_point = first_row_radian_point
+        self.first_row = first_row
+        self.rows = rows
+        self.brick_width = brick_width
+        self.brick_height = brick_height
+        self.brick_depth = brick_depth
+        self.surface_inner_radius = surface_inner_radius
+        self.height = height
+        self.first_row_height = first_row_height
+        self.seam = seam
+
+    @property
+    def last_row(self):
+        """Returns last row before key bricks."""
+        return self.rows[-1].row
+
+    @property
+    def warm_start(self):
+        """Returns solvers state to start similar geometry from.
+
+        See get_dome_geometry.
+        """
+        return {
+            'center_step': int(round(
+                self.dome_circle_center_point.y
+                - self.height_inner_point.y)),
+            'top_radian_index': self.first_row.top_radian_index,
+        }
+
+
+class CancelToken():
+
+    """Cooperative cancellation and time budget of a build.
+
+    Solver loops call check, so a cancelled or overdue build stops at the
+    next step instead of running until its safety counters.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        Args:
+            timeout(float or None): seconds from now the build must finish
+                in.
+        """
+        self.timeout = timeout
+        self.deadline = None if timeout is None \
+            else time.monotonic() + timeout
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        """Raises CancelledError or TimeoutError if the build must stop."""
+        if self.cancelled:
+            raise CancelledError('Build was cancelled.')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeoutError(
+                'Build exceeded its time budget of {:g} s.'.format(
+                    self.timeout))
+
+
+class BoundsCanvas():
+
+    """Canvas replacement that collects bounds of rendered elements."""
+
+    def __init__(self, font_name='Helvetica', font_size=12):
+        self.font_name = font_name
+        self.font_size = font_size
+        self.bounds = None
+
+    def _extend(self, x1, y1, x2, y2):
+        if self.bounds is None:
+            self.bounds = (x1, y1, x2, y2)
+        else:
+            self.bounds = (
+                min(self.bounds[0], x1), min(self.bounds[1], y1),
+                max(self.bounds[2], x2), max(self.bounds[3], y2))
+
+    def line(self, x1, y1, x2, y2):
+        self._extend(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+    def drawString(self, x, y, text):
+        width = stringWidth(text, self.font_name, self.font_size)
+        descent = self.font_size * 0.25
+        self._extend(x, y - descent, x + width, y + self.font_size)
+
+    def setDash(self, *args, **kwargs):
+        pass
+
+    def showPage(self):
+        pass
+
+
 def render_row_brick_template(
         cnv, bricks_amount, a_point, b_point, c_point, d_point,
         e_point, f_point, g_point, h_point,
         brick_height=65, brick_width=250,
         row_number=None, inner_outer_diff=None,
-        vertical_seam=4):
+        vertical_seam=4, show_page=True):
     assert inner_outer_diff is not None
     start_y = 285
     start_x = 20
@@ -400,7 +850,8 @@ def render_row_brick_template(
         point_d[1] + 30,
         u'{}°'.format(float_format(degree)))
 
-    cnv.showPage()
+    if show_page:
+        cnv.showPage()
 
 
 def render_row_constriction_template(
@@ -447,10 +898,7 @@ def render_row_constriction_template(
         'CD2({})'.format(float_format(get_distance1(c_point, d_point)/mm)))
 
 
-def render_first_row_template(cnv, first_row, brick_depth):
-    start_y = 275
-    start_x = 20
-
+def render_page_notes(cnv, start_x=20, start_y=275):
     cnv.drawString(
         (start_x - 5)*mm, (start_y + 10)*mm,
         'Warning: verify size with ruller after printing first'
@@ -460,6 +908,14 @@ def render_first_row_template(cnv, first_row, brick_depth):
         20, 20,
         'Generated with domebricks.py - https://github.com/nmb10/domebricks')
 
+
+def render_first_row_template(cnv, first_row, brick_depth, page_notes=True):
+    start_y = 275
+    start_x = 20
+
+    if page_notes:
+        render_page_notes(cnv, start_x=start_x, start_y=start_y)
+
     point1 = (start_x*mm, start_y*mm)
     cnv.drawString(point1[0] + 5, point1[1] - 15, 'A')
 
@@ -500,134 +956,112 @@ def render_first_row_template(cnv, first_row, brick_depth):
         'CD1({})'.format(float_format(get_distance1(point4, point3) / mm)))
 
 
-def build_svg(
-        scale=3.78,  # 1 mm == 1mm
-        brick_width=250.0,
-        brick_height=65.0,
-        brick_depth=120.0,
-        surface_inner_radius=503.0,
-        height=440.0,
-        support_template_step=3,
-        first_row_height=125.0,
-        seam=3.0,
-        door_height=265,
-        bricks_amount=None,
-        minimal_width=40):
-    """Returns svg content of a dome.
+def validate_params(
+        brick_width=250.0, brick_height=65.0, brick_depth=120.0,
+        surface_inner_radius=503.0, height=440.0, first_row_height=125.0,
+        seam=3.0, bricks_amount=None, minimal_width=40, bricks_amounts=None):
+    """Raises ValueError if the dome can't be built from params.
 
-    Args:
-        scale(float, default=3.78): scale of the svg
-        brick_width(float): width of the brick
-        brick_height(float): height of the brick
-        brick_depth(float): depth of the brick
-        surface_inner_radius(float, default=503): 503 is about
-            diameter=42 inches.
-        height(float): height of the dome in the center
-        first_row_height(float): height of the soldier brick from first row
-        seam(float): seam of the masonry
-        bricks_amount(int or None): force bricks amount
-            in the row to that value (if possible)
-        minimal_width(int): if inner brick size is less then
-            that value, brick of the new row will cover 2 bricks
-            from the bottom
+    Only cheap checks are done (no rows are computed), so impossible
+    params are rejected before get_dome_geometry solves anything.
 
-    Returns:
-        str: svg content
+    Args:
+        see build_svg.
 
     """
-
-    # Params verification.
-
-    if not bricks_amount:
+    for name, value in (
+            ('brick_width', brick_width), ('brick_height', brick_height),
+            ('brick_depth', brick_depth),
+            ('surface_inner_radius', surface_inner_radius),
+            ('height', height), ('first_row_height', first_row_height)):
+        if not value > 0:
+            raise ValueError(f'Invalid {name}. Expecting > 0, got {value}.')
+    if not seam >= 0:
+        raise ValueError(f'Invalid seam. Expecting >= 0, got {seam}.')
+    if seam >= brick_height:
         raise ValueError(
-            'Invalid bricks_amount. Expecting > 0.')
-
-    if 100 >= brick_width >= 300:
+            f'Invalid seam. Expecting less than brick_height'
+            f' ({brick_height}), got {seam}.')
+    if minimal_width is not None and minimal_width < 0:
         raise ValueError(
-            'Invalid brick_width. Expecting any from 100 to 300mm')
-
-    if 50 >= brick_height >= 80:
+            f'Invalid minimal_width. Expecting >= 0, got {minimal_width}.')
+    if bricks_amount is not None and bricks_amount < 1:
         raise ValueError(
-            'Invalid brick_height. Expecting any from 50 to 80mm')
-
-    if 100 >= brick_depth >= 150:
+            f'Invalid bricks_amount. Expecting > 0, got {bricks_amount}.')
+    if bricks_amounts is not None and (
+            not bricks_amounts or min(bricks_amounts) < 1):
         raise ValueError(
-            'Invalid brick_depth. Expecting any from 100 to 150mm')
+            'Invalid bricks_amounts. Expecting amounts > 0 for every row.')
 
-    if 300 >= surface_inner_radius >= 800:
+    # Soldier brick is placed by turning at most 1 radian around the
+    # surface circle, see Row.
+    maximal_first_row_height = \
+        brick_height + math.sin(1.0) * (surface_inner_radius + brick_depth)
+    if first_row_height >= maximal_first_row_height:
         raise ValueError(
-            'Invalid inner radius. Expecting any from 300 to 800mm')
-
-    if 125 >= height >= 250:
+            f'Invalid first_row_height. Expecting less than'
+            f' {float_format(maximal_first_row_height)} for'
+            f' surface_inner_radius {surface_inner_radius}, got'
+            f' {first_row_height}.')
+    if first_row_height - brick_height >= height:
         raise ValueError(
-            'Invalid dome height. Expecting any from 125 to 250mm')
+            f'Invalid first_row_height. Soldier row top'
+            f' ({float_format(first_row_height - brick_height)}) must be'
+            f' lower than height ({height}).')
 
-    if 4 >= seam >= 8:
+    if surface_inner_radius <= brick_width / 2.0:
+        raise ValueError(
+            f'Invalid surface_inner_radius. Expecting more than half of'
+            f' brick_width ({float_format(brick_width / 2.0)}), got'
+            f' {surface_inner_radius}.')
+    try:
+        get_inner_profile(
+            surface_inner_radius=surface_inner_radius, height=height,
+            first_row_height=first_row_height, brick_width=brick_width,
+            brick_height=brick_height, brick_depth=brick_depth, seam=seam)
+    except ValueError:
         raise ValueError(
-            'Invalid dome height. Expecting any from 4 to 8mm')
+            'Invalid params. Dome circle through the soldier row and the'
+            ' height does not exist.')
 
-    # Debugging scales.
-    # scale /= 2
-    # scale /= 5
-    # scale /= 10
 
-    elems = [
-        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
-        '''<svg version="1.1"
-                width="1500mm"
-                height="1000mm"
-                xmlns="http://www.w3.org/2000/svg" >''',
-        '<g transform="scale({scale})">'
-    ]
+def get_dome_geometry(
+        brick_width=250.0,
+        brick_height=65.0,
+        brick_depth=120.0,
+        surface_inner_radius=503.0,
+        height=440.0,
+        first_row_height=125.0,
+        seam=3.0,
+        bricks_amount=None,
+        minimal_width=40,
+        bricks_amounts=None,
+        warm_start=None,
+        cancel_token=None):
+    """Computes rows of the dome without rendering svg or pdf.
 
-    warning_part1 = 'Warning: Pre-alfa release of the script. Use it on your own risk, I don\'t'  # noqa: E501
-    warning_part2 = 'guarantee correctness of any value computed here.'
-    elems.append(
-        f'''<text x="100" y="50" font-size="30" fill="brown">
-                {warning_part1}
-            </text>''')
-    elems.append(
-        f'''<text x="100" y="86" font-size="30" fill="brown">
-                {warning_part2}
-            </text>''')
+    Args:
+        see build_svg.
+        warm_start(dict or None): warm_start of the geometry with close
+            params (e.g. previous point of a sweep) to start solvers from.
+            The result is the same, only faster.
+        cancel_token(CancelToken or None): checked by solver loops.
+
+    Returns:
+        DomeGeometry: soldier row and templates of all other rows.
 
+    """
+    validate_params(
+        brick_width=brick_width, brick_height=brick_height,
+        brick_depth=brick_depth, surface_inner_radius=surface_inner_radius,
+        height=height, first_row_height=first_row_height, seam=seam,
+        bricks_amount=bricks_amount, minimal_width=minimal_width,
+        bricks_amounts=bricks_amounts)
     cx = 200 + surface_inner_radius
     cy = 160 + surface_inner_radius
 
-    # Debug output
-    # Inner circle.
-    # elems.append(
-    #     '<circle cx="{}" cy="{}" r="{}" fill="gray" fill-opacity="0.6"/>'
-    #    .format(cx, cy, surface_inner_radius))
-    #
-    # Outer circle
-    # elems.append(
-    #     '<circle cx="{}" cy="{}" r="{}" fill="gray" fill-opacity="0.6"/>'
-    #     .format(cx, cy, surface_inner_radius + brick_width / 2.0))
-
     surface_outer_radius = surface_inner_radius + brick_width / 2.0
-
-    # Draw center line.
-    radian = math.pi / 2.0
-    center_line_x = cx \
-        + (surface_inner_radius + brick_width / 2.0 + 100) \
-        * math.cos(radian)
-    center_line_y = cy \
-        - (surface_inner_radius + brick_width / 2.0 - 70) \
-        * math.sin(radian)
-    elems.append(
-        f'''<line x1="{cx}"
-                  y1="{cy}"
-                  x2="{center_line_x}"
-                  y2="{center_line_y}"
-                  stroke-width="2"
-                  stroke="black" />''')
-
     surface_circle_center_point = Point('SCCP', cx, cy + 100)
-    elems.append(surface_circle_center_point.as_csv(fill='green'))
-
-    radian = math.pi
-    previous_row = None
 
     initial_radian_point = Point(
         'BOP', surface_circle_center_point.x - surface_outer_radius,
@@ -643,35 +1077,66 @@ def build_svg(
         'HI', surface_circle_center_point.x,
         surface_circle_center_point.y - height)
 
-    elems.append(height_inner_point.as_csv())
-    elems.append(
-        Path(height_inner_point, surface_circle_center_point)
-        .as_csv(stroke='green'))
-
     dome_radius, dome_circle_center_point, first_row_outer_top_point = \
         get_dome_inner_radius(
             surface_circle_center_point, surface_inner_radius,
             brick_width=brick_width, brick_height=brick_height,
-            # elems=elems,  # Debug display.
-            first_row_height=first_row_height, height=height)
+            first_row_height=first_row_height, height=height,
+            start_step=warm_start and warm_start['center_step'],
+            cancel_token=cancel_token)
 
     # Find first row position (soldier row).
     first_row_radian_point = Point(
         'FRRP', first_row_outer_top_point.x, initial_radian_point.y)
-    first_row = Row(
-        surface_circle_center_point, surface_inner_radius, radian,
-        first_row_radian_point, 1,
-        vertical=True, outer_height=first_row_height,
-        brick_height=brick_height,
-        bottom_seam=seam, brick_width=brick_width,
-        brick_depth=brick_depth)
-    elems.append(first_row_radian_point.as_csv())
 
-    # Show dome bottom
-    elems.extend(
-        get_floor_elems(
-            first_row, surface_circle_center_point,
-            surface_inner_radius, brick_height, brick_depth))
+    geometry = DomeGeometry(
+        surface_circle_center_point, height_inner_point, height_outer_point,
+        dome_radius, dome_circle_center_point, first_row_radian_point,
+        None, [], brick_width=brick_width, brick_height=brick_height,
+        brick_depth=brick_depth, surface_inner_radius=surface_inner_radius,
+        height=height, first_row_height=first_row_height, seam=seam)
+    return get_dome_geometry_from_center(
+        geometry, brick_depth=brick_depth, seam=seam,
+        bricks_amount=bricks_amount, minimal_width=minimal_width,
+        bricks_amounts=bricks_amounts,
+        top_radian_hint=warm_start and warm_start['top_radian_index'],
+        cancel_token=cancel_token)
+
+
+def get_dome_geometry_from_center(
+        geometry, brick_depth=120.0, seam=3.0, bricks_amount=None,
+        minimal_width=40, bricks_amounts=None, top_radian_hint=None,
+        cancel_token=None):
+    """Returns geometry with the dome circle of the geometry.
+
+    Dome circle doesn't depend on brick depth and seam, so only the
+    soldier row and rows are computed. The geometry is not changed.
+
+    Args:
+        geometry(DomeGeometry): geometry with solved dome circle.
+        brick_depth, seam, bricks_amount, minimal_width, bricks_amounts,
+            cancel_token: see build_svg.
+        top_radian_hint(int or None): see Row.
+
+    Returns:
+        DomeGeometry: soldier row and templates of all other rows.
+    """
+    validate_params(
+        brick_width=geometry.brick_width, brick_height=geometry.brick_height,
+        brick_depth=brick_depth,
+        surface_inner_radius=geometry.surface_inner_radius,
+        height=geometry.height, first_row_height=geometry.first_row_height,
+        seam=seam, bricks_amount=bricks_amount, minimal_width=minimal_width,
+        bricks_amounts=bricks_amounts)
+    dome_circle_center_point = geometry.dome_circle_center_point
+    first_row = Row(
+        geometry.surface_circle_center_point, geometry.surface_inner_radius,
+        math.pi, geometry.first_row_radian_point, 1,
+        vertical=True, outer_height=geometry.first_row_height,
+        brick_height=geometry.brick_height,
+        bottom_seam=seam, brick_width=geometry.brick_width,
+        brick_depth=brick_depth,
+        top_radian_hint=top_radian_hint)
 
     # Cut first row brick by line from outer point to radius center
     line1 = (first_row.top_outer_point, dome_circle_center_point)
@@ -683,61 +1148,56 @@ def build_svg(
         raise ValueError('Lines do not intersect')
     first_row.top_inner_point = intersection_point
 
-    # Debug print:
-    # Line1
-    # elems.append(
-    #    Path(first_row.top_outer_point, dome_circle_center_point)
-    #    .as_csv(stroke='green'))
-    #
-    # Line2
-    # elems.append(
-    #    Path(first_row.bottom_inner_point, first_row.top_inner_point)
-    #    .as_csv(stroke='green'))
-    #
-    # elems.append(
-    #    Path(dome_circle_center_point, height_inner_point)
-    #    .as_csv(stroke='green'))
-    #
-    # elems.append(
-    #    Path(first_row.bottom_inner_point, first_row.top_inner_point)
-    #    .as_csv(stroke='green'))
+    geometry = DomeGeometry(
+        geometry.surface_circle_center_point, geometry.height_inner_point,
+        geometry.height_outer_point, geometry.dome_radius,
+        dome_circle_center_point, geometry.first_row_radian_point,
+        first_row, [], brick_width=geometry.brick_width,
+        brick_height=geometry.brick_height, brick_depth=brick_depth,
+        surface_inner_radius=geometry.surface_inner_radius,
+        height=geometry.height, first_row_height=geometry.first_row_height,
+        seam=seam)
+    geometry.rows = get_row_templates(
+        geometry, bricks_amount=bricks_amount, minimal_width=minimal_width,
+        bricks_amounts=bricks_amounts, cancel_token=cancel_token)
+    return geometry
+
+
+def get_row_templates(
+        geometry, bricks_amount=None, minimal_width=40, bricks_amounts=None,
+        cancel_token=None):
+    """Returns templates of all rows above the soldier one.
+
+    Dome circle and the soldier row of geometry are reused, so it's cheap
+    to recompute rows for other bricks amounts.
 
-    elems.append(
-        Path(first_row.top_inner_point, dome_circle_center_point)
-        .as_csv(stroke='gray', inner_text=True))
+    Args:
+        geometry(DomeGeometry): geometry with solved dome circle.
+        bricks_amount, minimal_width, bricks_amounts, cancel_token: see
+            build_svg.
 
-    #
-    # Prepare and display brick of (vertical/soldier) row.
-    #
-    vertical_brick_elems = get_vertical_brick_elems(first_row)
-    elems.extend(vertical_brick_elems)
+    Returns:
+        list of RowTemplate.
 
-    # Debug:
-    # elems.append(
-    #     Path(first_row.top_inner_point, dome_circle_center_point).as_csv())
-    #
-    # Display dome radius circle
-    # elems.append(
-    #     '''<circle cx="{dome_circle_center_point.x}"
-    #                cy="{dome_circle_center_point.y}"
-    #                r="{dome_radius}"
-    #                stroke-width="3"
-    #                stroke="green"
-    #                fill-opacity="0.6"/>''')
+    """
+    brick_width = geometry.brick_width
+    brick_height = geometry.brick_height
+    brick_depth = geometry.brick_depth
+    seam = geometry.seam
+    dome_radius = geometry.dome_radius
+    dome_circle_center_point = geometry.dome_circle_center_point
+    height_outer_point = geometry.height_outer_point
+    first_row = geometry.first_row
+    previous_row = None
 
-    # first_row_inner_sizes, first_row_seam = split_row(
-    #     first_row, surface_inner_radius, brick_height, seam=seam)
-    # first_row_outer_sizes, first_row_seam = split_row(
-    #     first_row, surface_inner_radius + brick_width / 2.0,
-    #     brick_height, seam=seam)
     y_offset = dome_circle_center_point.y + 100
 
-    # Now compute bricks sizes and create templates pdf.
+    # Now compute bricks sizes.
     # FIXME: Refactor. It's legacy from the version without PDF.
     y_offset += 185
     safety_counter = 0
     rows_counter = 1
-    if bricks_amount is not None:
+    if bricks_amount is not None or bricks_amounts is not None:
         vertical_seam = seam
     else:
         # Actual value will be computed on first row split.
@@ -747,28 +1207,24 @@ def build_svg(
         # amount may be the same all rows except key brick.
         bricks_amount = None
 
-    inner_radius = surface_inner_radius
     dome_outer_radius = dome_radius
     dome_initial_radian, dome_initial_radian_point = get_dome_radius_radian(
         dome_outer_radius, dome_circle_center_point, first_row,
         brick_width=brick_width)
-    # Debug print:
-    # elems.append(dome_initial_radian_point.as_csv())
 
     sizes_row_y_offset = 120
+    rows = []
 
-    cnv = canvas.Canvas('row-templates.pdf')
-    cnv.setTitle(
-        f'Dome bricks templates: inner_radius={inner_radius}, height={height}')
-    cnv.setPageSize(size=A4)
-    # cnv.translate(mm, mm)
-
-    render_first_row_template(cnv, first_row, brick_depth)
+    # Every row takes at least brick_height of the dome quarter circle, so
+    # the loop is bounded by the dome size instead of a constant.
+    max_rows = int(math.pi / 2.0 * dome_radius / brick_height) + 2
 
     while True:
-        if safety_counter >= 100:
+        if safety_counter >= max_rows:
             break
         safety_counter += 1
+        if cancel_token:
+            cancel_token.check()
 
         if previous_row:
             radian_point = previous_row.top_outer_point
@@ -787,224 +1243,3628 @@ def build_svg(
             # All rows finished. Next is key brick.
             break
 
-        row_instance = Row(
-            dome_circle_center_point, inner_radius,
-            radian, radian_point, rows_counter,
-            vertical=False, brick_height=brick_height,
-            outer_height=brick_height,
-            bottom_seam=seam, brick_width=brick_width)
-        # elems.append(row_instance.bottom_radian_point.as_csv())
+        row_instance = Row(
+            dome_circle_center_point, inner_radius,
+            radian, radian_point, rows_counter,
+            vertical=False, brick_height=brick_height,
+            outer_height=brick_height,
+            bottom_seam=seam, brick_width=brick_width)
+
+        horizontal_outer_top_distance_point = Point(
+            f'{rows_counter}', dome_circle_center_point.x,
+            row_instance.top_outer_point.y)
+
+        row_initial_y = y_offset
+        y_offset += 450
+
+        #
+        # Prepare cut schemes (sizes and angle)
+        #
+        horizontal_distance_bottom_point = Point(
+            f'#{rows_counter}', dome_circle_center_point.x,
+            row_instance.bottom_outer_point.y)
+        horizontal_bottom_outer_radius = get_distance(
+            row_instance.bottom_outer_point, horizontal_distance_bottom_point)
+
+        if bricks_amounts is not None:
+            # Rows after the last amount keep it.
+            bricks_amount = bricks_amounts[
+                min(rows_counter - 2, len(bricks_amounts) - 1)]
+
+        if rows_counter == 2 and bricks_amount is None:
+            # Compute bricks amount and vertical seam for second
+            # (first after soldier) row only. All other rows will
+            # have the same amount of bricks (and seams)
+            bricks, vertical_seam = split_row(
+                row_instance, horizontal_bottom_outer_radius,
+                bottom_outer_width, seam=seam)
+            bricks_amount = len(bricks)
+
+        top_sizes_x_offset = 80
+        a_point = Point(
+            'A', top_sizes_x_offset,
+            row_initial_y + sizes_row_y_offset)
+
+        if rows_counter > 1:
+            # For first row bottom outer side is known
+            # (brick_depth), compute it for others.
+            horizontal_outer_bottom_distance_point = Point(
+                '#{rows_counter}', dome_circle_center_point.x,
+                row_instance.bottom_outer_point.y)
+            horizontal_outer_bottom_radius = get_distance(
+                row_instance.bottom_outer_point,
+                horizontal_outer_bottom_distance_point)
+            horizontal_outer_bottom_circumference = 2 \
+                * math.pi \
+                * horizontal_outer_bottom_radius
+            bottom_outer_width = round(
+                horizontal_outer_bottom_circumference / bricks_amount - vertical_seam,  # noqa: E501
+                1)
+
+        b_point = Point(
+            'B', top_sizes_x_offset + bottom_outer_width,
+            row_initial_y + sizes_row_y_offset)
+
+        ab_center = top_sizes_x_offset + abs(a_point.x - b_point.x) / 2
+
+        # Compute bottom inner side.
+        horizontal_inner_bottom_distance_point = Point(
+            '#{rows_counter}', dome_circle_center_point.x,
+            row_instance.bottom_inner_point.y)
+        horizontal_bottom_inner_radius = get_distance(
+            row_instance.bottom_inner_point,
+            horizontal_inner_bottom_distance_point)
+        horizontal_bottom_inner_circumference = 2 \
+            * math.pi \
+            * horizontal_bottom_inner_radius
+        bottom_inner_side = round(
+            horizontal_bottom_inner_circumference / bricks_amount - vertical_seam,  # noqa: E501
+            1)
+        c_point = Point(
+            'C', ab_center + bottom_inner_side / 2,
+            row_initial_y + sizes_row_y_offset + brick_width / 2.0)
+
+        d_point = Point(
+            'D', ab_center - bottom_inner_side / 2,
+            row_initial_y + sizes_row_y_offset + brick_width / 2.0)
+
+        # Template top face.
+        horizontal_top_outer_radius = get_distance(
+            row_instance.top_outer_point,
+            horizontal_outer_top_distance_point)
+        horizontal_outer_top_circumference = \
+            2 \
+            * math.pi \
+            * horizontal_top_outer_radius
+        top_outer_side = round(
+            horizontal_outer_top_circumference / bricks_amount - vertical_seam,
+            1)
+
+        # Bottom sizes (for verification after marking)
+        bottom_sizes_x_offset = 650
+        e_point = Point(
+            'E', bottom_sizes_x_offset,
+            row_initial_y + sizes_row_y_offset)
+        f_point = Point(
+            'F', bottom_sizes_x_offset + top_outer_side,
+            row_initial_y + sizes_row_y_offset)
+
+        #
+        horizontal_inner_top_distance_point = Point(
+            f'#{rows_counter}', dome_circle_center_point.x,
+            row_instance.top_inner_point.y)
+        horizontal_top_inner_radius = get_distance(
+            row_instance.top_inner_point, horizontal_inner_top_distance_point)
+        horizontal_top_inner_circumference = \
+            2 \
+            * math.pi \
+            * horizontal_top_inner_radius
+        top_inner_side = round(
+            horizontal_top_inner_circumference / bricks_amount - vertical_seam,
+            1)
+
+        ef_center = bottom_sizes_x_offset + abs(e_point.x - f_point.x) / 2
+
+        g_point = Point(
+            'G', ef_center + top_inner_side / 2,
+            row_initial_y + sizes_row_y_offset + brick_width / 2.0)
+
+        h_point = Point(
+            'H', ef_center - top_inner_side / 2,
+            row_initial_y + sizes_row_y_offset + brick_width / 2.0)
+
+        # End of paper template.
+
+        outer_height = brick_height
+        inner_height = get_distance(
+            row_instance.top_inner_point,
+            row_instance.bottom_inner_point)
+
+        inner_outer_diff = outer_height - inner_height
+
+        rows.append(
+            RowTemplate(
+                row_instance, bricks_amount, vertical_seam,
+                a_point, b_point, c_point, d_point,
+                e_point, f_point, g_point, h_point,
+                inner_outer_diff, horizontal_top_outer_radius))
+
+        # FIXME: This is not correct. It should compare
+        # h_point-g_point < minimal_width for the next row, not for current.
+        # See optimize_bricks_amounts for amounts computed with lookahead.
+        if bricks_amounts is None and bricks_amount % 2 == 0 \
+                and get_distance(h_point, g_point) < minimal_width + 5:
+            # Brick is too small, new row will contain
+            # larger bricks that will cover 2 bottom bricks.
+            bricks_amount = bricks_amount / 2
+
+        # Switch to next row.
+        previous_row = row_instance
+        if horizontal_top_outer_radius <= brick_width / 2.0:
+            # The radius is less then brick length. Further are key bricks.
+            break
+
+    return rows
+
+
+def get_template_renderers(geometry):
+    """Returns functions rendering every template of the pdf.
+
+    Every function takes canvas and draws one template at its default
+    position, without page notes and page breaks.
+    """
+    renderers = []
+    renderers.append(lambda cnv: render_first_row_template(
+        cnv, geometry.first_row, geometry.brick_depth, page_notes=False))
+
+    # The row above first row is known, so add soldier row constriction.
+    template = geometry.rows[0]
+    outer_size = get_distance(template.a_point, template.b_point) \
+        / 2.0 - template.vertical_seam
+    inner_size = get_distance(template.c_point, template.d_point) \
+        / 2.0 - template.vertical_seam
+    renderers.append(lambda cnv: render_row_constriction_template(
+        cnv, outer_size, inner_size, geometry.brick_depth,
+        'Row1',
+        start_y=100))
+
+    def get_row_renderer(template):
+        return lambda cnv: render_row_brick_template(
+            cnv, round(template.bricks_amount, 1),
+            template.a_point, template.b_point,
+            template.c_point, template.d_point,
+            template.e_point, template.f_point,
+            template.g_point, template.h_point,
+            row_number=template.number,
+            brick_height=geometry.brick_height,
+            brick_width=geometry.brick_width,
+            inner_outer_diff=template.inner_outer_diff,
+            vertical_seam=template.vertical_seam,
+            show_page=False)
+
+    for template in geometry.rows:
+        renderers.append(get_row_renderer(template))
+
+    row_instance = geometry.last_row
+    last_outer_size = get_distance(
+        row_instance.top_outer_point, row_instance.bottom_outer_point)
+    last_inner_size = get_distance(
+        row_instance.top_inner_point, row_instance.bottom_inner_point)
+    renderers.append(lambda cnv: render_row_constriction_template(
+        cnv, last_outer_size, last_inner_size, geometry.brick_width / 2.0,
+        'All except first'))
+    return renderers
+
+
+def pack_rectangles(sizes, bin_width, bin_height, spacing=0):
+    """Packs rectangles to the least amount of bins.
+
+    Uses MaxRects algorithm with best short side fit, larger rectangles
+    are placed first. Rectangles are not rotated.
+
+    Args:
+        sizes(list): (width, height) of every rectangle.
+        bin_width(float): width of the bin.
+        bin_height(float): height of the bin.
+        spacing(float): minimal distance between rectangles.
+
+    Returns:
+        list of tuple(bin index, x, y): bottom left corner of every
+            rectangle, in the order of sizes.
+    """
+    # Every rectangle takes spacing on its right and top sides, so extend
+    # the bin to allow rectangles to touch its right and top sides.
+    bin_width += spacing
+    bin_height += spacing
+    bins = []  # Free rectangles (x, y, width, height) of every bin.
+    placements = [None] * len(sizes)
+
+    order = sorted(
+        range(len(sizes)),
+        key=lambda i: (-max(sizes[i]), -sizes[i][0] * sizes[i][1]))
+    for i in order:
+        width = sizes[i][0] + spacing
+        height = sizes[i][1] + spacing
+        if width > bin_width or height > bin_height:
+            raise ValueError(
+                f'Rectangle {sizes[i]} does not fit to {bin_width - spacing}'
+                f'x{bin_height - spacing} bin.')
+
+        best = None
+        for bin_index, free in enumerate(bins):
+            for x, y, free_width, free_height in free:
+                if width > free_width or height > free_height:
+                    continue
+                score = (min(free_width - width, free_height - height),
+                         max(free_width - width, free_height - height))
+                if best is None or score < best[0]:
+                    best = (score, bin_index, x, y)
+        if best is None:
+            bins.append([(0, 0, bin_width, bin_height)])
+            best = (None, len(bins) - 1, 0, 0)
+        _, bin_index, x, y = best
+        placements[i] = (bin_index, x, y)
+
+        # Split free rectangles intersecting with the placed one.
+        free = []
+        for fx, fy, fw, fh in bins[bin_index]:
+            if x >= fx + fw or x + width <= fx \
+                    or y >= fy + fh or y + height <= fy:
+                free.append((fx, fy, fw, fh))
+                continue
+            if x > fx:
+                free.append((fx, fy, x - fx, fh))
+            if x + width < fx + fw:
+                free.append((x + width, fy, fx + fw - x - width, fh))
+            if y > fy:
+                free.append((fx, fy, fw, y - fy))
+            if y + height < fy + fh:
+                free.append((fx, y + height, fw, fy + fh - y - height))
+
+        # Remove free rectangles contained by other ones.
+        bins[bin_index] = [
+            a for i, a in enumerate(free)
+            if not any(
+                j != i
+                and b[0] <= a[0] and b[1] <= a[1]
+                and a[0] + a[2] <= b[0] + b[2]
+                and a[1] + a[3] <= b[1] + b[3]
+                and (a != b or j < i)
+                for j, b in enumerate(free))]
+    return placements
+
+
+def render_templates_pdf(
+        geometry, filename='row-templates.pdf', imposition=False,
+        cancel_token=None):
+    """Renders templates of all rows to the pdf file.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        filename(str or file): pdf file name or binary file object.
+        imposition(bool): pack templates to as few pages as possible
+            instead of page per row. Scale is the same.
+        cancel_token(CancelToken or None): checked before every template.
+
+    """
+    cnv = canvas.Canvas(filename)
+    cnv.setTitle(
+        f'Dome bricks templates: inner_radius={geometry.surface_inner_radius}, height={geometry.height}')  # noqa: E501
+    cnv.setPageSize(size=A4)
+    # cnv.translate(mm, mm)
+
+    renderers = get_template_renderers(geometry)
+
+    if not imposition:
+        render_page_notes(cnv)
+        first_row_renderer, row1_renderer = renderers[:2]
+        first_row_renderer(cnv)
+        row1_renderer(cnv)
+        cnv.showPage()
+        for row_renderer in renderers[2:-1]:
+            if cancel_token:
+                cancel_token.check()
+            row_renderer(cnv)
+            cnv.showPage()
+        renderers[-1](cnv)
+        cnv.save()
+        return
+
+    # Page notes are rendered on every page, the rest of the page
+    # is free for templates.
+    area_left, area_bottom = 8*mm, 12*mm
+    area_right, area_top = A4[0] - 8*mm, A4[1] - 14*mm
+    spacing = 5*mm
+
+    bounds = []
+    for renderer in renderers:
+        bounds_canvas = BoundsCanvas()
+        renderer(bounds_canvas)
+        bounds.append(bounds_canvas.bounds)
+    placements = pack_rectangles(
+        [(x[2] - x[0], x[3] - x[1]) for x in bounds],
+        area_right - area_left, area_top - area_bottom, spacing=spacing)
+
+    # Every sheet has the same page notes, so they are stored once and
+    # referenced from every page.
+    cnv.beginForm('page-notes')
+    render_page_notes(cnv)
+    cnv.endForm()
+
+    pages = max(x[0] for x in placements) + 1
+    for page in range(pages):
+        cnv.doForm('page-notes')
+        for renderer, bound, (page_index, x, y) in zip(
+                renderers, bounds, placements):
+            if page_index != page:
+                continue
+            if cancel_token:
+                cancel_token.check()
+            cnv.saveState()
+            cnv.translate(area_left + x - bound[0], area_bottom + y - bound[1])
+            renderer(cnv)
+            cnv.restoreState()
+        cnv.showPage()
+    cnv.save()
+
+
+def get_brick_volume(ab, cd, ef, gh, outer_height, inner_height, depth):
+    """Returns volume of the row brick cut by A-H template.
+
+    Width of the brick changes linearly from the outer side to the inner
+    one, as well as its height. So the volume is exact with Simpson's rule
+    over the depth of the wall.
+    """
+    outer_area = (ab + ef) / 2.0 * outer_height
+    inner_area = (cd + gh) / 2.0 * inner_height
+    middle_area = ((ab + cd) / 2.0 + (ef + gh) / 2.0) / 2.0 \
+        * (outer_height + inner_height) / 2.0
+    return depth / 6.0 * (outer_area + 4 * middle_area + inner_area)
+
+
+def get_floor_layout(radius, brick_width, brick_depth, seam=3, strips=32):
+    """Returns bricks of the round floor laid flat in a grid.
+
+    Bricks lie brick_width along x and brick_depth along y with seams
+    between them, one brick is centered on the dome axis. Bricks crossing
+    the edge are cut to the circle.
+
+    Args:
+        radius(float): radius of the floor (mm).
+        brick_width, brick_depth(float): brick size (mm).
+        seam(float): seam between floor bricks (mm).
+        strips(int): amount of strips the area of a cut brick inside the
+            circle is integrated over.
+
+    Returns:
+        dict: `whole` and `cut` amounts of bricks, `cut_area` (area of
+            cut pieces left in the floor, mm2).
+    """
+    def get_half_chord(x):
+        return math.sqrt(max(0.0, radius ** 2 - x ** 2))
+
+    whole = cut = 0
+    cut_area = 0.0
+    columns = int(math.ceil(radius / (brick_width + seam))) + 1
+    rows = int(math.ceil(radius / (brick_depth + seam))) + 1
+    for i in range(-columns, columns + 1):
+        x0 = i * (brick_width + seam) - brick_width / 2.0
+        x1 = x0 + brick_width
+        for j in range(-rows, rows + 1):
+            y0 = j * (brick_depth + seam) - brick_depth / 2.0
+            y1 = y0 + brick_depth
+            near_x = min(max(0.0, x0), x1)
+            near_y = min(max(0.0, y0), y1)
+            if math.hypot(near_x, near_y) >= radius:
+                continue
+            if math.hypot(max(abs(x0), abs(x1)), max(abs(y0), abs(y1))) \
+                    <= radius:
+                whole += 1
+                continue
+            cut += 1
+            # Midpoint rule over strips of the brick inside the circle.
+            left = max(x0, -radius)
+            width = (min(x1, radius) - left) / strips
+            for k in range(strips):
+                half_chord = get_half_chord(left + (k + 0.5) * width)
+                cut_area += width * max(
+                    0.0, min(y1, half_chord) - max(y0, -half_chord))
+    return {'whole': whole, 'cut': cut, 'cut_area': cut_area}
+
+
+def get_bill_of_materials(
+        geometry, brick_density=2000.0, mortar_density=2100.0,
+        floor_gap=8, floor_seam=3):
+    """Returns bricks, volumes and mass needed to build the dome.
+
+    Volumes are computed from the geometry only, so it's cheap to call
+    for every design of a parameter sweep. Every row except soldier one is
+    cut from half of the brick (depth of the dome wall is brick_width / 2),
+    so two pieces come from one stock brick.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        brick_density(float): brick density (kg/m3).
+        mortar_density(float): mortar density (kg/m3).
+        floor_gap(float): gap between floor and soldier bricks (mm).
+        floor_seam(float): seam between floor bricks (mm), see
+            get_floor_layout.
+
+    Returns:
+        dict: `rows` (list of dicts with number, bricks, stock_bricks,
+            brick_volume, waste_volume and mortar_volume per row) and totals
+            (bricks, stock_bricks, brick_volume, waste_volume, mortar_volume,
+            mass), `floor` totals are the same for the get_floor_layout
+            grid. Volumes are in mm3, mass in kg. Waste is negative if the
+            template doesn't fit in the stock brick.
+
+    """
+    brick_width = geometry.brick_width
+    brick_height = geometry.brick_height
+    brick_depth = geometry.brick_depth
+    seam = geometry.seam
+    stock_volume = brick_width * brick_height * brick_depth
+    bom_rows = []
+
+    # Soldier row. Brick stands on its end: brick_depth is the depth of the
+    # wall and brick_height is the width along the circumference.
+    first_row = geometry.first_row
+    soldier_outer_height = \
+        first_row.bottom_outer_point.y - first_row.top_outer_point.y
+    soldier_inner_height = \
+        first_row.bottom_inner_point.y - first_row.top_inner_point.y
+    soldier_mean_height = (soldier_outer_height + soldier_inner_height) / 2.0
+    soldier_bricks = get_soldier_bricks_amount(geometry)
+    soldier_volume = brick_depth * soldier_mean_height * brick_height
+    # Low soldier bricks may be cut from the same stock brick.
+    soldiers_per_stock = max(1, int(brick_width // soldier_outer_height))
+    soldier_stock_bricks = int(math.ceil(soldier_bricks / soldiers_per_stock))
+    soldier_mortar = soldier_bricks * seam * brick_depth \
+        * (soldier_mean_height + brick_height)
+    bom_rows.append({
+        'number': first_row.number,
+        'bricks': soldier_bricks,
+        'stock_bricks': soldier_stock_bricks,
+        'brick_volume': soldier_bricks * soldier_volume,
+        'waste_volume':
+            soldier_stock_bricks * stock_volume
+            - soldier_bricks * soldier_volume,
+        'mortar_volume': soldier_mortar,
+    })
+
+    # Dome rows.
+    depth = brick_width / 2.0
+    for template in geometry.rows:
+        bricks = int(template.bricks_amount)
+        ab = template.bottom_outer_width
+        cd = template.bottom_inner_width
+        ef = template.top_outer_width
+        gh = template.top_inner_width
+        outer_height = template.outer_height
+        inner_height = template.inner_height
+        brick_volume = get_brick_volume(
+            ab, cd, ef, gh, outer_height, inner_height, depth)
+
+        stock_bricks = int(math.ceil(bricks / 2.0))
+        bed_mortar = seam * depth \
+            * ((ab + cd) / 2.0 + template.vertical_seam)
+        vertical_mortar = template.vertical_seam * depth \
+            * (outer_height + inner_height) / 2.0
+        bom_rows.append({
+            'number': template.number,
+            'bricks': bricks,
+            'stock_bricks': stock_bricks,
+            'brick_volume': bricks * brick_volume,
+            'waste_volume':
+                stock_bricks * stock_volume - bricks * brick_volume,
+            'mortar_volume': bricks * (bed_mortar + vertical_mortar),
+        })
+
+    # Floor bricks lay flat inside the soldier row (see get_floor_elems),
+    # every cut brick is taken from its own stock brick.
+    floor_radius = geometry.surface_inner_radius - floor_gap
+    layout = get_floor_layout(
+        floor_radius, brick_width, brick_depth, seam=floor_seam)
+    floor_bricks = layout['whole'] + layout['cut']
+    floor_area = layout['whole'] * brick_width * brick_depth \
+        + layout['cut_area']
+    floor = {
+        'bricks': floor_bricks,
+        'stock_bricks': floor_bricks,
+        'brick_volume': floor_area * brick_height,
+        'waste_volume':
+            floor_bricks * stock_volume - floor_area * brick_height,
+        'mortar_volume':
+            (math.pi * floor_radius ** 2 - floor_area) * brick_height,
+    }
+
+    totals = {}
+    for key in ('bricks', 'stock_bricks', 'brick_volume', 'waste_volume',
+                'mortar_volume'):
+        totals[key] = sum(x[key] for x in bom_rows) + floor[key]
+    totals['mass'] = (
+        totals['brick_volume'] * brick_density
+        + totals['mortar_volume'] * mortar_density) / 1e9
+
+    return {'rows': bom_rows, 'floor': floor, 'totals': totals}
+
+
+def format_bill_of_materials(bom):
+    """Returns bill of materials as a text table."""
+    lines = [
+        '{:>6} {:>7} {:>6} {:>12} {:>12} {:>12}'.format(
+            'row', 'bricks', 'stock', 'volume(l)', 'waste(l)', 'mortar(l)')]
+    rows = [(f'#{x["number"]}', x) for x in bom['rows']]
+    rows.append(('floor', bom['floor']))
+    rows.append(('total', bom['totals']))
+    for title, row in rows:
+        lines.append('{:>6} {:>7} {:>6} {:>12} {:>12} {:>12}'.format(
+            title, row['bricks'], row['stock_bricks'],
+            float_format(row['brick_volume'] / 1e6),
+            float_format(row['waste_volume'] / 1e6),
+            float_format(row['mortar_volume'] / 1e6)))
+    lines.append('mass: {} kg'.format(float_format(bom['totals']['mass'])))
+    return '\n'.join(lines)
+
+
+def optimize_bricks_amounts(
+        geometry, minimal_width=40, maximal_width=None, objective='waste',
+        first_bricks_amount=None):
+    """Returns bricks amount of every row chosen with lookahead.
+
+    Rows positions don't depend on bricks amount, so amounts of all rows
+    are chosen together with dynamic programming over rows. Bricks amount
+    of the row equals to the amount of the row below or to its half, so
+    every seam is covered with brick of the next row.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        minimal_width(float): minimal inner (GH) width of the brick.
+        maximal_width(float or None): maximal outer (AB, EF) width of the
+            brick, brick_depth by default.
+        objective(str): `waste` to minimize stock volume cut off,
+            `cuts` to minimize amount of cut bricks. Less changes of
+            bricks amount are preferred for the same objective.
+        first_bricks_amount(int or None): force amount of the first row.
+
+    Returns:
+        list of int: bricks amount for every row of geometry.rows, to
+            be used as bricks_amounts of get_dome_geometry.
+
+    """
+    if objective not in ('waste', 'cuts'):
+        raise ValueError(
+            'Invalid objective. Expecting `waste` or `cuts`.')
+    if maximal_width is None:
+        maximal_width = geometry.brick_depth
+    seam = geometry.seam
+    depth = geometry.brick_width / 2.0
+    stock_volume = geometry.brick_width * geometry.brick_height \
+        * geometry.brick_depth
+    axis_x = geometry.dome_circle_center_point.x
+
+    def get_radius(point):
+        return get_distance(point, Point('', axis_x, point.y))
+
+    def get_width(radius, amount):
+        return round(2 * math.pi * radius / amount - seam, 1)
+
+    states = None  # bricks amount -> (cost, changes, amounts)
+    for template in geometry.rows:
+        row = template.row
+        bottom_outer, bottom_inner, top_outer, top_inner = [
+            get_radius(x) for x in (
+                row.bottom_outer_point, row.bottom_inner_point,
+                row.top_outer_point, row.top_inner_point)]
+        if states is None:
+            if first_bricks_amount:
+                candidates = [first_bricks_amount]
+            else:
+                # Narrower bricks are skipped below, widths are rounded to
+                # 0.1 mm.
+                candidates = range(1, int(
+                    2 * math.pi * bottom_outer
+                    / (max(minimal_width, 0.1) + seam)) + 1)
+        else:
+            candidates = set(states)
+            candidates.update(x // 2 for x in states if x % 2 == 0)
+
+        new_states = {}
+        for amount in sorted(candidates):
+            ab = get_width(bottom_outer, amount)
+            cd = get_width(bottom_inner, amount)
+            ef = get_width(top_outer, amount)
+            gh = get_width(top_inner, amount)
+            if min(ab, cd, ef, gh) < minimal_width \
+                    or max(ab, cd, ef, gh) > maximal_width:
+                continue
+
+            if objective == 'cuts':
+                cost = amount
+            else:
+                cost = int(math.ceil(amount / 2.0)) * stock_volume \
+                    - amount * get_brick_volume(
+                        ab, cd, ef, gh, template.outer_height,
+                        template.inner_height, depth)
+
+            if states is None:
+                new_states[amount] = (cost, 0, [amount])
+                continue
+            best = None
+            for previous in (amount, amount * 2):
+                if previous not in states:
+                    continue
+                previous_cost, changes, amounts = states[previous]
+                state = (previous_cost + cost,
+                         changes + int(previous != amount),
+                         amounts + [amount])
+                if best is None or state[:2] < best[:2]:
+                    best = state
+            if best is not None:
+                new_states[amount] = best
+        if not new_states:
+            raise ValueError(
+                f'Could not find bricks amount for row #{template.number}'
+                f' with brick width from {minimal_width} to'
+                f' {maximal_width}mm.')
+        states = new_states
+
+    return min(states.values(), key=lambda x: x[:2])[2]
+
+
+def evaluate_design(design, warm_start=None):
+    """Returns metrics of the design or None if it can't be built.
+
+    Args:
+        design(dict): get_dome_geometry params except bricks amounts,
+            minimal_width and minimal_seam_offset (optional). Bricks amount
+            of every row is chosen with optimize_bricks_amounts. Designs
+            failing verify_rows with minimal_seam_offset are not built.
+        warm_start(dict or None): see get_dome_geometry.
+
+    Returns:
+        dict or None: design params with `bricks_amounts`, `bricks`,
+            `waste_volume`, `templates` (distinct cut templates including
+            soldier one), `key_size` (diameter of the opening for key
+            bricks), `unsafe_rows` (rows with thrust line out of the
+            middle third, see get_thrust_line), `warm_start` (of the
+            geometry, to evaluate the next similar design from) and
+            `row_sizes` (cut sizes of every row, see get_row_sizes).
+    """
+    params = dict(design)
+    minimal_width = params.pop('minimal_width', 40)
+    minimal_seam_offset = params.pop('minimal_seam_offset', None)
+    try:
+        geometry = get_dome_geometry(
+            bricks_amount=1, warm_start=warm_start, **params)
+        bricks_amounts = optimize_bricks_amounts(
+            geometry, minimal_width=minimal_width)
+    except (ValueError, RuntimeError):
+        return None
+    geometry.rows = get_row_templates(geometry, bricks_amounts=bricks_amounts)
+    if minimal_seam_offset is not None and verify_rows(
+            geometry, minimal_offset=minimal_seam_offset):
+        return None
+    bom = get_bill_of_materials(geometry)
+    templates = set(
+        (x.bottom_outer_width, x.bottom_inner_width, x.top_outer_width,
+         x.top_inner_width) for x in geometry.rows)
+
+    result = dict(design)
+    result.update({
+        'bricks_amounts': bricks_amounts,
+        'bricks': bom['totals']['bricks'],
+        'waste_volume': bom['totals']['waste_volume'],
+        'templates': len(templates) + 1,
+        'key_size': 2 * geometry.rows[-1].horizontal_top_outer_radius,
+        'unsafe_rows': len([
+            x for x in get_thrust_line(geometry)['rows'] if not x['inside']]),
+        'warm_start': geometry.warm_start,
+        'row_sizes': [{
+            'number': x.number,
+            'bricks_amount': x.bricks_amount,
+            'ab': x.bottom_outer_width,
+            'cd': x.bottom_inner_width,
+            'ef': x.top_outer_width,
+            'gh': x.top_inner_width,
+            'outer_height': x.outer_height,
+            'inner_height': x.inner_height,
+            'bevel_angle': x.bevel_angle,
+        } for x in geometry.rows],
+    })
+    return result
+
+
+def evaluate_designs(designs):
+    """Returns evaluate_design results of the designs.
+
+    Every design is started from the warm start of the previous one, so
+    neighbours should differ a little (see get_snake_product).
+    """
+    results = []
+    warm_start = None
+    for design in designs:
+        result = evaluate_design(design, warm_start=warm_start)
+        if result is not None:
+            warm_start = result['warm_start']
+        results.append(result)
+    return results
+
+
+def get_snake_product(*iterables):
+    """Yields itertools.product in the snake (boustrophedon) order.
+
+    Every inner iterable goes back and forth, so neighbouring tuples
+    differ in one item, e.g. (0, 0), (0, 1), (1, 1), (1, 0).
+    """
+    pools = [list(x) for x in iterables]
+
+    def get_tuples(depth, position):
+        # position is the order of the prefix among prefixes of the same
+        # length, inner values of odd prefixes go backwards.
+        if depth == len(pools):
+            yield ()
+            return
+        values = pools[depth] if position % 2 == 0 else pools[depth][::-1]
+        for index, value in enumerate(values):
+            for rest in get_tuples(
+                    depth + 1, position * len(values) + index):
+                yield (value,) + rest
+
+    return get_tuples(0, 0)
+
+
+def get_pareto_front(
+        results, keys=('bricks', 'waste_volume', 'templates', 'key_size')):
+    """Returns results not dominated by any other result.
+
+    All keys are minimized.
+    """
+    front = []
+    for result in sorted(results, key=lambda x: [x[k] for k in keys]):
+        values = [result[k] for k in keys]
+        dominated = False
+        for other in front:
+            other_values = [other[k] for k in keys]
+            if all(a <= b for a, b in zip(other_values, values)):
+                # Sorted order guarantees other is not worse anywhere, so
+                # equal values are dominated too.
+                dominated = True
+                break
+        if not dominated:
+            front.append(result)
+    return front
+
+
+def search_designs(
+        catalog, surface_inner_radius, heights, first_row_heights=(125.0,),
+        seams=(3.0,), minimal_width=40, minimal_seam_offset=None,
+        processes=None):
+    """Returns Pareto front of designs for every brick of the catalog.
+
+    Every combination of brick format, height, first row height and seam
+    is evaluated with evaluate_designs in a process pool.
+
+    Args:
+        catalog(list): (brick_width, brick_height, brick_depth) of
+            available bricks.
+        surface_inner_radius(float): inner radius of the dome.
+        heights(list): dome heights to try.
+        first_row_heights(list): soldier row heights to try.
+        seams(list): seams to try.
+        minimal_width(float): see optimize_bricks_amounts.
+        minimal_seam_offset(float or None): skip designs with seams of
+            adjacent rows closer than that, see verify_rows.
+        processes(int or None): amount of worker processes, cpu count by
+            default. Designs are evaluated in current process if 1.
+
+    Returns:
+        list of dict: see evaluate_design.
+
+    """
+    loops = (catalog, heights, first_row_heights, seams)
+    designs = []
+    for brick, height, first_row_height, seam in get_snake_product(*loops):
+        brick_width, brick_height, brick_depth = brick
+        designs.append({
+            'brick_width': brick_width,
+            'brick_height': brick_height,
+            'brick_depth': brick_depth,
+            'surface_inner_radius': surface_inner_radius,
+            'height': height,
+            'first_row_height': first_row_height,
+            'seam': seam,
+            'minimal_width': minimal_width,
+            'minimal_seam_offset': minimal_seam_offset,
+        })
+
+    return get_pareto_front(
+        [x for x in evaluate_all_designs(designs, processes=processes)
+         if x is not None])
+
+
+def evaluate_all_designs(designs, processes=None):
+    """Returns evaluate_design results of the designs in a process pool.
+
+    Designs are evaluated in contiguous chunks with evaluate_designs, so
+    they should be ordered with small steps (e.g. get_snake_product) to
+    start every design from the warm start of its neighbour.
+
+    Args:
+        designs(list): see evaluate_design.
+        processes(int or None): amount of worker processes, cpu count by
+            default. Designs are evaluated in current process if 1.
+
+    Returns:
+        list: evaluate_design result for every design.
+    """
+    chunks_amount = 1 if processes == 1 else 4 * (processes or 4)
+    chunksize = max(1, -(-len(designs) // chunks_amount))
+    chunks = [designs[i:i + chunksize]
+              for i in range(0, len(designs), chunksize)]
+    if processes == 1:
+        results = [evaluate_designs(x) for x in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(evaluate_designs, chunks))
+    return list(itertools.chain.from_iterable(results))
+
+
+def parse_values(value):
+    """Returns list of floats from `1,2,3` or `start:stop:step` string."""
+    if ':' in value:
+        start, stop, step = [float(x) for x in value.split(':')]
+        values = []
+        while start <= stop + 1e-9:
+            values.append(start)
+            start += step
+        return values
+    return [float(x) for x in value.split(',')]
+
+
+def parse_catalog(value):
+    """Returns bricks from `250x65x120,230x65x114` string."""
+    return [tuple(float(x) for x in brick.split('x'))
+            for brick in value.split(',')]
+
+
+def format_designs(designs):
+    """Returns designs as a text table."""
+    line_format = '{:>13} {:>7} {:>9} {:>6} {:>7} {:>8} {:>10} {:>10} {:>5}'
+    lines = [line_format.format(
+        'brick', 'height', 'first_row', 'seam', 'bricks', 'waste(l)',
+        'templates', 'key_size', 'rows')]
+    for design in designs:
+        lines.append(line_format.format(
+            '{:g}x{:g}x{:g}'.format(
+                design['brick_width'], design['brick_height'],
+                design['brick_depth']),
+            '{:g}'.format(design['height']),
+            '{:g}'.format(design['first_row_height']),
+            '{:g}'.format(design['seam']),
+            design['bricks'], float_format(design['waste_volume'] / 1e6),
+            design['templates'], float_format(design['key_size']),
+            len(design['bricks_amounts']) + 1))
+    return '\n'.join(lines)
+
+
+SURROGATE_MAGIC = b'DOMESRG1'
+SURROGATE_HEADER = '<8s6I'
+SURROGATE_METRICS = ('rows', 'bricks', 'key_size')
+
+
+def get_surrogate_metrics(result):
+    """Returns SURROGATE_METRICS of evaluate_design result (NaN if None)."""
+    if result is None:
+        return [math.nan] * len(SURROGATE_METRICS)
+    return [
+        len(result['bricks_amounts']) + 1, result['bricks'],
+        result['key_size']]
+
+
+def build_surrogate(
+        catalog, radii, heights, first_row_heights, seam=3.0,
+        minimal_width=40, validation_samples=100, seed=None,
+        processes=None):
+    """Returns binary table of exact designs to interpolate them.
+
+    Every combination of brick format, inner radius, height and first row
+    height is evaluated with evaluate_design. Then designs at random
+    points between the grid nodes are evaluated and compared with the
+    interpolation to get the error bound (see Surrogate.error).
+
+    The table is SURROGATE_HEADER (magic, amounts of formats, radii,
+    heights, first row heights, metrics and validation samples) followed
+    by float64 arrays: seam, minimal width, error of every metric,
+    catalog, radii, heights, first row heights and metrics of every
+    design (NaN if it can't be built) in that loops order.
+
+    Args:
+        catalog(list): (brick_width, brick_height, brick_depth) of
+            available bricks.
+        radii(list): inner radii, ascending.
+        heights(list): dome heights, ascending.
+        first_row_heights(list): soldier row heights, ascending.
+        seam(float): masonry seam.
+        minimal_width(float): see optimize_bricks_amounts.
+        validation_samples(int): amount of random designs to measure
+            the error of the interpolation with.
+        seed: seed of random validation designs.
+        processes(int or None): see evaluate_all_designs.
+
+    Returns:
+        bytes: table to load with Surrogate.
+    """
+    loops = [list(catalog), list(radii), list(heights),
+             list(first_row_heights)]
+    for values in loops[1:]:
+        if len(values) < 2 or values != sorted(set(values)):
+            raise ValueError(
+                'Expecting at least 2 ascending values of every axis.')
+
+    def get_design(brick, radius, height, first_row_height):
+        return {
+            'brick_width': brick[0], 'brick_height': brick[1],
+            'brick_depth': brick[2], 'surface_inner_radius': radius,
+            'height': height, 'first_row_height': first_row_height,
+            'seam': seam, 'minimal_width': minimal_width}
+
+    indexes = list(get_snake_product(*[range(len(x)) for x in loops]))
+    results = evaluate_all_designs([
+        get_design(*[values[i] for values, i in zip(loops, index)])
+        for index in indexes], processes=processes)
+    shape = [len(x) for x in loops]
+    values = array('d', [0.0]) * (
+        shape[0] * shape[1] * shape[2] * shape[3] * len(SURROGATE_METRICS))
+    for index, result in zip(indexes, results):
+        offset = (((index[0] * shape[1] + index[1]) * shape[2] + index[2])
+                  * shape[3] + index[3]) * len(SURROGATE_METRICS)
+        values[offset:offset + len(SURROGATE_METRICS)] = array(
+            'd', get_surrogate_metrics(result))
+
+    header = array('d', [seam, minimal_width] + [0.0] * len(
+        SURROGATE_METRICS))
+    for brick in catalog:
+        header.extend(brick)
+    for axis in loops[1:]:
+        header.extend(axis)
+
+    def pack():
+        return struct.pack(
+            SURROGATE_HEADER, SURROGATE_MAGIC, *shape,
+            len(SURROGATE_METRICS), validation_samples) \
+            + header.tobytes() + values.tobytes()
+
+    surrogate = Surrogate(pack())
+
+    rand = random.Random(seed)
+    samples = []
+    for _ in range(validation_samples):
+        samples.append(get_design(
+            rand.choice(loops[0]),
+            *[rand.uniform(x[0], x[-1]) for x in loops[1:]]))
+    samples.sort(key=lambda x: (
+        loops[0].index((x['brick_width'], x['brick_height'],
+                        x['brick_depth'])),
+        x['surface_inner_radius'], x['height']))
+    for design, result in zip(
+            samples, evaluate_all_designs(samples, processes=processes)):
+        predicted = surrogate.predict(**design)
+        if result is None or predicted is None:
+            continue
+        for i, (metric, exact) in enumerate(zip(
+                SURROGATE_METRICS, get_surrogate_metrics(result))):
+            header[2 + i] = max(header[2 + i], abs(predicted[metric] - exact))
+    return pack()
+
+
+class Surrogate():
+
+    """Interpolated designs of build_surrogate table.
+
+    Designs are not computed, so a prediction takes microseconds. The table
+    is not copied, pass mmap to share it between processes (see
+    load_surrogate).
+    """
+
+    def __init__(self, data):
+        magic, *shape, metrics, samples = struct.unpack_from(
+            SURROGATE_HEADER, data)
+        if magic != SURROGATE_MAGIC or metrics != len(SURROGATE_METRICS):
+            raise ValueError('Invalid surrogate table.')
+        floats = memoryview(data)[struct.calcsize(SURROGATE_HEADER):]
+        floats = floats.cast('B').cast('d')
+        self.shape = shape
+        self.validation_samples = samples
+        self.seam, self.minimal_width = floats[0], floats[1]
+        offset = 2 + metrics
+        self.error = dict(zip(SURROGATE_METRICS, floats[2:offset]))
+        self.catalog = [
+            tuple(floats[offset + i * 3:offset + i * 3 + 3])
+            for i in range(shape[0])]
+        offset += shape[0] * 3
+        self.axes = []
+        for size in shape[1:]:
+            self.axes.append(floats[offset:offset + size].tolist())
+            offset += size
+        self.values = floats[offset:]
+
+    def _get_value(self, brick_index, index, metric):
+        shape = self.shape
+        return self.values[
+            (((brick_index * shape[1] + index[0]) * shape[2] + index[1])
+             * shape[3] + index[2]) * len(SURROGATE_METRICS) + metric]
+
+    def predict(
+            self, surface_inner_radius, height, first_row_height,
+            brick_width=250.0, brick_height=65.0, brick_depth=120.0,
+            **params):
+        """Returns interpolated metrics of the design.
+
+        Args:
+            surface_inner_radius, height, first_row_height, brick_width,
+            brick_height, brick_depth: design params, the brick must be in
+                the catalog. Other params (e.g. seam) are ignored.
+
+        Returns:
+            dict or None: SURROGATE_METRICS of the design or None if the
+                design is out of the table or near designs which can't be
+                built.
+        """
+        try:
+            brick_index = self.catalog.index(
+                (brick_width, brick_height, brick_depth))
+        except ValueError:
+            return None
+        cells = []
+        for axis, value in zip(
+                self.axes, (surface_inner_radius, height, first_row_height)):
+            if not axis[0] <= value <= axis[-1]:
+                return None
+            high = get_first_index(
+                1, len(axis) - 1, lambda i: axis[i] >= value)
+            cells.append((
+                high - 1, (value - axis[high - 1])
+                / (axis[high] - axis[high - 1])))
+
+        result = {}
+        for metric, name in enumerate(SURROGATE_METRICS):
+            total = 0.0
+            for corner in itertools.product((0, 1), repeat=3):
+                weight = 1.0
+                for (low, fraction), shift in zip(cells, corner):
+                    weight *= fraction if shift else 1 - fraction
+                if weight:
+                    value = self._get_value(
+                        brick_index,
+                        [low + shift for (low, _), shift in zip(
+                            cells, corner)], metric)
+                    if math.isnan(value):
+                        return None
+                    total += weight * value
+            result[name] = total
+        return result
+
+
+def load_surrogate(path):
+    """Returns Surrogate of the file memory mapped (not read)."""
+    with open(path, 'rb') as f:
+        return Surrogate(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def format_surrogate_prediction(prediction, error):
+    """Returns Surrogate.predict result with error bounds as text."""
+    if prediction is None:
+        return 'Design is out of the surrogate table.'
+    return '\n'.join(
+        '{}: {} (±{})'.format(
+            name, float_format(prediction[name]), float_format(error[name]))
+        for name in SURROGATE_METRICS)
+
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# struct format of a field to numpy dtype (little-endian, not aligned).
+NPY_TYPES = {'d': '<f8', 'i': '<i4', 'q': '<i8', '?': '|b1'}
+SWEEP_DESIGN_FIELDS = (
+    ('design', 'q'), ('brick_width', 'd'), ('brick_height', 'd'),
+    ('brick_depth', 'd'), ('surface_inner_radius', 'd'), ('height', 'd'),
+    ('first_row_height', 'd'), ('seam', 'd'), ('built', '?'),
+    ('rows', 'i'), ('bricks', 'i'), ('waste_volume', 'd'),
+    ('templates', 'i'), ('key_size', 'd'), ('unsafe_rows', 'i'),
+    ('center_step', 'i'), ('top_radian_index', 'i'), ('seconds', 'd'))
+SWEEP_ROW_FIELDS = (
+    ('design', 'q'), ('number', 'i'), ('bricks_amount', 'i'), ('ab', 'd'),
+    ('cd', 'd'), ('ef', 'd'), ('gh', 'd'), ('outer_height', 'd'),
+    ('inner_height', 'd'), ('bevel_angle', 'd'))
+
+
+class NpyWriter():
+
+    """Appends records to .npy file of one dimensional structured array.
+
+    The file is readable with numpy.load (mmap_mode too) or NpyTable. The
+    shape in the header is updated on close, so records are never kept
+    in memory.
+    """
+
+    def __init__(self, path, fields):
+        """
+        Args:
+            path(str): .npy file to write.
+            fields(list): (name, struct format) of every field, see
+                NPY_TYPES.
+        """
+        self.fields = fields
+        self.struct = struct.Struct(
+            '<' + ''.join(x[1] for x in fields))
+        self.count = 0
+        self.file = open(path, 'wb')
+        self.file.write(self.get_header(self.count))
+
+    def get_header(self, count):
+        descr = [(name, NPY_TYPES[format_]) for name, format_ in self.fields]
+        header = repr({
+            'descr': descr, 'fortran_order': False, 'shape': (count,)})
+        # Reserve space for any count, so the header keeps its size.
+        header = header.ljust(len(header) - len(str(count)) + 20)
+        # Data is aligned to 64 bytes as required by the format.
+        size = len(NPY_MAGIC) + 2 + len(header) + 1
+        header += ' ' * (-size % 64) + '\n'
+        return NPY_MAGIC + struct.pack('<H', len(header)) + header.encode()
+
+    def write(self, records):
+        """Appends records (tuples of fields values)."""
+        self.file.write(b''.join(self.struct.pack(*x) for x in records))
+        self.count += len(records)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(self.get_header(self.count))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NpyTable():
+
+    """Memory mapped .npy file of one dimensional structured array.
+
+    Records are unpacked on access, so tables larger than memory can be
+    queried.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(NPY_MAGIC)] != NPY_MAGIC:
+            raise ValueError('Unsupported npy file {}.'.format(path))
+        size, = struct.unpack_from('<H', self.data, len(NPY_MAGIC))
+        offset = len(NPY_MAGIC) + 2
+        header = ast.literal_eval(
+            self.data[offset:offset + size].decode('latin1'))
+        formats = {v: k for k, v in NPY_TYPES.items()}
+        self.fields = [
+            (name, formats[dtype]) for name, dtype in header['descr']]
+        self.struct = struct.Struct(
+            '<' + ''.join(x[1] for x in self.fields))
+        self.offset = offset + size
+        self.count, = header['shape']
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not -self.count <= index < self.count:
+            raise IndexError(index)
+        values = self.struct.unpack_from(
+            self.data, self.offset + index % self.count * self.struct.size)
+        return dict(zip((x[0] for x in self.fields), values))
+
+    def __iter__(self):
+        names = [x[0] for x in self.fields]
+        data = memoryview(self.data)[
+            self.offset:self.offset + self.count * self.struct.size]
+        for values in self.struct.iter_unpack(data):
+            yield dict(zip(names, values))
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_column(self, name):
+        """Yields values of the field of every record."""
+        index = [x[0] for x in self.fields].index(name)
+        data = memoryview(self.data)[
+            self.offset:self.offset + self.count * self.struct.size]
+        for values in self.struct.iter_unpack(data):
+            yield values[index]
+
+
+def get_sweep_records(designs):
+    """Returns records of sweep_designs tables for (index, design) pairs.
+
+    Designs are evaluated with evaluate_design, every one is started
+    from the warm start of the previous one.
+    """
+    design_records = []
+    row_records = []
+    warm_start = None
+    for index, design in designs:
+        start = time.perf_counter()
+        result = evaluate_design(design, warm_start=warm_start)
+        seconds = time.perf_counter() - start
+        params = [index] + [
+            design[x] for x, _ in SWEEP_DESIGN_FIELDS[1:8]]
+        if result is None:
+            design_records.append(params + [False] + [0] * 8 + [seconds])
+            continue
+        warm_start = result['warm_start']
+        design_records.append(params + [
+            True, len(result['bricks_amounts']) + 1, result['bricks'],
+            result['waste_volume'], result['templates'],
+            result['key_size'], result['unsafe_rows'],
+            warm_start['center_step'], warm_start['top_radian_index'],
+            seconds])
+        for row in result['row_sizes']:
+            row_records.append(
+                [index] + [row[x] for x, _ in SWEEP_ROW_FIELDS[1:]])
+    return design_records, row_records
+
+
+def sweep_designs(
+        path, catalog, radii, heights, first_row_heights=(125.0,),
+        seams=(3.0,), minimal_width=40, chunksize=64, processes=None):
+    """Writes results of every design of the grid to .npy tables.
+
+    Designs are streamed through a process pool in chunks and every
+    evaluated chunk is appended to the tables, so memory does not grow
+    with the amount of designs. Designs are numbered (`design` field) in
+    itertools.product order of the params, records are in the order of
+    evaluation (see get_snake_product).
+
+    Args:
+        path(str): existing directory to write designs.npy (one record per
+            design, see SWEEP_DESIGN_FIELDS) and rows.npy (one record per
+            row of built designs, see SWEEP_ROW_FIELDS) to.
+        catalog(list): (brick_width, brick_height, brick_depth) of
+            available bricks.
+        radii, heights, first_row_heights, seams(list): params to sweep.
+        minimal_width(float): see optimize_bricks_amounts.
+        chunksize(int): amount of designs evaluated by a worker at once.
+        processes(int or None): amount of worker processes, cpu count by
+            default. Designs are evaluated in current process if 1.
+
+    Returns:
+        tuple: amounts of designs and rows written.
+    """
+    loops = [list(catalog), list(radii), list(heights),
+             list(first_row_heights), list(seams)]
+    shape = [len(x) for x in loops]
+
+    def get_designs():
+        for index in get_snake_product(*[range(x) for x in shape]):
+            number = 0
+            for size, i in zip(shape, index):
+                number = number * size + i
+            brick, radius, height, first_row_height, seam = [
+                values[i] for values, i in zip(loops, index)]
+            yield number, {
+                'brick_width': brick[0], 'brick_height': brick[1],
+                'brick_depth': brick[2], 'surface_inner_radius': radius,
+                'height': height, 'first_row_height': first_row_height,
+                'seam': seam, 'minimal_width': minimal_width}
+
+    designs = get_designs()
+    chunks = iter(lambda: list(itertools.islice(designs, chunksize)), [])
+    with NpyWriter(os.path.join(path, 'designs.npy'),
+                   SWEEP_DESIGN_FIELDS) as design_writer, \
+            NpyWriter(os.path.join(path, 'rows.npy'),
+                      SWEEP_ROW_FIELDS) as row_writer:
+        if processes == 1:
+            for chunk in chunks:
+                design_records, row_records = get_sweep_records(chunk)
+                design_writer.write(design_records)
+                row_writer.write(row_records)
+        else:
+            workers = processes or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Keep a few chunks per worker in flight to bound memory.
+                pending = collections.deque()
+                for chunk in itertools.chain(chunks, [None]):
+                    if chunk is not None:
+                        pending.append(
+                            executor.submit(get_sweep_records, chunk))
+                    while pending and (
+                            chunk is None
+                            or len(pending) > 4 * workers):
+                        design_records, row_records = \
+                            pending.popleft().result()
+                        design_writer.write(design_records)
+                        row_writer.write(row_records)
+        return design_writer.count, row_writer.count
+
+
+def get_design_target(geometry, target):
+    """Returns value of the target for the geometry.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        target(str): `rows` (amount of rows including soldier one),
+            `key_radius` (horizontal radius of the last row top outer
+            point) or `key_side` (top inner width of the last row brick,
+            that's the side of key bricks).
+    """
+    if target == 'rows':
+        return len(geometry.rows) + 1
+    if target == 'key_radius':
+        return geometry.rows[-1].horizontal_top_outer_radius
+    if target == 'key_side':
+        return geometry.rows[-1].top_inner_width
+    raise ValueError(
+        'Invalid target. Expecting `rows`, `key_radius` or `key_side`.')
+
+
+def solve_design(
+        target, value, parameter='height', low=None, high=None,
+        samples=16, tolerance=0.5, **params):
+    """Returns value of the parameter giving requested target value.
+
+    The range of the parameter is sampled first (targets jump when rows
+    are added), then every interval where the target crosses the value is
+    bisected until the target is within tolerance. For `rows` the middle
+    of the range giving the rows amount is returned.
+
+    Args:
+        target(str): see get_design_target.
+        value(float): requested value of the target.
+        parameter(str): `height`, `first_row_height` or
+            `surface_inner_radius`.
+        low(float or None): minimal value of the parameter, 70% of the
+            current value by default.
+        high(float or None): maximal value of the parameter, 130% of the
+            current value by default.
+        samples(int): amount of samples of the range.
+        tolerance(float): allowed difference of the target from the value
+            (mm), or of the parameter for `rows` target.
+        params: other get_dome_geometry params.
+
+    Returns:
+        tuple(parameter value (float), geometry (DomeGeometry)).
+
+    """
+    if parameter not in ('height', 'first_row_height',
+                         'surface_inner_radius'):
+        raise ValueError(
+            'Invalid parameter. Expecting `height`, `first_row_height` or'
+            ' `surface_inner_radius`.')
+    defaults = {
+        'height': 440.0, 'first_row_height': 125.0,
+        'surface_inner_radius': 503.0}
+    current = params.pop(parameter, defaults[parameter])
+    if low is None:
+        low = current * 0.7
+    if high is None:
+        high = current * 1.3
+
+    cache = {}
+    # Probes are close to each other, start solvers from the last one.
+    warm_starts = [None]
+
+    def evaluate(x):
+        if x not in cache:
+            try:
+                geometry = get_dome_geometry(
+                    warm_start=warm_starts[-1],
+                    **dict(params, **{parameter: x}))
+                warm_starts.append(geometry.warm_start)
+                cache[x] = (get_design_target(geometry, target), geometry)
+            except (ValueError, RuntimeError):
+                cache[x] = (None, None)
+        return cache[x]
+
+    xs = [low + (high - low) * i / (samples - 1) for i in range(samples)]
+    points = [(x, evaluate(x)[0]) for x in xs]
+    points = [x for x in points if x[1] is not None]
+
+    if target == 'rows':
+        matches = [x for x, y in points if y == value]
+        if not matches:
+            raise ValueError(
+                f'Could not find {parameter} from {float_format(low)} to'
+                f' {float_format(high)} giving {value} rows.')
+        # Bisect bounds of the range with requested rows amount.
+        bounds = []
+        for inside, direction in ((matches[0], -1), (matches[-1], 1)):
+            outside = inside + direction * (high - low) / (samples - 1)
+            outside = min(max(outside, low), high)
+            while abs(outside - inside) > tolerance:
+                middle = (inside + outside) / 2.0
+                if evaluate(middle)[0] == value:
+                    inside = middle
+                else:
+                    outside = middle
+            bounds.append(inside)
+        result = (bounds[0] + bounds[1]) / 2.0
+        if evaluate(result)[0] != value:
+            result = bounds[0]
+        return result, evaluate(result)[1]
+
+    best = min(points, key=lambda x: abs(x[1] - value), default=None)
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        if (y1 - value) * (y2 - value) > 0:
+            continue
+        # Bisection with secant step (regula falsi with bisection guard).
+        for _ in range(60):
+            if abs(y1 - value) <= tolerance:
+                x2, y2 = x1, y1
+                break
+            if abs(y2 - value) <= tolerance:
+                break
+            middle = (x1 + x2) / 2.0
+            if y1 != y2:
+                secant = x1 + (value - y1) * (x2 - x1) / (y2 - y1)
+                if min(x1, x2) < secant < max(x1, x2):
+                    middle = (middle + secant) / 2.0
+            y_middle = evaluate(middle)[0]
+            if y_middle is None or abs(x2 - x1) < 1e-6:
+                break
+            if (y1 - value) * (y_middle - value) <= 0:
+                x2, y2 = middle, y_middle
+            else:
+                x1, y1 = middle, y_middle
+        if abs(y2 - value) <= tolerance:
+            return x2, evaluate(x2)[1]
+        if abs(y2 - value) < abs(best[1] - value):
+            best = (x2, y2)
+
+    message = f'Could not find {parameter} from {float_format(low)} to' \
+        f' {float_format(high)} giving {target}={value}.'
+    if best:
+        message += f' Closest is {target}={best[1]} for' \
+            f' {parameter}={float_format(best[0])}.'
+    raise ValueError(message)
+
+
+def get_row_sizes(design, warm_start=None):
+    """Returns cut sizes of every row of the design or None.
+
+    Args:
+        design(dict): get_dome_geometry params.
+        warm_start(dict or None): see get_dome_geometry.
+
+    Returns:
+        dict or None: see get_geometry_row_sizes, None if the design can't
+            be built.
+    """
+    try:
+        geometry = get_dome_geometry(warm_start=warm_start, **design)
+    except (ValueError, RuntimeError):
+        return None
+    return get_geometry_row_sizes(geometry)
+
+
+def get_geometry_row_sizes(geometry):
+    """Returns row number to dict with `ab`, `cd`, `ef`, `gh` (see
+    RowTemplate) and `bevel_angle` of every row of the geometry.
+    """
+    return {
+        x.number: {
+            'ab': x.bottom_outer_width,
+            'cd': x.bottom_inner_width,
+            'ef': x.top_outer_width,
+            'gh': x.top_inner_width,
+            'bevel_angle': x.bevel_angle,
+        } for x in geometry.rows}
+
+
+def get_sensitivity(
+        design, parameters=('seam', 'brick_height', 'height'), step=1.0,
+        processes=None):
+    """Returns derivatives of every row cut size by every parameter.
+
+    Derivatives are central finite differences around the sizes of the
+    design itself. Bricks amounts of the design are kept for perturbed
+    designs, so only the geometry changes. Perturbed designs are close to
+    the design, so they are evaluated in one batch warm started from it
+    in the current process, a process pool (see processes) only pays off
+    for long lists of parameters. Cut sizes are rounded to 0.1 mm, so
+    derivatives are accurate to about 0.05 / step.
+
+    Args:
+        design(dict): get_dome_geometry params.
+        parameters(list): get_dome_geometry params to perturb.
+        step(float): perturbation of every parameter (mm).
+        processes(int or None): amount of worker processes to evaluate
+            designs in, current process by default.
+
+    Returns:
+        list of dict: `number` of the row, `sizes` (see get_row_sizes) and
+            `derivatives` (parameter to size to derivative). Derivative is
+            one-sided if the row is missing on the other side and None if
+            it's missing on both.
+
+    """
+    geometry = get_dome_geometry(**design)
+    # Perturbed designs may have more rows, they keep the last amount.
+    base = dict(design, bricks_amount=None, bricks_amounts=[
+        x.bricks_amount for x in geometry.rows])
+    arguments = inspect.signature(get_dome_geometry).bind(**design)
+    arguments.apply_defaults()
+    designs = []
+    for parameter in parameters:
+        value = arguments.arguments[parameter]
+        for sign in (-1, 1):
+            designs.append(dict(base, **{parameter: value + sign * step}))
+
+    evaluate = functools.partial(
+        get_row_sizes, warm_start=geometry.warm_start)
+    if not processes or processes == 1:
+        results = [evaluate(x) for x in designs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(evaluate, designs))
+
+    sensitivity = []
+    for number, sizes in sorted(get_geometry_row_sizes(geometry).items()):
+        derivatives = {}
+        for i, parameter in enumerate(parameters):
+            lower, upper = [
+                x.get(number) if x else None
+                for x in results[2 * i:2 * i + 2]]
+            derivatives[parameter] = {}
+            for key, value in sizes.items():
+                if lower and upper:
+                    derivative = (upper[key] - lower[key]) / (2 * step)
+                elif upper:
+                    derivative = (upper[key] - value) / step
+                elif lower:
+                    derivative = (value - lower[key]) / step
+                else:
+                    derivative = None
+                derivatives[parameter][key] = derivative
+        sensitivity.append({
+            'number': number, 'sizes': sizes, 'derivatives': derivatives})
+    return sensitivity
+
+
+def format_sensitivity(sensitivity):
+    """Returns sensitivity as a text table (mm or degrees per mm)."""
+    keys = ('ab', 'cd', 'ef', 'gh', 'bevel_angle')
+    line_format = '{:>6} {:>15}' + ' {:>11}' * len(keys)
+    lines = [line_format.format('row', 'parameter', *keys)]
+    for row in sensitivity:
+        lines.append(line_format.format(
+            f'#{row["number"]}', 'value',
+            *[float_format(row['sizes'][x]) for x in keys]))
+        for parameter, derivatives in row['derivatives'].items():
+            lines.append(line_format.format(
+                '', f'd/d{parameter}',
+                *['-' if derivatives[x] is None
+                  else '{:.3f}'.format(derivatives[x]) for x in keys]))
+    return '\n'.join(lines)
+
+
+def get_percentiles(values, percentiles=(5, 50, 95)):
+    """Returns dict of percentiles of values (linear interpolation)."""
+    values = sorted(values)
+    result = {}
+    for percentile in percentiles:
+        position = (len(values) - 1) * percentile / 100.0
+        lower = int(math.floor(position))
+        upper = min(lower + 1, len(values) - 1)
+        result[percentile] = values[lower] \
+            + (values[upper] - values[lower]) * (position - lower)
+    return result
+
+
+def simulate_tolerances(
+        geometry, samples=10000, brick_tolerance=1.5, seam_tolerance=1.0,
+        cut_tolerance=0.5, percentiles=(5, 50, 95), seed=None):
+    """Returns percentile bands of rows positions for perturbed bricks.
+
+    Bricks are cut by the templates of the geometry, but every course is
+    laid with its own brick height and bed seam, and vertical seams and
+    cuts of every brick deviate too. Deviations are normal with standard
+    deviation of half the tolerance, so about 95% of them are within the
+    tolerance.
+
+    Every dome row moves its outer points along the dome circle by the bed
+    seam and the brick height (see Row and move_along_radius). That's a
+    rotation around the dome center by the chord angle, so the row chain
+    is propagated with angles only, without building Row instances.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        samples(int): amount of simulated domes.
+        brick_tolerance(float): tolerance of brick height (mm).
+        seam_tolerance(float): tolerance of bed and vertical seams (mm).
+        cut_tolerance(float): tolerance of template cut widths (mm).
+        percentiles(list): percentiles to report.
+        seed(int or None): seed of the random generator.
+
+    Returns:
+        dict: `rows` (list of dicts with `number`, `height` (height of the
+            top outer point above the dome base) and `closure` (bottom
+            outer circumference minus the length of bricks and vertical
+            seams laid, negative if the ring doesn't fit), with nominal
+            value and percentiles dict each) and `key_size` (diameter of
+            the opening left for key bricks).
+
+    """
+    if samples < 1:
+        raise ValueError('Invalid samples. Expecting at least one sample.')
+    rng = random.Random(seed)
+    brick_sigma = brick_tolerance / 2.0
+    seam_sigma = seam_tolerance / 2.0
+    cut_sigma = cut_tolerance / 2.0
+    center = geometry.dome_circle_center_point
+    base_y = geometry.surface_circle_center_point.y
+    _, start_point = get_dome_radius_radian(
+        geometry.dome_radius, center, geometry.first_row,
+        brick_width=geometry.brick_width)
+    radius, start_angle = to_polar(
+        start_point.x - center.x, start_point.y - center.y)
+    start_angle = math.radians(start_angle)
+    courses = [
+        (x.number, int(x.bricks_amount), x.bottom_outer_width,
+         x.vertical_seam) for x in geometry.rows]
+
+    def chord_angle(distance):
+        return math.acos(1 - distance ** 2 / (2 * radius ** 2))
+
+    def lay(brick_height, seam, cut_errors, vertical_seam_errors):
+        angle = start_angle
+        heights = []
+        closures = []
+        for (number, amount, width, vertical_seam), h, s, c, v in zip(
+                courses, brick_height, seam, cut_errors,
+                vertical_seam_errors):
+            angle += chord_angle(s)
+            bottom_radius = abs(radius * math.cos(angle))
+            closures.append(
+                2 * math.pi * bottom_radius
+                - amount * (width + vertical_seam) - c - v)
+            angle += chord_angle(h)
+            heights.append(base_y - center.y - radius * math.sin(angle))
+        return heights, closures, 2 * abs(radius * math.cos(angle))
+
+    nominal = lay(
+        [geometry.brick_height] * len(courses),
+        [geometry.seam] * len(courses),
+        [0.0] * len(courses), [0.0] * len(courses))
+
+    heights = [[] for _ in courses]
+    closures = [[] for _ in courses]
+    key_sizes = []
+    for _ in range(samples):
+        # Sum of normal deviations of every brick of the course is normal.
+        result = lay(
+            [rng.gauss(geometry.brick_height, brick_sigma)
+             for _ in courses],
+            [max(0.0, rng.gauss(geometry.seam, seam_sigma))
+             for _ in courses],
+            [rng.gauss(0, cut_sigma * math.sqrt(x[1])) for x in courses],
+            [rng.gauss(0, seam_sigma * math.sqrt(x[1])) for x in courses])
+        for i, (height, closure) in enumerate(zip(result[0], result[1])):
+            heights[i].append(height)
+            closures[i].append(closure)
+        key_sizes.append(result[2])
+
+    rows = []
+    for i, course in enumerate(courses):
+        rows.append({
+            'number': course[0],
+            'height': (
+                nominal[0][i], get_percentiles(heights[i], percentiles)),
+            'closure': (
+                nominal[1][i], get_percentiles(closures[i], percentiles)),
+        })
+    return {
+        'rows': rows,
+        'key_size': (nominal[2], get_percentiles(key_sizes, percentiles)),
+    }
+
+
+def format_tolerance_simulation(simulation):
+    """Returns tolerance simulation as a text table."""
+    def format_band(value):
+        nominal, percentiles = value
+        return '{} [{}]'.format(
+            float_format(nominal),
+            ' '.join(float_format(x) for x in percentiles.values()))
+
+    percentiles = ', '.join(
+        f'p{x:g}' for x in simulation['key_size'][1])
+    lines = [f'nominal [{percentiles}]']
+    lines.append('{:>6} {:>32} {:>32}'.format('row', 'height', 'closure'))
+    for row in simulation['rows']:
+        lines.append('{:>6} {:>32} {:>32}'.format(
+            f'#{row["number"]}', format_band(row['height']),
+            format_band(row['closure'])))
+    lines.append('key size: {}'.format(format_band(simulation['key_size'])))
+    return '\n'.join(lines)
+
+
+def get_inner_profile(
+        surface_inner_radius=503.0, height=440.0, first_row_height=125.0,
+        brick_width=250.0, brick_height=65.0, brick_depth=120.0, seam=3.0):
+    """Returns inner profile of the dome computed without stepping.
+
+    Continuous version of get_dome_inner_radius: the dome circle center
+    is on the dome axis at depth s under the height point, where the
+    line from the first row outer top point to the center crosses the
+    inner wall at distance s from the center. By similar triangles that
+    is a quadratic equation of s, so the profile is smooth in all
+    parameters. Coordinates are (horizontal distance from the axis,
+    height above the surface the dome height is measured from).
+
+    Returns:
+        tuple(soldier bottom height, soldier top inner point (r, z),
+            dome circle center height, dome inner radius).
+
+    """
+    # See get_dome_inner_radius.
+    outer_radius = surface_inner_radius + brick_width / 2.0
+    depth = height - (first_row_height - brick_height)
+    ratio = surface_inner_radius / outer_radius
+    a = ratio ** 2 - 1
+    b = -2 * ratio ** 2 * depth
+    c = ratio ** 2 * (outer_radius ** 2 + depth ** 2)
+    discriminant = b ** 2 - 4 * a * c
+    if a >= 0 or discriminant < 0:
+        raise ValueError('Could not find center of the dome circle.')
+    s = (-b - math.sqrt(discriminant)) / (2 * a)
+    center_z = height - s
+
+    # Soldier row outer top point and its cut by the line to the center,
+    # see get_dome_geometry.
+    bottom_z = seam - brick_height
+    top_outer = (surface_inner_radius + brick_depth,
+                 first_row_height + bottom_z)
+    cut = surface_inner_radius / top_outer[0]
+    top_inner = (surface_inner_radius,
+                 center_z + (top_outer[1] - center_z) * cut)
+    inner_radius = math.sqrt(
+        top_outer[0] ** 2 + (top_outer[1] - center_z) ** 2) * cut
+    return bottom_z, top_inner, center_z, inner_radius
+
+
+def get_profile_distance(profile, point):
+    """Returns signed distance from (r, z) point to the inner profile.
+
+    Distance is positive if the point is out of the dome.
+    """
+    bottom_z, top_inner, center_z, inner_radius = profile
+    r, z = point
+    wall_z = min(max(z, bottom_z), top_inner[1])
+    wall = math.copysign(
+        math.sqrt((r - top_inner[0]) ** 2 + (z - wall_z) ** 2),
+        r - top_inner[0])
+    if math.atan2(z - center_z, r) >= math.atan2(
+            top_inner[1] - center_z, top_inner[0]):
+        arc = math.sqrt(r ** 2 + (z - center_z) ** 2) - inner_radius
+    else:
+        arc = math.copysign(
+            math.sqrt((r - top_inner[0]) ** 2 + (z - top_inner[1]) ** 2),
+            r - top_inner[0])
+    return min(wall, arc, key=abs)
+
+
+def solve_linear(matrix, vector):
+    """Returns solution of the linear system (gaussian elimination)."""
+    size = len(vector)
+    rows = [list(x) + [y] for x, y in zip(matrix, vector)]
+    for i in range(size):
+        pivot = max(range(i, size), key=lambda x: abs(rows[x][i]))
+        if not rows[pivot][i]:
+            raise ValueError('Singular matrix.')
+        rows[i], rows[pivot] = rows[pivot], rows[i]
+        for j in range(i + 1, size):
+            factor = rows[j][i] / rows[i][i]
+            for k in range(i, size + 1):
+                rows[j][k] -= factor * rows[i][k]
+    result = [0.0] * size
+    for i in reversed(range(size)):
+        result[i] = (rows[i][size] - sum(
+            rows[i][k] * result[k] for k in range(i + 1, size))) \
+            / rows[i][i]
+    return result
+
+
+def fit_dome(
+        points, surface_inner_radius=None, height=None,
+        first_row_height=125.0, brick_width=250.0, brick_height=65.0,
+        brick_depth=120.0, seam=3.0, iterations=100):
+    """Returns dome params best matching measured inner profile points.
+
+    surface_inner_radius, height and first_row_height are fitted with
+    Levenberg-Marquardt least squares over distances from the points to
+    get_inner_profile. Brick sizes and seam are kept.
+
+    Args:
+        points(list): measured (horizontal distance from the dome axis,
+            height above the surface) points of the inner side (mm).
+        surface_inner_radius(float or None): initial value, the largest
+            horizontal distance of points by default.
+        height(float or None): initial value, the largest height of
+            points by default.
+        first_row_height(float): initial value.
+        brick_width, brick_height, brick_depth, seam: see build_svg.
+        iterations(int): maximal amount of iterations.
+
+    Returns:
+        tuple(params (dict with surface_inner_radius, height and
+            first_row_height), rms distance of points (mm)).
+
+    """
+    if len(points) < 3:
+        raise ValueError('Invalid points. Expecting at least 3 points.')
+    names = ('surface_inner_radius', 'height', 'first_row_height')
+    values = [
+        surface_inner_radius or max(x[0] for x in points),
+        height or max(x[1] for x in points),
+        first_row_height]
+    bricks = dict(
+        brick_width=brick_width, brick_height=brick_height,
+        brick_depth=brick_depth, seam=seam)
+
+    def get_residuals(values):
+        try:
+            profile = get_inner_profile(**dict(zip(names, values)), **bricks)
+        except (ValueError, ZeroDivisionError):
+            return None
+        return [get_profile_distance(profile, x) for x in points]
+
+    residuals = get_residuals(values)
+    if residuals is None:
+        raise ValueError('Invalid initial params.')
+    cost = sum(x ** 2 for x in residuals)
+    damping = 1e-3
+    step = 1e-3
+    for _ in range(iterations):
+        jacobian = []
+        for i in range(len(values)):
+            shifted = list(values)
+            shifted[i] += step
+            shifted_residuals = get_residuals(shifted) or residuals
+            jacobian.append([
+                (x - y) / step for x, y in zip(shifted_residuals, residuals)])
+        normal = [[sum(a * b for a, b in zip(x, y)) for y in jacobian]
+                  for x in jacobian]
+        gradient = [sum(a * b for a, b in zip(x, residuals))
+                    for x in jacobian]
+        while True:
+            damped = [
+                [x + (damping * x if i == j else 0) + (1e-9 if i == j else 0)
+                 for j, x in enumerate(row)] for i, row in enumerate(normal)]
+            delta = solve_linear(damped, [-x for x in gradient])
+            candidate = [x + y for x, y in zip(values, delta)]
+            candidate_residuals = get_residuals(candidate)
+            if candidate_residuals is not None:
+                candidate_cost = sum(x ** 2 for x in candidate_residuals)
+                if candidate_cost <= cost:
+                    break
+            damping *= 10
+            if damping > 1e12:
+                break
+        if damping > 1e12:
+            break
+        damping = max(damping / 10, 1e-9)
+        improvement = cost - candidate_cost
+        values, residuals, cost = \
+            candidate, candidate_residuals, candidate_cost
+        if max(abs(x) for x in delta) < 1e-4 or improvement < 1e-12:
+            break
+
+    return (dict(zip(names, values)),
+            math.sqrt(cost / len(points)))
+
+
+def parse_points(lines):
+    """Returns (horizontal, vertical) points from `r,z` csv lines."""
+    points = []
+    for line in lines:
+        line = line.split('#')[0].strip()
+        if line:
+            r, z = line.replace(';', ',').split(',')[:2]
+            points.append((float(r), float(z)))
+    return points
+
+
+def get_cut_pieces(geometry):
+    """Returns footprints of all pieces cut from stock bricks.
+
+    Pieces are cut through the whole brick height, so the footprint is a
+    symmetric trapezoid on the brick_width x brick_depth face of the brick.
+
+    Returns:
+        list of tuple(row number, length, width at one end, width at the
+            other end): length is along brick_width, widths are along
+            brick_depth.
+    """
+    first_row = geometry.first_row
+    soldier_length = max(
+        first_row.bottom_outer_point.y - first_row.top_outer_point.y,
+        first_row.bottom_inner_point.y - first_row.top_inner_point.y)
+    pieces = [
+        (first_row.number, soldier_length,
+         geometry.brick_depth, geometry.brick_depth)
+    ] * get_soldier_bricks_amount(geometry)
+
+    for template in geometry.rows:
+        outer_width = max(
+            template.bottom_outer_width, template.top_outer_width)
+        inner_width = max(
+            template.bottom_inner_width, template.top_inner_width)
+        pieces.extend(
+            [(template.number, geometry.brick_width / 2.0,
+              outer_width, inner_width)] * int(template.bricks_amount))
+    return pieces
+
+
+def optimize_cutting(geometry, kerf=0.0):
+    """Returns plan to cut all pieces of the dome from stock bricks.
+
+    Stock brick is split along its width into lanes, every lane holds
+    pieces of the same length side by side. Neighbour trapezoids are
+    flipped to nest into each other, so a lane may take pieces from
+    several rows (offcuts of lower rows are reused for upper ones). Lanes
+    and pieces are placed with best fit decreasing heuristic.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        kerf(float): width of the saw cut (mm).
+
+    Returns:
+        dict: `bricks` (list of stock bricks, every brick is a list of
+            lanes, every lane is a list of row numbers of its pieces),
+            `stock_bricks`, `lower_bound` (no plan can use less stock
+            bricks), `waste_volume` (mm3).
+    """
+    brick_width = geometry.brick_width
+    brick_depth = geometry.brick_depth
+    pieces = sorted(
+        get_cut_pieces(geometry),
+        key=lambda x: (-x[1], -max(x[2], x[3])))
+    narrowest = min(min(x[2], x[3]) for x in pieces)
+
+    bricks = []  # Lengths left in stock bricks.
+    lanes = []  # Open lanes: [length, right at both ends, brick, pieces]
+    plan = []
+
+    def place(lane, piece, reverse):
+        _, _, width_a, width_b = piece
+        if reverse:
+            width_a, width_b = width_b, width_a
+        size = max(width_a, width_b)
+        right_a, right_b = lane[1], lane[2]
+        if lane[4]:
+            right_a += kerf
+            right_b += kerf
+        x = max(right_a - (size - width_a) / 2.0,
+                right_b - (size - width_b) / 2.0)
+        return x + (size + width_a) / 2.0, x + (size + width_b) / 2.0
+
+    for piece in pieces:
+        number, length = piece[0], piece[1]
+        best = None
+        for lane in lanes:
+            if lane[0] < length:
+                continue
+            for reverse in (False, True):
+                right_a, right_b = place(lane, piece, reverse)
+                left = brick_depth - max(right_a, right_b)
+                if left >= 0 and (best is None or left < best[0]):
+                    best = (left, lane, right_a, right_b)
+        if best is None:
+            # Open new lane in the brick with the least length left.
+            brick = None
+            for i, length_left in enumerate(bricks):
+                needed = length + (kerf if plan[i] else 0)
+                if length_left >= needed \
+                        and (brick is None or length_left < bricks[brick]):
+                    brick = i
+            if brick is None:
+                bricks.append(brick_width)
+                plan.append([])
+                brick = len(bricks) - 1
+            if plan[brick]:
+                bricks[brick] -= kerf
+            bricks[brick] -= length
+            lane = [length, 0.0, 0.0, brick, []]
+            plan[brick].append(lane[4])
+            lanes.append(lane)
+            right_a, right_b = place(lane, piece, False)
+            best = (brick_depth - max(right_a, right_b), lane, right_a,
+                    right_b)
+
+        left, lane, lane[1], lane[2] = best
+        lane[4].append(number)
+        if left < narrowest + kerf:
+            lanes.remove(lane)
+
+    stock_volume = brick_width * brick_depth * geometry.brick_height
+    bom = get_bill_of_materials(geometry)
+    cut_volume = sum(x['brick_volume'] for x in bom['rows'])
+    pieces_volume = sum(
+        x[1] * (x[2] + x[3]) / 2.0 for x in pieces) * geometry.brick_height
+    return {
+        'bricks': plan,
+        'stock_bricks': len(plan),
+        'lower_bound': int(math.ceil(pieces_volume / stock_volume - 1e-9)),
+        'waste_volume': len(plan) * stock_volume - cut_volume,
+    }
+
+
+def format_cutting_plan(cutting_plan):
+    """Returns cutting plan as a text, same bricks are grouped."""
+    patterns = {}
+    for brick in cutting_plan['bricks']:
+        pattern = ' | '.join(
+            ' '.join(f'#{x}' for x in lane) for lane in brick)
+        patterns[pattern] = patterns.get(pattern, 0) + 1
+    lines = [f'{amount} x [{pattern}]' for pattern, amount in
+             patterns.items()]
+    lines.append('stock bricks: {} (lower bound {})'.format(
+        cutting_plan['stock_bricks'], cutting_plan['lower_bound']))
+    lines.append('waste: {} l'.format(
+        float_format(cutting_plan['waste_volume'] / 1e6)))
+    return '\n'.join(lines)
+
+
+def get_soldier_bricks_amount(geometry):
+    """Returns amount of bricks in the soldier (first) row.
+
+    Soldier brick stands on its end, so brick_height is its width along
+    the inner circumference.
+    """
+    return int(math.ceil(
+        2 * math.pi * geometry.surface_inner_radius
+        / (geometry.brick_height + geometry.seam)))
+
+
+def get_seam_angles(geometry):
+    """Returns azimuthal positions of vertical seams of every row.
+
+    Seams of every row are placed in the middle between seams of the row
+    below as much as bricks amounts allow. Seams of rows with n and m
+    bricks can't be closer than 2 * pi / lcm(n, m) to each other, so the
+    row is turned by half of that from the row below.
+
+    Positions are the best rotation of every row for evenly spaced seams,
+    get_seam_layout starts laying bricks of every row from them.
+
+    Returns:
+        list of tuple(row number, bricks amount, angle of the first seam):
+            seams of the row are placed evenly starting from the angle.
+    """
+    seams = [(
+        geometry.first_row.number, get_soldier_bricks_amount(geometry),
+        0.0)]
+    for template in geometry.rows:
+        _, previous_amount, previous_angle = seams[-1]
+        amount = int(template.bricks_amount)
+        lcm = previous_amount * amount // math.gcd(previous_amount, amount)
+        seams.append((
+            template.number, amount, previous_angle + math.pi / lcm))
+    return seams
+
+
+def get_seams_distance(amount1, angle1, amount2, angle2):
+    """Returns minimal angle between seams of two rows."""
+    lcm = amount1 * amount2 // math.gcd(amount1, amount2)
+    step = 2 * math.pi / lcm
+    offset = (angle2 - angle1) % step
+    return min(offset, step - offset)
+
+
+def get_seam_layout(geometry, start_angles=None):
+    """Returns azimuthal positions of vertical seams of dome rows as laid.
+
+    Bricks are flat, so every brick of the row with its vertical seam
+    takes the chord of AB + seam length at the bottom outer radius, not
+    the arc AB is computed from. What's left of the circle is spread over
+    all vertical seams of the row, so seams are placed evenly starting
+    from the start angle.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        start_angles(list of float): angle of the first seam of every dome
+            row as it's laid, the best rotation of get_seam_angles by
+            default.
+
+    Returns:
+        list of dict: `number` of the row, `angles` (sorted angles of its
+            seams in [0, 2 * pi)) and `closure` (what's left of the bottom
+            outer circle after all bricks and vertical seams, mm, negative
+            if bricks overlap).
+
+    """
+    axis_x = geometry.dome_circle_center_point.x
+    if start_angles is None:
+        start_angles = [x[2] for x in get_seam_angles(geometry)[1:]]
+    layout = []
+    for template, start in zip(geometry.rows, start_angles):
+        amount = int(template.bricks_amount)
+        radius = abs(axis_x - template.row.bottom_outer_point.x)
+        chord = template.bottom_outer_width + template.vertical_seam
+        brick_angle = 2 * math.asin(min(chord / (2 * radius), 1.0))
+        layout.append({
+            'number': template.number,
+            'angles': sorted(
+                (start + 2 * math.pi * x / amount) % (2 * math.pi)
+                for x in range(amount)),
+            'closure': radius * (2 * math.pi - amount * brick_angle),
+        })
+    return layout
+
+
+def get_layout_seams_distance(angles, below):
+    """Returns minimal angle between seams and sorted seams below."""
+    distance = math.pi
+    for angle in angles:
+        index = bisect.bisect_left(below, angle)
+        for other in (below[index - 1], below[index % len(below)]):
+            offset = abs(angle - other) % (2 * math.pi)
+            distance = min(distance, offset, 2 * math.pi - offset)
+    return distance
+
+
+def verify_rows(
+        geometry, minimal_offset=15.0, closure_tolerance=2.0,
+        start_angles=None):
+    """Returns seam staggering and ring closure violations.
+
+    Seams are taken from get_seam_layout, every row laid from its start
+    angle. Soldier row bricks stand on their ends and their amount doesn't
+    depend on dome rows, so only seams of dome rows are checked.
+
+    Ring closure compares chords of bricks with the circle they are laid
+    on. AB is rounded and computed along the arc, so the ring never closes
+    exactly, every vertical seam may take closure_tolerance of it.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        minimal_offset(float): minimal distance between vertical seams of
+            adjacent rows along their bed at the inner side (mm).
+        closure_tolerance(float): allowed closure error per vertical seam
+            of the row (mm).
+        start_angles(list of float): angle of the first seam of every dome
+            row, see get_seam_layout.
+
+    Returns:
+        list of dict: `number` of the row, `kind` (`seam` or `closure`)
+            and `value` (seams offset or closure error, mm). Empty if all
+            rows are fine.
+
+    """
+    axis_x = geometry.dome_circle_center_point.x
+    violations = []
+    layout = get_seam_layout(geometry, start_angles=start_angles)
+    below = None
+    for template, row in zip(geometry.rows, layout):
+        if below is not None:
+            bed_radius = abs(axis_x - template.row.bottom_inner_point.x)
+            offset = bed_radius * get_layout_seams_distance(
+                row['angles'], below)
+            if offset < minimal_offset:
+                violations.append(
+                    {'number': row['number'], 'kind': 'seam',
+                     'value': offset})
+        below = row['angles']
+
+        if abs(row['closure']) > closure_tolerance * len(row['angles']):
+            violations.append(
+                {'number': row['number'], 'kind': 'closure',
+                 'value': row['closure']})
+    return violations
+
+
+def format_violations(violations):
+    """Returns violations of verify_rows as text."""
+    note = 'Seams are checked for bricks laid from the first seam of every' \
+        ' row turned by the best angle from the row below.'
+    if not violations:
+        return 'All seams are covered and all rings close.\n' + note
+    messages = {
+        'seam': 'seams of the row below are {} mm away',
+        'closure': 'ring closure error is {} mm',
+    }
+    return '\n'.join([
+        '#{}: {}'.format(
+            x['number'],
+            messages[x['kind']].format(float_format(x['value'])))
+        for x in violations] + [note])
+
+
+def get_polygon_centroid(points):
+    """Returns centroid (x, y) of the polygon given by (x, y) vertices."""
+    area = 0.0
+    cx = 0.0
+    cy = 0.0
+    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+        cross = x1 * y2 - x2 * y1
+        area += cross
+        cx += (x1 + x2) * cross
+        cy += (y1 + y2) * cross
+    if not area:
+        return (sum(x[0] for x in points) / len(points),
+                sum(x[1] for x in points) / len(points))
+    return cx / (3 * area), cy / (3 * area)
+
+
+def get_thrust_line(geometry, density=2000.0):
+    """Returns thrust line of the dome and courses where it's unsafe.
+
+    Slice of the dome one radian wide is analysed as an arch: hoop forces
+    are ignored, which is conservative. Weight of every course and of the
+    key bricks (disc laid on top of the last row) is taken from the bill
+    of materials. Horizontal thrust at the crown is chosen so the thrust
+    line passes through the middle of the top joint of the last row and
+    the middle of the bottom joint of the first dome row, then the thrust
+    line is found at the bottom joint of every course.
+
+    Args:
+        geometry(DomeGeometry): result of get_dome_geometry.
+        density(float): brick density (kg/m3).
+
+    Returns:
+        dict: `thrust` (horizontal thrust, N per radian) and `rows` (list of
+            dicts with `number`, `load` (vertical load on the bottom joint,
+            N per radian), `position` (where the thrust line crosses the
+            bottom joint, 0 at the inner side, 1 at the outer side) and
+            `inside` (True if the position is within the middle third)).
+
+    """
+    axis_x = geometry.dome_circle_center_point.x
+    floor_y = geometry.surface_circle_center_point.y
+
+    def to_section(point):
+        return (axis_x - point.x, floor_y - point.y)
+
+    bom = get_bill_of_materials(geometry, brick_density=density)
+    weight_factor = density * 9.81 / 1e9 / (2 * math.pi)
+    courses = []
+    for row, bom_row in zip(
+            [geometry.first_row] + [x.row for x in geometry.rows],
+            bom['rows']):
+        inner = to_section(row.bottom_inner_point)
+        outer = to_section(row.bottom_outer_point)
+        centroid = get_polygon_centroid([
+            outer, to_section(row.top_outer_point),
+            to_section(row.top_inner_point), inner])
+        courses.append((
+            row.number, inner, outer, centroid[0],
+            bom_row['brick_volume'] * weight_factor))
+
+    last_row = geometry.last_row
+    top_inner = to_section(last_row.top_inner_point)
+    top_outer = to_section(last_row.top_outer_point)
+    crown = ((top_inner[0] + top_outer[0]) / 2.0,
+             (top_inner[1] + top_outer[1]) / 2.0)
+    key_radius = geometry.rows[-1].horizontal_top_outer_radius
+    key_load = math.pi * key_radius ** 2 * geometry.brick_height \
+        * weight_factor
+
+    # Vertical load and its moment arm sum above every joint, top down.
+    loads = []
+    load = key_load
+    moment = key_load * crown[0]
+    for number, inner, outer, centroid_x, weight in reversed(courses):
+        load += weight
+        moment += weight * centroid_x
+        loads.append((number, inner, outer, load, moment))
+    loads.reverse()
+
+    # Moment of crown thrust and loads above the joint point is zero:
+    # thrust * (crown_y - y) = load * x - moment.
+    def get_position(thrust, inner, outer, load, moment):
+        dx = outer[0] - inner[0]
+        dy = outer[1] - inner[1]
+        divider = load * dx + thrust * dy
+        if not divider:
+            return None
+        return (moment - load * inner[0] + thrust * (crown[1] - inner[1])) \
+            / divider
+
+    _, inner, outer, load, moment = loads[1]
+    middle = ((inner[0] + outer[0]) / 2.0, (inner[1] + outer[1]) / 2.0)
+    thrust = (load * middle[0] - moment) / (crown[1] - middle[1])
+
+    rows = []
+    for number, inner, outer, load, moment in loads:
+        position = get_position(thrust, inner, outer, load, moment)
+        rows.append({
+            'number': number,
+            'load': load,
+            'position': position,
+            'inside': position is not None and 1 / 3.0 <= position <= 2 / 3.0,
+        })
+    return {'thrust': thrust, 'rows': rows}
+
+
+def format_thrust_line(thrust_line):
+    """Returns thrust line as a text table."""
+    lines = ['thrust: {} N per radian'.format(
+        float_format(thrust_line['thrust']))]
+    lines.append('{:>6} {:>10} {:>9} {:>7}'.format(
+        'row', 'load(N)', 'position', 'safe'))
+    for row in thrust_line['rows']:
+        lines.append('{:>6} {:>10} {:>9} {:>7}'.format(
+            f'#{row["number"]}', float_format(row['load']),
+            '-' if row['position'] is None
+            else '{:.2f}'.format(row['position']),
+            'yes' if row['inside'] else 'no'))
+    return '\n'.join(lines)
+
+
+def get_brick_solid(profile, widths):
+    """Returns vertices and triangles of the brick.
+
+    Args:
+        profile(list): (radius, height) of bottom outer, top outer,
+            top inner and bottom inner corners of the row cross-section.
+        widths(list): brick width along the circumference for every
+            corner of the profile.
+
+    Returns:
+        tuple(vertices (list of (x, y, z)), triangles (list of indices)):
+            x is directed from the dome axis to the brick, y is up, z is
+            along the circumference.
+    """
+    vertices = []
+    for (radius, height), width in zip(profile, widths):
+        vertices.append((radius, height, -width / 2.0))
+        vertices.append((radius, height, width / 2.0))
+
+    faces = [
+        (0, 2, 4, 6),  # -z side
+        (1, 3, 5, 7),  # +z side
+        (0, 1, 3, 2),  # outer side
+        (4, 5, 7, 6),  # inner side
+        (2, 3, 5, 4),  # top
+        (6, 7, 1, 0),  # bottom
+    ]
+    center = [sum(x[i] for x in vertices) / len(vertices) for i in range(3)]
+    triangles = []
+    for face in faces:
+        for triangle in ((face[0], face[1], face[2]),
+                         (face[0], face[2], face[3])):
+            p0, p1, p2 = [vertices[x] for x in triangle]
+            u = [p1[i] - p0[i] for i in range(3)]
+            v = [p2[i] - p0[i] for i in range(3)]
+            normal = (u[1] * v[2] - u[2] * v[1],
+                      u[2] * v[0] - u[0] * v[2],
+                      u[0] * v[1] - u[1] * v[0])
+            outside = sum(normal[i] * (p0[i] - center[i]) for i in range(3))
+            if outside < 0:
+                # Keep counter-clockwise order for outer side of the face.
+                triangle = (triangle[0], triangle[2], triangle[1])
+            triangles.extend(triangle)
+    return vertices, triangles
+
+
+def get_dome_bricks(geometry):
+    """Returns bricks of the dome as shapes and their placement.
+
+    Returns:
+        list of tuple(row number, profile, widths, bricks amount,
+            start angle): profile and widths are in get_brick_solid format.
+            Bricks of the row are placed evenly starting from start angle.
+    """
+    axis_x = geometry.dome_circle_center_point.x
+    floor_y = geometry.surface_circle_center_point.y
+
+    def to_profile(points):
+        return [(axis_x - x.x, floor_y - x.y) for x in points]
+
+    first_row = geometry.first_row
+    seams = get_seam_angles(geometry)
+    bricks = [(
+        first_row.number,
+        to_profile([
+            first_row.bottom_outer_point, first_row.top_outer_point,
+            first_row.top_inner_point, first_row.bottom_inner_point]),
+        [geometry.brick_height] * 4,
+        seams[0][1],
+        seams[0][2] - math.pi / seams[0][1])]
+
+    for template, (_, amount, seam_angle) in zip(geometry.rows, seams[1:]):
+        row = template.row
+        # Bricks are centered between seams, see get_seam_angles.
+        bricks.append((
+            template.number,
+            to_profile([
+                row.bottom_outer_point, row.top_outer_point,
+                row.top_inner_point, row.bottom_inner_point]),
+            [template.bottom_outer_width, template.top_outer_width,
+             template.top_inner_width, template.bottom_inner_width],
+            amount,
+            seam_angle - math.pi / amount))
+    return bricks
+
+
+def build_gltf(geometry):
+    """Returns binary glTF (glb) content with 3D model of the dome.
+
+    Every row has one mesh, every brick is a node referencing the mesh
+    of its row, so the geometry is not duplicated. Units are meters.
+    """
+    meshes = {}
+    mesh_list = []
+    nodes = []
+    accessors = []
+    buffer_views = []
+    binary = bytearray()
+
+    def add_view(data, target):
+        while len(binary) % 4:
+            binary.append(0)
+        buffer_views.append({
+            'buffer': 0, 'byteOffset': len(binary),
+            'byteLength': len(data), 'target': target})
+        binary.extend(data)
+        return len(buffer_views) - 1
+
+    indices_accessor = None
+    for number, profile, widths, amount, start_angle in \
+            get_dome_bricks(geometry):
+        vertices, triangles = get_brick_solid(profile, widths)
+        vertices = [tuple(round(c / 1000.0, 6) for c in x) for x in vertices]
+        key = tuple(vertices)
+        if key not in meshes:
+            if indices_accessor is None:
+                # Triangles are the same for every brick.
+                view = add_view(
+                    struct.pack(f'<{len(triangles)}H', *triangles), 34963)
+                accessors.append({
+                    'bufferView': view, 'componentType': 5123,
+                    'count': len(triangles), 'type': 'SCALAR'})
+                indices_accessor = len(accessors) - 1
+            flat = [c for x in vertices for c in x]
+            view = add_view(struct.pack(f'<{len(flat)}f', *flat), 34962)
+            accessors.append({
+                'bufferView': view, 'componentType': 5126,
+                'count': len(vertices), 'type': 'VEC3',
+                'min': [min(x[i] for x in vertices) for i in range(3)],
+                'max': [max(x[i] for x in vertices) for i in range(3)]})
+            mesh_list.append({
+                'name': f'row-{number}',
+                'primitives': [{
+                    'attributes': {'POSITION': len(accessors) - 1},
+                    'indices': indices_accessor}]})
+            meshes[key] = len(mesh_list) - 1
+
+        for i in range(amount):
+            angle = start_angle + 2 * math.pi * i / amount
+            nodes.append({
+                'name': f'row-{number}-brick-{i + 1}',
+                'mesh': meshes[key],
+                'rotation': [
+                    0.0, math.sin(angle / 2.0), 0.0, math.cos(angle / 2.0)]})
+
+    while len(binary) % 4:
+        binary.append(0)
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'domebricks.py'},
+        'scene': 0,
+        'scenes': [{'nodes': [len(nodes)]}],
+        'nodes': nodes + [
+            {'name': 'dome', 'children': list(range(len(nodes)))}],
+        'meshes': mesh_list,
+        'accessors': accessors,
+        'bufferViews': buffer_views,
+        'buffers': [{'byteLength': len(binary)}],
+    }
+    content = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    content += b' ' * (-len(content) % 4)
+
+    return b''.join([
+        struct.pack(
+            '<4sII', b'glTF', 2, 12 + 8 + len(content) + 8 + len(binary)),
+        struct.pack('<I4s', len(content), b'JSON'), content,
+        struct.pack('<I4s', len(binary), b'BIN\x00'), bytes(binary)])
+
+
+def build_svg(
+        scale=3.78,  # 1 mm == 1mm
+        brick_width=250.0,
+        brick_height=65.0,
+        brick_depth=120.0,
+        surface_inner_radius=503.0,
+        height=440.0,
+        support_template_step=3,
+        first_row_height=125.0,
+        seam=3.0,
+        door_height=265,
+        bricks_amount=None,
+        minimal_width=40,
+        imposition=False,
+        bricks_amounts=None,
+        cancel_token=None,
+        detail=DETAIL_FULL,
+        place_labels=False,
+        svg_filename='dome.svg',
+        pdf_filename='row-templates.pdf'):
+    """Returns svg content of a dome.
+
+    Args:
+        scale(float, default=3.78): scale of the svg
+        brick_width(float): width of the brick
+        brick_height(float): height of the brick
+        brick_depth(float): depth of the brick
+        surface_inner_radius(float, default=503): 503 is about
+            diameter=42 inches.
+        height(float): height of the dome in the center
+        first_row_height(float): height of the soldier brick from first row
+        seam(float): seam of the masonry
+        bricks_amount(int or None): force bricks amount
+            in the row to that value (if possible)
+        minimal_width(int): if inner brick size is less then
+            that value, brick of the new row will cover 2 bricks
+            from the bottom
+        imposition(bool): pack row templates to as few pdf pages as
+            possible
+        bricks_amounts(list or None): bricks amount for every row after
+            the soldier one (see optimize_bricks_amounts), overrides
+            bricks_amount and minimal_width. Rows after the last amount
+            keep it.
+        cancel_token(CancelToken or None): checked by solver loops to stop
+            the build (see build_svg_async)
+        detail(int): level of detail of the svg, DETAIL_OUTLINE for
+            previews, DETAIL_DIMENSIONS adds distances and DETAIL_FULL
+            point markers, labels and all support template details
+        place_labels(bool): move point labels and distances outside of
+            paths to avoid overlaps (see label_placement)
+        svg_filename(str or None): svg file to write, not written if None
+        pdf_filename(str, file or None): pdf file of row templates (see
+            render_templates_pdf), not rendered if None
+
+    Returns:
+        str: svg content
+
+    """
+
+    # Params verification.
+
+    if not bricks_amount and not bricks_amounts:
+        raise ValueError(
+            'Invalid bricks_amount. Expecting > 0.')
+
+    # Sizes and their combinations are verified by get_dome_geometry, see
+    # validate_params.
+
+    geometry = get_dome_geometry(
+        brick_width=brick_width,
+        brick_height=brick_height,
+        brick_depth=brick_depth,
+        surface_inner_radius=surface_inner_radius,
+        height=height,
+        first_row_height=first_row_height,
+        seam=seam,
+        bricks_amount=bricks_amount,
+        minimal_width=minimal_width,
+        bricks_amounts=bricks_amounts,
+        cancel_token=cancel_token)
+
+    if cancel_token:
+        cancel_token.check()
+    if pdf_filename is not None:
+        render_templates_pdf(
+            geometry, filename=pdf_filename, imposition=imposition,
+            cancel_token=cancel_token)
+
+    total_layout = render_dome_svg(
+        geometry, scale=scale, support_template_step=support_template_step,
+        cancel_token=cancel_token, detail=detail,
+        place_labels=place_labels)
+    if svg_filename is not None:
+        with open(svg_filename, 'w') as f:
+            f.write(total_layout)
+
+    # See write_svg_fragments for svg of every row.
+    return total_layout
+
+
+def render_dome_svg(
+        geometry, scale=3.78, support_template_step=3, cancel_token=None,
+        detail=DETAIL_FULL, place_labels=False):
+    """Returns svg content with the dome section and support template.
+
+    Args:
+        geometry(DomeGeometry): see get_dome_geometry.
+        scale, support_template_step, cancel_token, detail, place_labels:
+            see build_svg.
+    """
+    if detail == DETAIL_OUTLINE:
+        # Labels and colored points of the support template are details.
+        support_template_step = min(support_template_step, 1)
+    placement = label_placement() if place_labels \
+        else contextlib.nullcontext()
+    with svg_detail(detail), placement:
+        return '\n'.join([str(x) for x in get_dome_elems(
+            geometry, scale=scale,
+            support_template_step=support_template_step,
+            cancel_token=cancel_token) if x])
+
+
+def get_dome_elems(
+        geometry, scale=3.78, support_template_step=3, cancel_token=None):
+    # Returns svg elements of render_dome_svg.
+    brick_width = geometry.brick_width
+    brick_height = geometry.brick_height
+    brick_depth = geometry.brick_depth
+    surface_inner_radius = geometry.surface_inner_radius
+    height = geometry.height
+    seam = geometry.seam
+
+    # Debugging scales.
+    # scale /= 2
+    # scale /= 5
+    # scale /= 10
+
+    elems = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+        '''<svg version="1.1"
+                width="1500mm"
+                height="1000mm"
+                xmlns="http://www.w3.org/2000/svg" >''',
+        '<g transform="scale({scale})">'
+    ]
+
+    warning_part1 = 'Warning: Pre-alfa release of the script. Use it on your own risk, I don\'t'  # noqa: E501
+    warning_part2 = 'guarantee correctness of any value computed here.'
+    warning_elems = [
+        f'''<text x="100" y="50" font-size="30" fill="brown">
+                {warning_part1}
+            </text>''',
+        f'''<text x="100" y="86" font-size="30" fill="brown">
+                {warning_part2}
+            </text>''']
+    if SVG_DETAIL.get() > DETAIL_OUTLINE:
+        elems.extend(warning_elems)
+
+    cx = 200 + surface_inner_radius
+    cy = 160 + surface_inner_radius
+
+    # Debug output
+    # Inner circle.
+    # elems.append(
+    #     '<circle cx="{}" cy="{}" r="{}" fill="gray" fill-opacity="0.6"/>'
+    #    .format(cx, cy, surface_inner_radius))
+    #
+    # Outer circle
+    # elems.append(
+    #     '<circle cx="{}" cy="{}" r="{}" fill="gray" fill-opacity="0.6"/>'
+    #     .format(cx, cy, surface_inner_radius + brick_width / 2.0))
+
+    # Draw center line.
+    radian = math.pi / 2.0
+    center_line_x = cx \
+        + (surface_inner_radius + brick_width / 2.0 + 100) \
+        * math.cos(radian)
+    center_line_y = cy \
+        - (surface_inner_radius + brick_width / 2.0 - 70) \
+        * math.sin(radian)
+    elems.append(
+        f'''<line x1="{cx}"
+                  y1="{cy}"
+                  x2="{center_line_x}"
+                  y2="{center_line_y}"
+                  stroke-width="2"
+                  stroke="black" />''')
+
+    surface_circle_center_point = geometry.surface_circle_center_point
+    elems.append(surface_circle_center_point.as_csv(fill='green'))
+
+    height_inner_point = geometry.height_inner_point
+    elems.append(height_inner_point.as_csv())
+    elems.append(
+        Path(height_inner_point, surface_circle_center_point)
+        .as_csv(stroke='green'))
+
+    dome_circle_center_point = geometry.dome_circle_center_point
+    first_row = geometry.first_row
+    elems.append(geometry.first_row_radian_point.as_csv())
+
+    # Show dome bottom
+    elems.extend(
+        get_floor_elems(
+            first_row, surface_circle_center_point,
+            surface_inner_radius, brick_height, brick_depth))
+
+    # Debug print:
+    # Line1
+    # elems.append(
+    #    Path(first_row.top_outer_point, dome_circle_center_point)
+    #    .as_csv(stroke='green'))
+    #
+    # Line2
+    # elems.append(
+    #    Path(first_row.bottom_inner_point, first_row.top_inner_point)
+    #    .as_csv(stroke='green'))
+
+    elems.append(
+        Path(first_row.top_inner_point, dome_circle_center_point)
+        .as_csv(stroke='gray', inner_text=True))
+
+    #
+    # Prepare and display brick of (vertical/soldier) row.
+    #
+    vertical_brick_elems = get_vertical_brick_elems(first_row)
+    elems.extend(vertical_brick_elems)
+
+    # Debug:
+    # Display dome radius circle
+    # elems.append(
+    #     '''<circle cx="{dome_circle_center_point.x}"
+    #                cy="{dome_circle_center_point.y}"
+    #                r="{dome_radius}"
+    #                stroke-width="3"
+    #                stroke="green"
+    #                fill-opacity="0.6"/>''')
+
+    for template in geometry.rows:
+        if cancel_token:
+            cancel_token.check()
+        row_instance = template.row
+
+        # Display brick points.
+        row_brick_elems = row_instance.get_brick_elems()
+        elems.extend(row_brick_elems)
+
+        # Show the distance from the top inner corner to center.
+        elems.append(
+            Path(row_instance.top_inner_point, dome_circle_center_point)
+            .as_csv(stroke='gray', inner_text=True))
+
+    support_template_elems = get_support_template_elems(
+        surface_circle_center_point,
+        dome_circle_center_point, first_row, height_inner_point,
+        geometry.last_row,
+        seam=seam, template_width=surface_inner_radius, template_height=height,
+        support_template_step=support_template_step,
+        cancel_token=cancel_token)
+
+    elems.extend(support_template_elems)
+
+    # Show key brick template.
+    # FIXME: Implement
+    # y_offset += 300
+    # elems.extend(
+    #     get_key_brick_templates(
+    #         key_brick_radius4, get_distance(h_point, g_point),
+    #         y_offset, brick_width=brick_width))
+
+    elems.append('</g></svg>')
+    return elems
+
+
+def get_bounds(points, margin=0):
+    """Returns (x, y, width, height) box of the points with the margin."""
+    xs = [x.x for x in points]
+    ys = [x.y for x in points]
+    return (min(xs) - margin, min(ys) - margin,
+            max(xs) - min(xs) + 2 * margin, max(ys) - min(ys) + 2 * margin)
+
+
+def render_svg_fragment(elems, bounds):
+    """Returns standalone svg of the elems cropped to bounds.
+
+    Units are mm as in dome.svg, so the fragment is printed in scale.
+    """
+    x, y, width, height = [round(x, 1) for x in bounds]
+    return '\n'.join([
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+        f'''<svg version="1.1"
+                width="{width}mm"
+                height="{height}mm"
+                viewBox="{x} {y} {width} {height}"
+                xmlns="http://www.w3.org/2000/svg" >'''
+    ] + [str(x) for x in elems] + ['</svg>'])
+
+
+def get_row_svg_fragment(geometry, number, margin=40):
+    """Returns (svg, bounds) of the row section of the dome.
+
+    Args:
+        geometry(DomeGeometry): see get_dome_geometry.
+        number(int): row number, 1 is the soldier row.
+        margin(float): space around the row for labels (mm).
+    """
+    if number == 1:
+        row = geometry.first_row
+        elems = get_vertical_brick_elems(row)
+    else:
+        rows = [x.row for x in geometry.rows if x.number == number]
+        if not rows:
+            raise ValueError(f'Invalid row number {number}.')
+        row = rows[0]
+        elems = row.get_brick_elems()
+    bounds = get_bounds(
+        [row.bottom_outer_point, row.top_outer_point, row.top_inner_point,
+         row.bottom_inner_point], margin=margin)
+    return render_svg_fragment(elems, bounds), bounds
+
+
+def get_template_svg_fragment(template, brick_width=250.0, margin=40):
+    """Returns (svg, bounds) of the unfolded A-H cut template of the row.
+
+    Sides are laid out as in render_row_brick_template: AB, CD, EF and GH
+    from top to bottom.
+    """
+    row = template.row
+    a_point = template.a_point
+    b_point = template.b_point
+    c_point = template.c_point
+    d_point = template.d_point
+    e_point = template.e_point
+    f_point = template.f_point
+    g_point = template.g_point
+    h_point = template.h_point
+
+    length_diff1 = (b_point.x - a_point.x) - (f_point.x - e_point.x)
+    length_diff2 = (b_point.x - a_point.x) - (c_point.x - d_point.x)
+    length_diff3 = (c_point.x - d_point.x) - (g_point.x - h_point.x)
+    a = Point('A', 0, 0)
+    b = Point('B', get_distance(e_point, f_point), 0)
+    c = Point('C', -length_diff1 / 2, row.brick_height)
+    d = Point('D', b.x + length_diff1 / 2, row.brick_height)
+    e = Point('E', c.x + length_diff2 / 2, c.y + brick_width / 2)
+    f = Point('F', d.x - length_diff2 / 2, e.y)
+    g = Point('G', e.x + length_diff3 / 2, e.y + row.brick_height)
+    h = Point('H', f.x - length_diff3 / 2, g.y)
+
+    elems = [
+        Path(a, b).as_csv(dasharray=True),
+        Path(c, d).as_csv(),
+        Path(e, f).as_csv(),
+        Path(g, h).as_csv(dasharray=True, inner_text=True),
+    ]
+    for p1, p2 in ((a, c), (b, d), (c, e), (d, f), (e, g), (f, h)):
+        elems.append(Path(p1, p2).as_csv(inner_text=p1.x > p2.x))
+    elems.extend(x.as_csv() for x in (a, b, c, d, e, f, g, h))
+    if SVG_DETAIL.get() > DETAIL_OUTLINE:
+        elems.append(
+            f'''<text x="{c.x + 20}" y="{c.y + 40}" font-size="14">
+                Row #{template.number}, bricks_amount:
+                {template.bricks_amount}
+            </text>''')
+    bounds = get_bounds([a, b, c, d, e, f, g, h], margin=margin)
+    return render_svg_fragment(elems, bounds), bounds
+
+
+def write_svg_fragments(geometry, path='.', detail=DETAIL_FULL):
+    """Writes row-N.svg and template-N.svg of every row to the directory.
+
+    detail is the level of detail of the fragments, see build_svg.
+
+    Returns:
+        list of str: written files.
+    """
+    files = []
+    with svg_detail(detail):
+        fragments = [('row-1.svg', get_row_svg_fragment(geometry, 1))]
+        for template in geometry.rows:
+            fragments.append((
+                f'row-{template.number}.svg',
+                get_row_svg_fragment(geometry, template.number)))
+            fragments.append((
+                f'template-{template.number}.svg',
+                get_template_svg_fragment(
+                    template, brick_width=geometry.brick_width)))
+    for filename, (svg, _) in fragments:
+        files.append(os.path.join(path, filename))
+        with open(files[-1], 'w') as f:
+            f.write(svg)
+    return files
+
+
+PLOT_TARGETS = ('support', 'dome', 'templates')
+PLOT_FORMATS = ('hpgl', 'gcode', 'svg')
+# Plotter units of HPGL per mm.
+HPGL_UNITS = 40
+
+
+def get_plot_segments(geometry, target='support', support_template_step=3,
+                      spacing=20.0):
+    """Returns line segments of the target in svg coordinates (mm).
+
+    Args:
+        geometry(DomeGeometry): see get_dome_geometry.
+        target(str): 'support' template to cut from plywood, 'dome'
+            section or 'templates' of rows cut sides (see
+            get_template_svg_fragment) placed from top to bottom.
+        support_template_step(int): see build_svg.
+        spacing(float): distance between templates (mm).
+
+    Returns:
+        list: (stroke, (x1, y1), (x2, y2)) of every segment in the order
+            of the svg.
+    """
+    if target not in PLOT_TARGETS:
+        raise ValueError(f'Invalid plot target {target}.')
+    with plot_recording() as segments, svg_detail(DETAIL_OUTLINE):
+        if target == 'dome':
+            get_dome_elems(
+                geometry, support_template_step=support_template_step)
+        elif target == 'support':
+            get_support_template_elems(
+                geometry.surface_circle_center_point,
+                geometry.dome_circle_center_point, geometry.first_row,
+                geometry.height_inner_point, geometry.last_row,
+                seam=geometry.seam,
+                template_width=geometry.surface_inner_radius,
+                template_height=geometry.height,
+                support_template_step=support_template_step)
+        else:
+            top = 0.0
+            for template in geometry.rows:
+                start = len(segments)
+                _, (x, y, _, height) = get_template_svg_fragment(
+                    template, brick_width=geometry.brick_width, margin=0)
+                segments[start:] = [
+                    (stroke, (p1[0] - x, p1[1] - y + top),
+                     (p2[0] - x, p2[1] - y + top))
+                    for stroke, p1, p2 in segments[start:]]
+                top += height + spacing
+    return segments
+
+
+def merge_segments(segments, tolerance=0.01):
+    """Joins connected segments to polylines without collinear vertices.
+
+    Ends closer than the tolerance are joined, repeated segments (e.g.
+    sides shared by neighbour bricks) are drawn once. Chains go straight
+    through junctions, so collinear segments end up in one line.
+
+    Args:
+        segments(list): ((x1, y1), (x2, y2)) of every segment.
+        tolerance(float): distance of joined ends and of vertices to the
+            line they are dropped from (mm).
+
+    Returns:
+        list: polylines, lists of (x, y).
+    """
+    def get_key(point):
+        return (round(point[0] / tolerance), round(point[1] / tolerance))
+
+    def get_cosine(previous, current, following):
+        x1, y1 = current[0] - previous[0], current[1] - previous[1]
+        x2, y2 = following[0] - current[0], following[1] - current[1]
+        return (x1 * x2 + y1 * y2) / (
+            math.hypot(x1, y1) * math.hypot(x2, y2))
+
+    points = {}
+    adjacency = collections.defaultdict(list)
+    edges = set()
+    for p1, p2 in segments:
+        key1 = get_key(p1)
+        key2 = get_key(p2)
+        edge = (min(key1, key2), max(key1, key2))
+        if key1 == key2 or edge in edges:
+            continue
+        edges.add(edge)
+        points.setdefault(key1, p1)
+        points.setdefault(key2, p2)
+        adjacency[key1].append(key2)
+        adjacency[key2].append(key1)
+
+    polylines = []
+    # Chains start at odd vertices (ends of lines) first, closed chains
+    # anywhere.
+    starts = [x for x in adjacency if len(adjacency[x]) % 2]
+    for start in starts + list(adjacency):
+        while adjacency[start]:
+            chain = [start]
+            while adjacency[chain[-1]]:
+                current = chain[-1]
+                neighbours = adjacency[current]
+                following = neighbours[0]
+                if len(chain) > 1 and len(neighbours) > 1:
+                    following = max(neighbours, key=lambda x: get_cosine(
+                        points[chain[-2]], points[current], points[x]))
+                neighbours.remove(following)
+                adjacency[following].remove(current)
+                chain.append(following)
+
+            polyline = [points[chain[0]]]
+            for key, following in zip(chain[1:], chain[2:]):
+                previous = polyline[-1]
+                point = points[key]
+                following = points[following]
+                x1, y1 = point[0] - previous[0], point[1] - previous[1]
+                x2, y2 = following[0] - previous[0], following[1] - previous[1]
+                # Vertex is dropped if it is on the line and goes forward.
+                offset = abs(x1 * y2 - y1 * x2) / (math.hypot(x2, y2) or 1.0)
+                if x1 * (x2 - x1) + y1 * (y2 - y1) <= 0 or offset > tolerance:
+                    polyline.append(point)
+            polyline.append(points[chain[-1]])
+            polylines.append(polyline)
+    return polylines
+
+
+def get_travel_distance(polylines, start=(0.0, 0.0)):
+    """Returns pen-up travel drawing the polylines in the order (mm)."""
+    distance = 0.0
+    position = start
+    for polyline in polylines:
+        distance += math.hypot(
+            polyline[0][0] - position[0], polyline[0][1] - position[1])
+        position = polyline[-1]
+    return distance
+
+
+def order_polylines(polylines, start=(0.0, 0.0), window=64, passes=8):
+    """Orders and reverses polylines to reduce pen-up travel.
+
+    The next polyline is the one with the nearest end (nearest neighbour
+    tour). Ends are kept in a uniform grid, so every step only checks cells
+    around the pen. Then 2-opt reverses parts of the tour (up to window
+    polylines long) while it shortens the travel.
+
+    Args:
+        polylines(list): lists of (x, y).
+        start(tuple): (x, y) of the pen before drawing.
+        window(int): maximal amount of polylines reversed by 2-opt.
+        passes(int): maximal amount of 2-opt passes over the tour.
+
+    Returns:
+        list: polylines in drawing order, some of them reversed.
+    """
+    if not polylines:
+        return []
+    xs = [x[i][0] for x in polylines for i in (0, -1)]
+    ys = [x[i][1] for x in polylines for i in (0, -1)]
+    cell_size = math.sqrt(
+        (max(xs) - min(xs)) * (max(ys) - min(ys)) / len(polylines))
+    if not cell_size:
+        # Ends are on a line or at one point, so cells are the mean gap
+        # between ends along it. The pen start counts as well, the first
+        # search would go through the gap to it cell by cell otherwise.
+        xs.append(start[0])
+        ys.append(start[1])
+        cell_size = max(
+            max(xs) - min(xs), max(ys) - min(ys)) / len(polylines)
+    if not cell_size:
+        # All ends are at the start, the first cell has them all.
+        cell_size = 1.0
+
+    def get_cell(point):
+        return (int(math.floor(point[0] / cell_size)),
+                int(math.floor(point[1] / cell_size)))
+
+    def get_ring(column, row, ring):
+        if not ring:
+            return [(column, row)]
+        cells = []
+        for x in range(-ring, ring + 1):
+            cells.extend([(column + x, row - ring), (column + x, row + ring)])
+        for y in range(-ring + 1, ring):
+            cells.extend([(column - ring, row + y), (column + ring, row + y)])
+        return cells
+
+    grid = collections.defaultdict(list)
+    for index, polyline in enumerate(polylines):
+        grid[get_cell(polyline[0])].append((index, 0))
+        grid[get_cell(polyline[-1])].append((index, -1))
+    used = [False] * len(polylines)
+    tour = []
+    position = start
+    for _ in polylines:
+        column, row = get_cell(position)
+        best = best_distance = None
+        ring = 0
+        # Cells of the next ring are at least (ring - 1) cells away.
+        while best is None or best_distance > (ring - 1) * cell_size:
+            for cell in get_ring(column, row, ring):
+                ends = grid.get(cell)
+                if not ends:
+                    continue
+                ends[:] = [x for x in ends if not used[x[0]]]
+                for index, end in ends:
+                    point = polylines[index][end]
+                    distance = math.hypot(
+                        point[0] - position[0], point[1] - position[1])
+                    if best is None or distance < best_distance:
+                        best, best_distance = (index, end), distance
+            ring += 1
+        index, end = best
+        used[index] = True
+        tour.append(polylines[index][::-1] if end else polylines[index])
+        position = tour[-1][-1]
+
+    for _ in range(passes):
+        improved = False
+        for i in range(len(tour)):
+            before = tour[i - 1][-1] if i else start
+            for j in range(i, min(len(tour), i + window)):
+                first = tour[i][0]
+                last = tour[j][-1]
+                delta = math.hypot(last[0] - before[0], last[1] - before[1]) \
+                    - math.hypot(first[0] - before[0], first[1] - before[1])
+                if j + 1 < len(tour):
+                    after = tour[j + 1][0]
+                    delta += \
+                        math.hypot(after[0] - first[0], after[1] - first[1]) \
+                        - math.hypot(after[0] - last[0], after[1] - last[1])
+                if delta < -1e-9:
+                    tour[i:j + 1] = [x[::-1] for x in reversed(tour[i:j + 1])]
+                    improved = True
+        if not improved:
+            break
+    return tour
+
+
+def format_hpgl(layers):
+    """Returns HPGL program drawing every layer with its own pen.
+
+    Args:
+        layers(list): (stroke, polylines) in plotter coordinates (mm).
+    """
+    commands = ['IN']
+    for number, (_, polylines) in enumerate(layers):
+        commands.append(f'SP{number % 8 + 1}')
+        for polyline in polylines:
+            x, y = [round(x * HPGL_UNITS) for x in polyline[0]]
+            commands.append(f'PU{x},{y}')
+            commands.append('PD' + ','.join(
+                str(round(x * HPGL_UNITS)) for x in itertools.chain(
+                    *polyline[1:])))
+    commands.extend(['PU', 'SP0'])
+    return ';\n'.join(commands) + ';\n'
+
+
+def format_gcode(layers, feed=1000):
+    """Returns G-code program, M3/M5 switch the laser (or pen) on and off.
+
+    Args:
+        layers(list): (stroke, polylines) in plotter coordinates (mm).
+        feed(float): drawing speed (mm/min).
+    """
+    lines = ['G21', 'G90', 'M5']
+    for stroke, polylines in layers:
+        lines.append(f'; {stroke}')
+        for polyline in polylines:
+            lines.append('G0 X{:.3f} Y{:.3f}'.format(*polyline[0]))
+            lines.append('M3')
+            lines.extend(
+                'G1 X{:.3f} Y{:.3f} F{}'.format(x, y, feed)
+                for x, y in polyline[1:])
+            lines.append('M5')
+    lines.extend(['G0 X0 Y0', 'M2'])
+    return '\n'.join(lines) + '\n'
+
+
+def format_plot_svg(layers):
+    """Returns svg with a path for every polyline in drawing order.
+
+    Args:
+        layers(list): (stroke, polylines) in plotter coordinates (mm).
+    """
+    points = [x for _, polylines in layers for y in polylines for x in y]
+    width = round(max(x[0] for x in points), 3)
+    height = round(max(x[1] for x in points), 3)
+    elems = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+        f'''<svg version="1.1"
+                width="{width}mm"
+                height="{height}mm"
+                viewBox="0 0 {width} {height}"
+                xmlns="http://www.w3.org/2000/svg" >''',
+        # Plotter y axis goes up.
+        f'<g transform="matrix(1 0 0 -1 0 {height})">']
+    for stroke, polylines in layers:
+        for polyline in polylines:
+            elems.append(
+                f'<path stroke="{stroke}" stroke-width="0.5" fill="none"'
+                ' d="M{}" />'.format(' L'.join(
+                    '{:.3f},{:.3f}'.format(*x) for x in polyline)))
+    elems.append('</g></svg>')
+    return '\n'.join(elems)
+
 
-        horizontal_outer_top_distance_point = Point(
-            f'{rows_counter}', dome_circle_center_point.x,
-            row_instance.top_outer_point.y)
+PLOT_FORMATTERS = {
+    'hpgl': format_hpgl,
+    'gcode': format_gcode,
+    'svg': format_plot_svg,
+}
 
-        # Display brick points.
-        row_brick_elems = row_instance.get_brick_elems()
-        elems.extend(row_brick_elems)
 
-        # Show the distance from the top inner corner to center.
-        elems.append(
-            Path(row_instance.top_inner_point, dome_circle_center_point)
-            .as_csv(stroke='gray', inner_text=True))
+def build_plot(geometry, target='support', plot_format='hpgl',
+               support_template_step=3, tolerance=0.01):
+    """Returns plotter (or laser cutter) program of the target.
 
-        row_initial_y = y_offset
-        y_offset += 450
+    Segments are moved to the plotter coordinates (origin at the bottom
+    left corner, y axis goes up), grouped by stroke color to layers drawn
+    with their own pen, merged to polylines (see merge_segments) and
+    ordered to reduce pen-up travel (see order_polylines).
 
-        #
-        # Prepare cut schemes (sizes and angle)
-        #
-        horizontal_distance_bottom_point = Point(
-            f'#{rows_counter}', dome_circle_center_point.x,
-            row_instance.bottom_outer_point.y)
-        horizontal_bottom_outer_radius = get_distance(
-            row_instance.bottom_outer_point, horizontal_distance_bottom_point)
+    Args:
+        geometry(DomeGeometry): see get_dome_geometry.
+        target(str): see get_plot_segments.
+        plot_format(str): 'hpgl', 'gcode' or 'svg'.
+        support_template_step(int): see build_svg.
+        tolerance(float): see merge_segments.
 
-        if rows_counter == 2 and bricks_amount is None:
-            # Compute bricks amount and vertical seam for second
-            # (first after soldier) row only. All other rows will
-            # have the same amount of bricks (and seams)
-            bricks, vertical_seam = split_row(
-                row_instance, horizontal_bottom_outer_radius,
-                bottom_outer_width, seam=seam)
-            bricks_amount = len(bricks)
+    Returns:
+        tuple: (program, report), report is a dict with amounts of
+            segments and polylines and pen-up travel (mm) drawing segments
+            in the svg order (travel_before) and optimized one
+            (travel_after).
+    """
+    if plot_format not in PLOT_FORMATTERS:
+        raise ValueError(f'Invalid plot format {plot_format}.')
+    segments = get_plot_segments(
+        geometry, target=target, support_template_step=support_template_step)
+    left = min(min(p1[0], p2[0]) for _, p1, p2 in segments)
+    bottom = max(max(p1[1], p2[1]) for _, p1, p2 in segments)
+    segments = [
+        (stroke, (p1[0] - left, bottom - p1[1]),
+         (p2[0] - left, bottom - p2[1]))
+        for stroke, p1, p2 in segments]
+
+    layers = {}
+    for stroke, p1, p2 in segments:
+        layers.setdefault(stroke, []).append((p1, p2))
+    ordered = []
+    position = (0.0, 0.0)
+    travel = 0.0
+    for stroke, layer in layers.items():
+        polylines = order_polylines(
+            merge_segments(layer, tolerance=tolerance), start=position)
+        travel += get_travel_distance(polylines, start=position)
+        position = polylines[-1][-1]
+        ordered.append((stroke, polylines))
+
+    report = {
+        'segments': len(segments),
+        'polylines': sum(len(x) for _, x in ordered),
+        'travel_before': get_travel_distance([x[1:] for x in segments]),
+        'travel_after': travel,
+    }
+    return PLOT_FORMATTERS[plot_format](ordered), report
+
+
+def format_plot_report(report):
+    """Returns segments and pen-up travel report of build_plot as a text."""
+    before = report['travel_before']
+    after = report['travel_after']
+    return '\n'.join([
+        'segments: {}, polylines: {}'.format(
+            report['segments'], report['polylines']),
+        'pen-up travel: {} mm, optimized: {} mm ({}%)'.format(
+            float_format(before), float_format(after),
+            float_format(100 * (after - before) / before if before else 0)),
+    ])
+
+
+# Stages of build_svg recomputed when the param changes. Only the center
+# params move the dome circle (solved again from warm start), brick depth
+# and seam reuse it and only recompute the soldier row and rows (see
+# get_dome_geometry_from_center).
+CENTER_PARAMS = (
+    'brick_width', 'brick_height', 'surface_inner_radius', 'height',
+    'first_row_height')
+BUILD_STAGES = dict(
+    [(x, ('center', 'geometry', 'pdf', 'svg')) for x in CENTER_PARAMS]
+    + [(x, ('geometry', 'pdf', 'svg')) for x in ('brick_depth', 'seam')]
+    + [(x, ('rows', 'pdf', 'svg'))
+       for x in ('bricks_amount', 'minimal_width', 'bricks_amounts')]
+    + [('imposition', ('pdf',)), ('scale', ('svg',)),
+       ('support_template_step', ('svg',)), ('detail', ('svg',)),
+       ('place_labels', ('svg',)), ('door_height', ()),
+       ('svg_filename', ('svg',)), ('pdf_filename', ('pdf',))])
+
+
+def update_build(params, previous=None):
+    """Recomputes only build_svg stages affected by changed params.
 
-        top_sizes_x_offset = 80
-        a_point = Point(
-            'A', top_sizes_x_offset,
-            row_initial_y + sizes_row_y_offset)
+    Args:
+        params(dict): build_svg params.
+        previous(dict or None): previous update_build result, everything
+            is built if None.
 
-        if rows_counter > 1:
-            # For first row bottom outer side is known
-            # (brick_depth), compute it for others.
-            horizontal_outer_bottom_distance_point = Point(
-                '#{rows_counter}', dome_circle_center_point.x,
-                row_instance.bottom_outer_point.y)
-            horizontal_outer_bottom_radius = get_distance(
-                row_instance.bottom_outer_point,
-                horizontal_outer_bottom_distance_point)
-            horizontal_outer_bottom_circumference = 2 \
-                * math.pi \
-                * horizontal_outer_bottom_radius
-            bottom_outer_width = round(
-                horizontal_outer_bottom_circumference / bricks_amount - vertical_seam,  # noqa: E501
-                1)
+    Returns:
+        dict: `params` (all build_svg params), `geometry`, `changed`
+            (params changed since previous), `stages` (recomputed, see
+            BUILD_STAGES) and `files` (rewritten output files).
+    """
+    arguments = inspect.signature(build_svg).bind(**params)
+    arguments.apply_defaults()
+    params = dict(arguments.arguments)
+    params.pop('cancel_token')
+    if previous is None:
+        changed = list(params)
+    else:
+        changed = [
+            x for x in params if params[x] != previous['params'][x]]
+    stages = set(itertools.chain.from_iterable(
+        BUILD_STAGES[x] for x in changed))
+
+    if not params['bricks_amount'] and not params['bricks_amounts']:
+        raise ValueError('Invalid bricks_amount. Expecting > 0.')
+    geometry_params = {
+        x: params[x] for x in BUILD_STAGES
+        if {'geometry', 'rows'} & set(BUILD_STAGES[x])}
+    geometry = previous and previous['geometry']
+    if 'center' in stages:
+        geometry = get_dome_geometry(
+            warm_start=geometry and geometry.warm_start, **geometry_params)
+    elif 'geometry' in stages:
+        geometry = get_dome_geometry_from_center(
+            geometry, brick_depth=params['brick_depth'], seam=params['seam'],
+            bricks_amount=params['bricks_amount'],
+            minimal_width=params['minimal_width'],
+            bricks_amounts=params['bricks_amounts'],
+            top_radian_hint=geometry.first_row.top_radian_index)
+    elif 'rows' in stages:
+        validate_params(**geometry_params)
+        # Previous result keeps its geometry.
+        geometry = copy.copy(geometry)
+        geometry.rows = get_row_templates(
+            geometry, bricks_amount=params['bricks_amount'],
+            minimal_width=params['minimal_width'],
+            bricks_amounts=params['bricks_amounts'])
+
+    files = []
+    if 'pdf' in stages and params['pdf_filename'] is not None:
+        render_templates_pdf(
+            geometry, filename=params['pdf_filename'],
+            imposition=params['imposition'])
+        files.append(params['pdf_filename'])
+    if 'svg' in stages and params['svg_filename'] is not None:
+        with open(params['svg_filename'], 'w') as f:
+            f.write(render_dome_svg(
+                geometry, scale=params['scale'],
+                support_template_step=params['support_template_step'],
+                detail=params['detail'],
+                place_labels=params['place_labels']))
+        files.append(params['svg_filename'])
+    return {
+        'params': params,
+        'geometry': geometry,
+        'changed': changed,
+        'stages': [x for x in ('center', 'geometry', 'rows', 'pdf', 'svg')
+                   if x in stages],
+        'files': files,
+    }
+
+
+def watch_params(path, params=None, interval=0.5, iterations=None):
+    """Rebuilds outputs every time json file with build_svg params changes.
+
+    Only stages affected by changed params are recomputed and only their
+    files are rewritten, see update_build.
 
-        b_point = Point(
-            'B', top_sizes_x_offset + bottom_outer_width,
-            row_initial_y + sizes_row_y_offset)
+    Args:
+        path(str): json file with build_svg params (e.g.
+            {"seam": 4, "bricks_amount": 32}).
+        params(dict or None): build_svg params the file params override.
+        interval(float): seconds between checks of the file.
+        iterations(int or None): amount of checks, endless if None.
+    """
+    state = None
+    modified = None
+    for _ in itertools.count() if iterations is None else range(iterations):
+        try:
+            current = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            current = None
+        if current is not None and current != modified:
+            modified = current
+            start = time.perf_counter()
+            previous = state
+            try:
+                with open(path) as f:
+                    file_params = json.load(f)
+                state = update_build(
+                    dict(params or {}, **file_params), previous=previous)
+            except (ValueError, TypeError, RuntimeError,
+                    ZeroDivisionError) as e:
+                print('Error: {}'.format(e))
+            else:
+                print('Changed: {}. Recomputed: {}. Written: {}'
+                      ' ({:.3f} s)'.format(
+                          ', '.join(state['changed'] if previous else ['all'])
+                          or 'nothing',
+                          ', '.join(state['stages']) or 'nothing',
+                          ', '.join(state['files']) or 'nothing',
+                          time.perf_counter() - start))
+        time.sleep(interval)
 
-        ab_center = top_sizes_x_offset + abs(a_point.x - b_point.x) / 2
 
-        # Compute bottom inner side.
-        horizontal_inner_bottom_distance_point = Point(
-            '#{rows_counter}', dome_circle_center_point.x,
-            row_instance.bottom_inner_point.y)
-        horizontal_bottom_inner_radius = get_distance(
-            row_instance.bottom_inner_point,
-            horizontal_inner_bottom_distance_point)
-        horizontal_bottom_inner_circumference = 2 \
-            * math.pi \
-            * horizontal_bottom_inner_radius
-        bottom_inner_side = round(
-            horizontal_bottom_inner_circumference / bricks_amount - vertical_seam,  # noqa: E501
-            1)
-        c_point = Point(
-            'C', ab_center + bottom_inner_side / 2,
-            row_initial_y + sizes_row_y_offset + brick_width / 2.0)
+async def run_cancellable(func, timeout=None, executor=None, **params):
+    """Runs func with params in the executor without blocking the loop.
 
-        d_point = Point(
-            'D', ab_center - bottom_inner_side / 2,
-            row_initial_y + sizes_row_y_offset + brick_width / 2.0)
+    func gets cancel_token, which is cancelled together with the awaiting
+    task, so the worker thread is freed at the next solver step.
 
-        # Display template top face.
-        horizontal_top_outer_radius = get_distance(
-            row_instance.top_outer_point,
-            horizontal_outer_top_distance_point)
-        # Debug: distance from out to center line.
-        # elems.append(
-        #     Path(row_instance.top_outer_point,
-        #          horizontal_outer_top_distance_point)
-        #     .as_csv())
-        horizontal_outer_top_circumference = \
-            2 \
-            * math.pi \
-            * horizontal_top_outer_radius
-        top_outer_side = round(
-            horizontal_outer_top_circumference / bricks_amount - vertical_seam,
-            1)
+    Args:
+        func: function accepting cancel_token (e.g. build_svg).
+        timeout(float or None): time budget in seconds, TimeoutError is
+            raised when it's exceeded.
+        executor(concurrent.futures.Executor or None): thread pool, loop
+            default executor if None.
 
-        # Display bottom sizes (for verification after marking)
-        bottom_sizes_x_offset = 650
-        e_point = Point(
-            'E', bottom_sizes_x_offset,
-            row_initial_y + sizes_row_y_offset)
-        f_point = Point(
-            'F', bottom_sizes_x_offset + top_outer_side,
-            row_initial_y + sizes_row_y_offset)
+    Returns:
+        func result.
+    """
+    token = CancelToken(timeout=timeout)
+    future = asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(func, cancel_token=token, **params))
+    try:
+        return await future
+    except asyncio.CancelledError:
+        token.cancel()
+        raise
 
-        #
-        horizontal_inner_top_distance_point = Point(
-            f'#{rows_counter}', dome_circle_center_point.x,
-            row_instance.top_inner_point.y)
-        horizontal_top_inner_radius = get_distance(
-            row_instance.top_inner_point, horizontal_inner_top_distance_point)
-        horizontal_top_inner_circumference = \
-            2 \
-            * math.pi \
-            * horizontal_top_inner_radius
-        top_inner_side = round(
-            horizontal_top_inner_circumference / bricks_amount - vertical_seam,
-            1)
 
-        ef_center = bottom_sizes_x_offset + abs(e_point.x - f_point.x) / 2
+def build_outputs(**params):
+    """Returns svg and pdf of build_svg without writing any file.
 
-        g_point = Point(
-            'G', ef_center + top_inner_side / 2,
-            row_initial_y + sizes_row_y_offset + brick_width / 2.0)
+    Concurrent builds don't share output files this way.
 
-        h_point = Point(
-            'H', ef_center - top_inner_side / 2,
-            row_initial_y + sizes_row_y_offset + brick_width / 2.0)
+    Args:
+        params: build_svg params except svg_filename and pdf_filename.
 
-        # End of paper template.
+    Returns:
+        dict: `svg` (str) and `pdf` (bytes of row templates).
+    """
+    pdf = io.BytesIO()
+    svg = build_svg(svg_filename=None, pdf_filename=pdf, **params)
+    return {'svg': svg, 'pdf': pdf.getvalue()}
 
-        if rows_counter == 2:
-            # The row above first row is known, so add template to pdf.
-            outer_size = get_distance(a_point, b_point) / 2.0 - vertical_seam
-            inner_size = get_distance(c_point, d_point) / 2.0 - vertical_seam
 
-            render_row_constriction_template(
-                cnv, outer_size, inner_size, brick_depth,
-                'Row1',
-                start_y=100)
-            cnv.showPage()
+async def build_svg_async(timeout=None, executor=None, **params):
+    """Returns build_outputs result computed in the executor.
 
-        # Render row template to pdf file.
-        outer_height = brick_height
-        inner_height = get_distance(
-            row_instance.top_inner_point,
-            row_instance.bottom_inner_point)
+    See run_cancellable and build_outputs.
+    """
+    return await run_cancellable(
+        build_outputs, timeout=timeout, executor=executor, **params)
 
-        inner_outer_diff = outer_height - inner_height
 
-        render_row_brick_template(
-            cnv, round(bricks_amount, 1), a_point, b_point, c_point, d_point,
-            e_point, f_point, g_point, h_point,
-            row_number=rows_counter,
-            brick_height=brick_height,
-            brick_width=brick_width,
-            inner_outer_diff=inner_outer_diff,
-            vertical_seam=vertical_seam)
+async def get_dome_geometry_async(timeout=None, executor=None, **params):
+    """Returns get_dome_geometry result computed in the executor.
 
-        # FIXME: This is not correct. It should compare
-        # h_point-g_point < minimal_width for the next row, not for current.
-        if bricks_amount % 2 == 0 \
-                and get_distance(h_point, g_point) < minimal_width + 5:
-            # Brick is too small, new row will contain
-            # larger bricks that will cover 2 bottom bricks.
-            bricks_amount = bricks_amount / 2
+    See run_cancellable and get_dome_geometry.
+    """
+    return await run_cancellable(
+        get_dome_geometry, timeout=timeout, executor=executor, **params)
 
-        # Switch to next row.
-        previous_row = row_instance
-        if horizontal_top_outer_radius <= brick_width / 2.0:
-            # The radius is less then brick length. Further are key bricks.
-            break
 
-    outer_size = get_distance(
-        row_instance.top_outer_point, row_instance.bottom_outer_point)
-    inner_size = get_distance(
-        row_instance.top_inner_point, row_instance.bottom_inner_point)
+def get_call_key(func, **params):
+    """Returns hashable key of func call with normalized params.
 
-    render_row_constriction_template(
-        cnv, outer_size, inner_size, brick_width / 2.0,
-        'All except first')
-    cnv.save()
+    Defaults are filled in, numbers are floats and lists are tuples, so
+    `height=440` and `height=440.0` or omitted default height give the
+    same key. cancel_token is not a param of the result and is skipped.
+    """
+    def normalize(value):
+        if isinstance(value, (list, tuple)):
+            return tuple(normalize(x) for x in value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return float(value)
+        return value
 
-    support_template_elems = get_support_template_elems(
-        surface_circle_center_point,
-        dome_circle_center_point, first_row, height_inner_point, row_instance,
-        seam=seam, template_width=surface_inner_radius, template_height=height,
-        support_template_step=support_template_step)
+    arguments = inspect.signature(func).bind(**params)
+    arguments.apply_defaults()
+    return (func.__name__,) + tuple(sorted(
+        (name, normalize(value))
+        for name, value in arguments.arguments.items()
+        if name != 'cancel_token'))
 
-    elems.extend(support_template_elems)
 
-    # Show key brick template.
-    # FIXME: Implement
-    # y_offset += 300
-    # elems.extend(
-    #     get_key_brick_templates(
-    #         key_brick_radius4, get_distance(h_point, g_point),
-    #         y_offset, brick_width=brick_width))
+class SingleFlight():
 
-    elems.append('</g></svg>')
+    """Shares one in-flight computation between identical concurrent calls.
 
-    total_layout = '\n'.join([str(x) for x in elems])
-    with open('dome.svg', 'w') as f:
-        f.write(total_layout)
+    Calls with the same key made while the computation is running get the
+    same result object (or exception) instead of computing it again. The
+    result is not cached after the computation is finished.
+    """
 
-    # Create viewbox copy for every brick.
-    return total_layout
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    @property
+    def metrics(self):
+        """Returns amounts of requests, computations and coalesced ones."""
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'computations': self.requests - self.coalesced,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.calls) + len(self.async_calls),
+            }
+
+    def do(self, key, func, *args, **kwargs):
+        """Returns func result, computed once for concurrent threads."""
+        with self.lock:
+            self.requests += 1
+            future = self.calls.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self.calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """Returns result of func coroutine, awaited once for all tasks.
+
+        The computation is cancelled only when every task waiting for it
+        is cancelled, then the next call with the key starts a new one.
+        """
+        with self.lock:
+            self.requests += 1
+            call = self.async_calls.get(key)
+            if call is None:
+                call = self.async_calls[key] = {
+                    'task': asyncio.ensure_future(func(*args, **kwargs)),
+                    'waiters': 0,
+                }
+
+                def remove(_):
+                    with self.lock:
+                        if self.async_calls.get(key) is call:
+                            del self.async_calls[key]
+
+                call['task'].add_done_callback(remove)
+            else:
+                self.coalesced += 1
+            call['waiters'] += 1
+        try:
+            return await asyncio.shield(call['task'])
+        finally:
+            with self.lock:
+                call['waiters'] -= 1
+                abandoned = not call['waiters'] and not call['task'].done()
+                if abandoned and self.async_calls.get(key) is call:
+                    del self.async_calls[key]
+            if abandoned:
+                call['task'].cancel()
+
+    def build_svg(self, **params):
+        """Returns build_outputs result shared by identical calls."""
+        return self.do(
+            get_call_key(build_svg, **params), build_outputs, **params)
+
+    async def build_svg_async(self, timeout=None, executor=None, **params):
+        """Returns build_svg_async result shared by identical calls.
+
+        timeout and executor of the first call are used.
+        """
+        return await self.do_async(
+            get_call_key(build_svg, **params), build_svg_async,
+            timeout=timeout, executor=executor, **params)
 
 
 def get_distance(p1, p2):
@@ -1019,41 +4879,103 @@ def get_distance1(p1, p2):
     return round(distance, 1)
 
 
+def get_first_index(low, high, predicate, hint=None):
+    """Returns first index from low to high where predicate is true.
+
+    Predicate must be false before some index and true after it. Returns
+    high if predicate is false everywhere. If hint is given, the index is
+    searched with growing steps around it first, so it's found faster when
+    it is near the hint.
+    """
+    if hint is not None and low <= hint < high:
+        step = 1
+        if predicate(hint):
+            high = hint
+            probe = hint - step
+            while probe >= low and predicate(probe):
+                high = probe
+                step *= 2
+                probe = high - step
+            low = max(low, probe + 1)
+        else:
+            low = hint + 1
+            probe = low
+            while probe < high and not predicate(probe):
+                low = probe + 1
+                step *= 2
+                probe = low + step - 1
+            high = min(high, probe)
+    while low < high:
+        middle = (low + high) // 2
+        if predicate(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+@functools.lru_cache(maxsize=None)
+def get_accumulated_radians(step):
+    """Returns radians from 0 up to 2 * pi accumulated by step.
+
+    Values are summed one step at a time as the loops moving a radian by
+    step did, so binary search over them gives the same points. The table
+    is computed once per step (solvers use one step), so every search is
+    O(log n) and memory doesn't grow with the amount of designs. Solvers
+    starting from other radians add it to the values.
+
+    Returns:
+        array: radians, must not be changed.
+    """
+    radians = array('d', [0.0])
+    while radians[-1] + step < 2 * math.pi:
+        radians.append(radians[-1] + step)
+    return radians
+
+
 def split_row(row_instance, radius, elem_width, seam=3):
     # Find how many full bricks we need to fit that row.
-    radian_pivot = 0
-    bricks_amount = 0
     step = 0.0001
     bricks = []
     brick_cut = 0
     vertical_seam = seam
 
     dome_circle_center_point = Point('DCCP', 900, 2200)
-    # elems.append(dome_circle_center_point.as_csv())
-    # elems.append(
-    #    '''<circle cx="900" cy="2200"
-    #               r="{horizontal_bottom_outer_radius}"
-    #               fill="blue"
-    #               fill-opacity="0.6"/>')
     previous_brick_point = Point(
         '?', dome_circle_center_point.x + radius,
         dome_circle_center_point.y)
-    # elems.append(previous_brick_point.as_csv(fill='black'))
+
+    # Radians are moved by step around the circle. Instead of checking every
+    # radian, find the first one giving the brick with binary search (the
+    # chord grows with the radian up to pi). Radians are accumulated the
+    # same way as in the loop to get the same bricks.
+    radians = get_accumulated_radians(step)
+
+    def get_point(index):
+        return Point(
+            '?',
+            dome_circle_center_point.x + radius * math.cos(radians[index]),
+            dome_circle_center_point.y - radius * math.sin(radians[index]))
+
+    def get_cut(index):
+        return get_distance(previous_brick_point, get_point(index))
+
+    previous_index = 0
+    last_index = len(radians) - 1
     while True:
-        if radian_pivot >= 2 * math.pi:
+        high = min(last_index, previous_index + int(math.pi / step))
+        index = get_first_index(
+            previous_index, high + 1,
+            lambda x: get_cut(x) >= elem_width + vertical_seam)
+        if index > high:
+            brick_cut = get_cut(last_index)
+            break
+        brick_cut = get_cut(index)
+        bricks.append(brick_cut - vertical_seam)
+        previous_brick_point = get_point(index)
+        previous_index = index
+        if index == last_index:
             break
-        new_x = dome_circle_center_point.x + radius * math.cos(radian_pivot)
-        new_y = dome_circle_center_point.y - radius * math.sin(radian_pivot)
-        new_point = Point('?', new_x, new_y)
-        brick_cut = get_distance(previous_brick_point, new_point)
-        if brick_cut >= elem_width + vertical_seam:
-            bricks_amount += 1
-            # elems.append(new_point.as_csv())
-            # elems.append(Path(previous_brick_point, new_point).as_csv())
-            # elems.append(Path(dome_circle_center_point, new_point).as_csv())
-            previous_brick_point = new_point
-            bricks.append(brick_cut - vertical_seam)
-        radian_pivot += step
     if brick_cut:
         # Small cut of brick remained. Make it full by taking sizes from every
         # brick in the row.
@@ -1112,6 +5034,32 @@ def get_point_on_line(point1, point2, distance=70.0, title='T'):
     return new_point
 
 
+def get_line_crossing_distance(point1, point2, x, max_distance):
+    """Returns whole distance from point1 to point2 where line reaches x.
+
+    Same as moving from point1 by 1 mm until x is reached, but without
+    the loop. Returns max_distance - 1 if x is never reached.
+    """
+    def is_reached(distance):
+        return get_point_on_line(
+            point1, point2, distance=distance).x >= x
+
+    if is_reached(0):
+        return 0
+    if point2.x <= point1.x:
+        return max_distance - 1
+    length = math.sqrt(
+        pow(point2.x - point1.x, 2) + pow(point2.y - point1.y, 2))
+    distance = int(math.ceil((x - point1.x) / (point2.x - point1.x) * length))
+    distance = min(max(distance, 0), max_distance - 1)
+    # Fix float rounding around the crossing.
+    while distance > 0 and is_reached(distance - 1):
+        distance -= 1
+    while distance < max_distance - 1 and not is_reached(distance):
+        distance += 1
+    return distance
+
+
 def float_format(number):
     return str(round(number, 1))
 
@@ -1119,8 +5067,13 @@ def float_format(number):
 def get_dome_inner_radius(
         surface_circle_center_point, surface_inner_radius,
         brick_width=250, brick_height=65, elems=None, first_row_height=160,
-        height=450):
-    """Returns inner radius for dome."""
+        height=450, start_step=None, cancel_token=None):
+    """Returns inner radius for dome.
+
+    start_step is the center step (mm under the height) of the similar
+    dome to start search from. cancel_token (CancelToken) is checked on
+    every step.
+    """
 
     # Note first row outer top point will change while computing dome radius.
     first_row_outer_top_point = Point(
@@ -1142,10 +5095,7 @@ def get_dome_inner_radius(
 
     # Find center of the dome circle - move down from the height until the
     # distance will be the same.
-    counter = 0
-    step = 1  # mm
-    new_first_row_outer_top_point = None
-    while True:
+    def get_center_diff(step):
         # We compute it by outer point because
         # inner point will be lower because of cut.
         pivot_point = Point(
@@ -1154,32 +5104,59 @@ def get_dome_inner_radius(
         #
         # Verify outer point is covered by next row, otherwise
         # move the outer point.
-        # FIXME: Find a math instead of a loop
         # Find a point on the inner side of the soldier brick.
-        for i in range(int(math.ceil(brick_width * 2))):
-            temp_inner_point = get_point_on_line(
-                first_row_outer_top_point, pivot_point, distance=i)
-            if temp_inner_point.x >= first_row_inner_bottom_point.x:
-                # if step % 25 == 0:
-                #     elems.append(temp_inner_point.as_csv())
-                #     elems.append(
-                #          Path(first_row_outer_top_point, pivot_point)
-                #          .as_csv())
-                break
-
-        if get_distance(
-                first_row_outer_top_point,
-                temp_inner_point) >= brick_width / 2.0:
-            dist = \
-                get_distance(first_row_outer_top_point, temp_inner_point) \
-                - brick_width \
-                / 2.0
-            moved_first_row_outer_top_point = get_point_on_line(
-                first_row_outer_top_point, pivot_point, distance=dist)
-            new_first_row_outer_top_point = moved_first_row_outer_top_point
-
-        diff = int(get_distance(pivot_point, new_first_row_outer_top_point)) \
+        temp_inner_point = get_point_on_line(
+            first_row_outer_top_point, pivot_point,
+            distance=get_line_crossing_distance(
+                first_row_outer_top_point, pivot_point,
+                first_row_inner_bottom_point.x,
+                int(math.ceil(brick_width * 2))))
+
+        # Inner side is brick_width / 2 away horizontally, so the point
+        # is always far enough to move the outer point.
+        dist = \
+            get_distance(first_row_outer_top_point, temp_inner_point) \
+            - brick_width \
+            / 2.0
+        moved_first_row_outer_top_point = get_point_on_line(
+            first_row_outer_top_point, pivot_point, distance=dist)
+
+        diff = int(get_distance(
+            pivot_point, moved_first_row_outer_top_point)) \
             - int(get_distance(pivot_point, height_outer_point))
+        return diff, pivot_point, moved_first_row_outer_top_point
+
+    # Moving by 1 mm from the height takes as many steps as the dome radius,
+    # so start near the center found with get_inner_profile or the center
+    # of the similar dome. Diff decreases by at least 1 - ratio per mm,
+    # start far enough to have it above 1.
+    if start_step is not None:
+        back = 2
+        step = max(1, start_step - back)
+        while step > 1 and get_center_diff(step)[0] <= 3:
+            back *= 2
+            step = max(1, start_step - back)
+    else:
+        try:
+            _, _, center_z, _ = get_inner_profile(
+                surface_inner_radius=surface_inner_radius, height=height,
+                first_row_height=first_row_height, brick_width=brick_width,
+                brick_height=brick_height)
+            ratio = surface_inner_radius / (
+                surface_inner_radius + brick_width / 2.0)
+            margin = int(4 / (1 - ratio)) + 16
+            step = max(1, int(height - center_z) - margin)
+        except ValueError:
+            step = 1
+        while step > 1 and get_center_diff(step)[0] <= 1:
+            step = max(1, step // 2)
+
+    counter = 0
+    while True:
+        if cancel_token:
+            cancel_token.check()
+        diff, pivot_point, new_first_row_outer_top_point = \
+            get_center_diff(step)
         is_circle_center = abs(diff) <= 1
         if is_circle_center:
             dome_circle_center_point = pivot_point
@@ -1197,10 +5174,8 @@ def get_dome_inner_radius(
 
     dome_radius = get_distance(
         dome_circle_center_point, first_row_outer_top_point)
-    if new_first_row_outer_top_point:
-        return (dome_radius, dome_circle_center_point,
-                new_first_row_outer_top_point)
-    return dome_radius, dome_circle_center_point, first_row_outer_top_point
+    return (dome_radius, dome_circle_center_point,
+            new_first_row_outer_top_point)
 
 
 def get_degree(a_point, b_point, c_point):
@@ -1230,7 +5205,7 @@ def get_support_template_elems(
         surface_circle_center_point, dome_circle_center_point,
         first_row, height_inner_point, row_instance,
         template_width=None, template_height=None,
-        seam=4, support_template_step=3):
+        seam=4, support_template_step=3, cancel_token=None):
 
     assert template_width is not None
     assert template_height is not None
@@ -1292,27 +5267,31 @@ def get_support_template_elems(
 
     # First find the point where the cut starts - it's
     # soldier brick inner top point
-    template_radian_counter = 0
     template_radian_step = 0.0001
     first_point = Point(
         'FP', blank_bottom_right.x, first_row.top_inner_point.y)
     # debug output
     # elems.append(first_point.as_csv())
-    while True:
-        if template_radian_counter >= math.pi / 2.0:
-            break
-
-        new_x = support_radius_center_point.x \
-            + template_radius \
-            * math.cos(template_radian_counter)
-        new_y = support_radius_center_point.y \
-            - template_radius \
-            * math.sin(template_radian_counter)
-        if new_y <= first_point.y:
-            # print('Region of the blank found.')
-            break
 
-        template_radian_counter += template_radian_step
+    # Radians are moved by step up to pi / 2, points move up and left
+    # monotonically, so the points are found with binary search instead of
+    # checking every radian. Radians are accumulated the same way as in
+    # the loop to get the same points.
+    template_radians = get_accumulated_radians(template_radian_step)
+    template_radians_amount = bisect.bisect_left(
+        template_radians, math.pi / 2.0)
+
+    def get_template_point(index, title='?'):
+        return Point(
+            title,
+            support_radius_center_point.x
+            + template_radius * math.cos(template_radians[index]),
+            support_radius_center_point.y
+            - template_radius * math.sin(template_radians[index]))
+
+    radian_index = get_first_index(
+        0, template_radians_amount,
+        lambda x: get_template_point(x).y <= first_point.y)
     # Now display points of the cut on the blank.
     previous_point = None
     # Since it's a circle we assume rows height is the same, so we can use the
@@ -1336,21 +5315,26 @@ def get_support_template_elems(
         'teal'
     ]
     while True:
-        if template_radian_counter >= math.pi / 2.0:
+        if cancel_token:
+            cancel_token.check()
+        if radian_index >= template_radians_amount:
             break
 
         if point_counter > row_instance.number + 1:
             break
 
-        new_x = support_radius_center_point.x \
-            + template_radius \
-            * math.cos(template_radian_counter)
-        new_y = support_radius_center_point.y \
-            - template_radius \
-            * math.sin(template_radian_counter)
-        is_last_point = new_x <= blank_top_left.x
+        if previous_point:
+            # Skip radians until the next point.
+            radian_index = get_first_index(
+                radian_index, template_radians_amount,
+                lambda x: get_template_point(x).x <= blank_top_left.x
+                or get_distance(get_template_point(x), previous_point)
+                >= row_inner_height)
+            if radian_index >= template_radians_amount:
+                break
 
-        new_point = Point(str(point_counter), new_x, new_y)
+        new_point = get_template_point(radian_index, str(point_counter))
+        is_last_point = new_point.x <= blank_top_left.x
         point_color = colors[point_counter % 10]
 
         if previous_point:
@@ -1507,7 +5491,7 @@ def get_support_template_elems(
 
         if is_last_point:
             break
-        template_radian_counter += template_radian_step
+        radian_index += 1
     return elems
 
 
@@ -1923,10 +5907,152 @@ if __name__ == '__main__':
         help='If row brick inner bottom side is less then that'
              ' value (roughly), build next row with bricks'
              ' that cover bottom 2 bricks.')
+    parser.add_argument(
+        '--bom', action='store_true',
+        help='Print bill of materials instead of rendering templates.')
+
+    parser.add_argument(
+        '--cutting', action='store_true',
+        help='Print plan to cut bricks from stock instead of rendering'
+             ' templates.')
+    parser.add_argument(
+        '--optimize-rows', default=None,
+        choices=['waste', 'cuts'],
+        help='Choose bricks amount of every row with lookahead to'
+             ' minimize waste or cuts.')
+    parser.add_argument(
+        '--search', action='store_true',
+        help='Print Pareto front of designs for bricks of the catalog'
+             ' instead of rendering templates.')
+    parser.add_argument(
+        '--catalog', default=None,
+        type=parse_catalog,
+        help='Bricks to search through, e.g. 250x65x120,230x65x114'
+             ' (default is the brick from params).')
+    parser.add_argument(
+        '--heights', default=None,
+        type=parse_values,
+        help='Dome heights to search through, e.g. 400:480:10 or 420,440'
+             ' (default is the height from params).')
+    parser.add_argument(
+        '--first-row-heights', default=None,
+        type=parse_values,
+        help='First row heights to search through (default is the first'
+             ' row height from params).')
+    parser.add_argument(
+        '--seams', default=None,
+        type=parse_values,
+        help='Seams to search through (default is the seam from params).')
+    parser.add_argument(
+        '--build-surrogate', default=None,
+        help='Write table of designs for bricks of the catalog, inner'
+             ' radii, heights and first row heights to the file to'
+             ' predict them with --surrogate.')
+    parser.add_argument(
+        '--inner-radii', default=None,
+        type=parse_values,
+        help='Inner radii of the --build-surrogate table or --sweep, e.g.'
+             ' 400:700:25.')
+    parser.add_argument(
+        '--surrogate', default=None,
+        help='Print rows, bricks and key size of the design interpolated'
+             ' from the --build-surrogate table file instead of rendering'
+             ' templates.')
+    parser.add_argument(
+        '--sweep', default=None,
+        help='Write results and row sizes of every design for bricks of'
+             ' the catalog, inner radii, heights, first row heights and'
+             ' seams to designs.npy and rows.npy of the directory.')
+    parser.add_argument(
+        '--verify', action='store_true',
+        help='Print rows with seams not covered by the next row or rings'
+             ' not closing instead of rendering templates.')
+    parser.add_argument(
+        '--minimal-seam-offset', default=None,
+        type=float,
+        help='Minimal distance between seams of adjacent rows (mm.), also'
+             ' filters --search results.')
+    parser.add_argument(
+        '--thrust', action='store_true',
+        help='Print thrust line position at every row joint instead of'
+             ' rendering templates.')
+    parser.add_argument(
+        '--sensitivity', action='store_true',
+        help='Print derivatives of row cut sizes by seam, brick height and'
+             ' dome height instead of rendering templates.')
+    parser.add_argument(
+        '--simulate', action='store_true',
+        help='Print rows positions, ring closure errors and key size for'
+             ' bricks and seams varying within tolerances instead of'
+             ' rendering templates.')
+    parser.add_argument(
+        '--samples', default=10000,
+        type=int,
+        help='Amount of domes to simulate.')
+    parser.add_argument(
+        '--brick-tolerance', default=1.5,
+        type=float,
+        help='Brick height tolerance (mm.)')
+    parser.add_argument(
+        '--seam-tolerance', default=1.0,
+        type=float,
+        help='Seam tolerance (mm.)')
+    parser.add_argument(
+        '--fit', default=None,
+        help='Csv file of measured inner profile points (horizontal'
+             ' distance from the dome axis, height) to fit inner radius,'
+             ' height and first row height to.')
+    parser.add_argument(
+        '--solve', default=None,
+        help='Find parameter (see --solve-for) giving the target, e.g.'
+             ' rows=12, key_radius=100 or key_side=60.')
+    parser.add_argument(
+        '--solve-for', default='height',
+        choices=['height', 'first_row_height', 'inner_radius'],
+        help='Parameter to find with --solve.')
+    parser.add_argument(
+        '--watch', default=None,
+        help='Json file with build_svg params overriding other params'
+             ' (e.g. {"seam": 4}). Rebuild outputs every time it changes,'
+             ' recomputing only stages affected by changed params.')
+    parser.add_argument(
+        '--imposition', action='store_true',
+        help='Pack row templates to as few pdf pages as possible.')
+    parser.add_argument(
+        '--detail', default='full',
+        choices=list(DETAIL_LEVELS),
+        help='Level of detail of svg files: outline for previews,'
+             ' dimensions adds distances, full adds point labels and'
+             ' support template details.')
+    parser.add_argument(
+        '--place-labels', action='store_true',
+        help='Move point labels and distances of the svg to avoid'
+             ' overlaps.')
+    parser.add_argument(
+        '--fragments', default=None,
+        help='Also write svg of every row section (row-N.svg) and cut'
+             ' template (template-N.svg) cropped to its size to the'
+             ' directory.')
+    parser.add_argument(
+        '--plot', default=None,
+        help='Write plotter or laser cutter program of --plot-target to the'
+             ' file instead of rendering templates. Lines are merged and'
+             ' ordered to reduce pen-up travel.')
+    parser.add_argument(
+        '--plot-target', default='support',
+        choices=list(PLOT_TARGETS),
+        help='Drawing to --plot: support template, dome section or cut'
+             ' templates of rows.')
+    parser.add_argument(
+        '--plot-format', default='hpgl',
+        choices=list(PLOT_FORMATS),
+        help='Format of --plot: HPGL, G-code or svg in drawing order.')
+    parser.add_argument(
+        '--gltf', action='store_true',
+        help='Write 3D model of the dome to dome.glb.')
 
     args = parser.parse_args()
-    build_svg(
-        scale=args.scale,
+    params = dict(
         brick_width=args.brick_width,
         brick_height=args.brick_height,
         brick_depth=args.brick_depth,
@@ -1934,7 +6060,140 @@ if __name__ == '__main__':
         height=args.height,
         first_row_height=args.first_row_height,
         seam=args.seam,
-        door_height=args.door_height,
         bricks_amount=args.bricks_amount,
         minimal_width=40)
-    print('Done. Check dome.svg and row-templates.pdf.')
+    if args.fit:
+        with open(args.fit) as f:
+            fitted, rms = fit_dome(
+                parse_points(f), first_row_height=args.first_row_height,
+                brick_width=args.brick_width, brick_height=args.brick_height,
+                brick_depth=args.brick_depth, seam=args.seam)
+        params.update(fitted)
+        print('inner_radius: {}, height: {}, first_row_height: {}'
+              ' (rms {} mm)'.format(
+                  float_format(fitted['surface_inner_radius']),
+                  float_format(fitted['height']),
+                  float_format(fitted['first_row_height']),
+                  float_format(rms)))
+    if args.solve:
+        target, value = args.solve.split('=')
+        parameter = {'inner_radius': 'surface_inner_radius'}.get(
+            args.solve_for, args.solve_for)
+        params[parameter], _ = solve_design(
+            target, float(value), parameter=parameter, **params)
+        print(f'{args.solve_for}: {float_format(params[parameter])}')
+    if args.search:
+        print(format_designs(search_designs(
+            args.catalog or [
+                (args.brick_width, args.brick_height, args.brick_depth)],
+            args.inner_radius,
+            args.heights or [args.height],
+            first_row_heights=args.first_row_heights or [
+                args.first_row_height],
+            seams=args.seams or [args.seam],
+            minimal_width=args.minimal_width or 40,
+            minimal_seam_offset=args.minimal_seam_offset)))
+        raise SystemExit()
+    if args.build_surrogate:
+        surrogate = build_surrogate(
+            args.catalog or [
+                (args.brick_width, args.brick_height, args.brick_depth)],
+            args.inner_radii or [args.inner_radius],
+            args.heights or [args.height],
+            args.first_row_heights or [args.first_row_height],
+            seam=args.seam, minimal_width=args.minimal_width or 40)
+        with open(args.build_surrogate, 'wb') as f:
+            f.write(surrogate)
+        print('Error bound: {}'.format(', '.join(
+            '{} {}'.format(name, float_format(value))
+            for name, value in Surrogate(surrogate).error.items())))
+        raise SystemExit()
+    if args.sweep:
+        designs, rows = sweep_designs(
+            args.sweep,
+            args.catalog or [
+                (args.brick_width, args.brick_height, args.brick_depth)],
+            args.inner_radii or [args.inner_radius],
+            args.heights or [args.height],
+            first_row_heights=args.first_row_heights or [
+                args.first_row_height],
+            seams=args.seams or [args.seam],
+            minimal_width=args.minimal_width or 40)
+        print('Written {} designs and {} rows to {}.'.format(
+            designs, rows, args.sweep))
+        raise SystemExit()
+    if args.surrogate:
+        surrogate = load_surrogate(args.surrogate)
+        print(format_surrogate_prediction(
+            surrogate.predict(**params), surrogate.error))
+        raise SystemExit()
+    if args.optimize_rows:
+        params['bricks_amounts'] = optimize_bricks_amounts(
+            get_dome_geometry(**params),
+            minimal_width=args.minimal_width or 40,
+            objective=args.optimize_rows,
+            first_bricks_amount=args.bricks_amount)
+        print('Bricks amounts: {}'.format(
+            ', '.join(str(x) for x in params['bricks_amounts'])))
+    if args.bom:
+        geometry = get_dome_geometry(**params)
+        print(format_bill_of_materials(get_bill_of_materials(geometry)))
+        raise SystemExit()
+    if args.cutting:
+        geometry = get_dome_geometry(**params)
+        print(format_cutting_plan(optimize_cutting(geometry)))
+        raise SystemExit()
+    if args.verify:
+        print(format_violations(verify_rows(
+            get_dome_geometry(**params),
+            minimal_offset=args.minimal_seam_offset or 15.0)))
+        raise SystemExit()
+    if args.thrust:
+        print(format_thrust_line(get_thrust_line(get_dome_geometry(**params))))
+        raise SystemExit()
+    if args.sensitivity:
+        print(format_sensitivity(get_sensitivity(params)))
+        raise SystemExit()
+    if args.simulate:
+        print(format_tolerance_simulation(simulate_tolerances(
+            get_dome_geometry(**params), samples=args.samples,
+            brick_tolerance=args.brick_tolerance,
+            seam_tolerance=args.seam_tolerance)))
+        raise SystemExit()
+    if args.plot:
+        program, report = build_plot(
+            get_dome_geometry(**params), target=args.plot_target,
+            plot_format=args.plot_format)
+        with open(args.plot, 'w') as f:
+            f.write(program)
+        print(format_plot_report(report))
+        raise SystemExit()
+
+    if args.watch:
+        print('Watching {}, press Ctrl+C to stop.'.format(args.watch))
+        try:
+            watch_params(args.watch, params=dict(
+                params, scale=args.scale, door_height=args.door_height,
+                imposition=args.imposition,
+                detail=DETAIL_LEVELS[args.detail],
+                place_labels=args.place_labels))
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit()
+
+    build_svg(
+        scale=args.scale, door_height=args.door_height,
+        imposition=args.imposition, detail=DETAIL_LEVELS[args.detail],
+        place_labels=args.place_labels, **params)
+    if args.fragments:
+        files = write_svg_fragments(
+            get_dome_geometry(**params), path=args.fragments,
+            detail=DETAIL_LEVELS[args.detail])
+        print('Written {} row and template svg files to {}.'.format(
+            len(files), args.fragments))
+    if args.gltf:
+        with open('dome.glb', 'wb') as f:
+            f.write(build_gltf(get_dome_geometry(**params)))
+        print('Done. Check dome.svg, row-templates.pdf and dome.glb.')
+    else:
+        print('Done. Check dome.svg and row-templates.pdf.')
@@ -1,11 +1,46 @@
+import asyncio
+import base64
+import itertools
+import json
+import io
 import math
-from mock import Mock
+import os
+import re
+import struct
+import tempfile
+import threading
+import zlib
+from concurrent.futures import CancelledError
+from mock import Mock, patch
 from unittest import TestCase, main as unittest_main
 
 from domebricks import Point, Path, Row, \
     get_distance, get_lines_intersection, get_dome_radius_radian, \
     get_point_on_line, get_dome_inner_radius, move_along_radius, \
-    get_points_radian, float_format
+    get_points_radian, float_format, get_dome_geometry, \
+    get_bill_of_materials, get_floor_layout, get_brick_solid, \
+    build_gltf, get_soldier_bricks_amount, get_cut_pieces, optimize_cutting, \
+    pack_rectangles, render_templates_pdf, BoundsCanvas, \
+    optimize_bricks_amounts, evaluate_design, get_pareto_front, \
+    search_designs, parse_values, parse_catalog, solve_design, \
+    get_design_target, get_line_crossing_distance, get_sensitivity, \
+    format_sensitivity, simulate_tolerances, format_tolerance_simulation, \
+    get_geometry_row_sizes, get_row_sizes, \
+    get_percentiles, get_seam_angles, get_seams_distance, verify_rows, \
+    get_seam_layout, get_layout_seams_distance, \
+    format_violations, get_polygon_centroid, get_thrust_line, \
+    format_thrust_line, get_inner_profile, get_profile_distance, fit_dome, \
+    parse_points, solve_linear, get_first_index, split_row, \
+    get_accumulated_radians, validate_params, \
+    build_svg, evaluate_designs, get_snake_product, build_surrogate, \
+    Surrogate, load_surrogate, NpyWriter, NpyTable, sweep_designs, \
+    CancelToken, run_cancellable, get_dome_geometry_async, get_call_key, \
+    build_svg_async, SingleFlight, update_build, watch_params, get_bounds, \
+    get_row_svg_fragment, get_template_svg_fragment, write_svg_fragments, \
+    svg_detail, render_dome_svg, DETAIL_OUTLINE, DETAIL_DIMENSIONS, \
+    DETAIL_FULL, LabelPlacer, label_placement, get_text_box, \
+    get_text_path_boxes, plot_recording, get_plot_segments, merge_segments, \
+    get_travel_distance, order_polylines, build_plot, format_plot_report
 
 
 def debug_dump(test_function):
@@ -325,6 +360,1543 @@ class GetDomeInnerRadiusTest(TestCase):
         return False, elems
 
 
+class GetDomeGeometryTest(TestCase):
+
+    def test_returns_rows_up_to_key_bricks(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+
+        self.assertEqual(geometry.first_row.number, 1)
+        self.assertEqual(
+            [x.number for x in geometry.rows],
+            list(range(2, len(geometry.rows) + 2)))
+        self.assertEqual(geometry.rows[0].bricks_amount, 32)
+        self.assertLessEqual(
+            geometry.rows[-1].horizontal_top_outer_radius, 125)
+        for template in geometry.rows:
+            self.assertLess(
+                template.top_inner_width, template.bottom_outer_width)
+
+
+class GetFloorLayoutTest(TestCase):
+
+    def test_small_floor_is_cut_from_one_brick(self):
+        layout = get_floor_layout(50, 250, 120)
+        self.assertEqual((layout['whole'], layout['cut']), (0, 1))
+        self.assertAlmostEqual(
+            layout['cut_area'], math.pi * 50 ** 2, delta=20)
+
+    def test_bricks_and_seams_cover_the_floor(self):
+        layout = get_floor_layout(495, 250, 120, seam=3)
+        bricks_area = layout['whole'] * 250 * 120 + layout['cut_area']
+
+        self.assertGreater(layout['whole'], 0)
+        self.assertGreater(layout['cut'], 0)
+        self.assertLess(bricks_area, math.pi * 495 ** 2)
+        self.assertGreater(bricks_area, 0.95 * math.pi * 495 ** 2)
+
+
+class GetBillOfMaterialsTest(TestCase):
+
+    def test_returns_rows_and_totals(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        bom = get_bill_of_materials(geometry)
+
+        # Soldier row goes first.
+        self.assertEqual(len(bom['rows']), len(geometry.rows) + 1)
+        self.assertEqual(bom['rows'][1]['bricks'], 32)
+        self.assertEqual(bom['rows'][1]['stock_bricks'], 16)
+        self.assertEqual(
+            bom['totals']['bricks'],
+            sum(x['bricks'] for x in bom['rows']) + bom['floor']['bricks'])
+
+        half_brick_volume = 250 / 2.0 * 65 * 120
+        for row in bom['rows'][1:]:
+            self.assertLess(row['brick_volume'] / row['bricks'],
+                            half_brick_volume)
+            self.assertGreater(row['waste_volume'], 0)
+            self.assertGreater(row['mortar_volume'], 0)
+        self.assertGreater(bom['totals']['mass'], 0)
+        self.assertGreater(bom['floor']['waste_volume'], 0)
+        self.assertGreater(bom['floor']['mortar_volume'], 0)
+
+    def test_computes_volume_of_rectangular_brick(self):
+        template = Mock()
+        template.number = 2
+        template.bricks_amount = 2
+        template.vertical_seam = 3
+        template.bottom_outer_width = 120
+        template.bottom_inner_width = 120
+        template.top_outer_width = 120
+        template.top_inner_width = 120
+        template.outer_height = 65
+        template.inner_height = 65
+        geometry = get_dome_geometry(bricks_amount=32)
+        geometry.rows = [template]
+
+        bom = get_bill_of_materials(geometry)
+
+        self.assertAlmostEqual(bom['rows'][1]['brick_volume'], 250 * 65 * 120)
+        self.assertAlmostEqual(bom['rows'][1]['waste_volume'], 0)
+
+
+class GetBrickSolidTest(TestCase):
+
+    def test_returns_closed_solid_with_outer_faces(self):
+        profile = [(500, 0), (500, 65), (375, 65), (375, 0)]
+        vertices, triangles = get_brick_solid(profile, [120] * 4)
+
+        self.assertEqual(len(vertices), 8)
+        self.assertEqual(len(triangles), 36)
+
+        # Signed volume is positive only if all faces look outside.
+        volume = 0
+        for i in range(0, len(triangles), 3):
+            a, b, c = [vertices[x] for x in triangles[i:i + 3]]
+            volume += (
+                a[0] * (b[1] * c[2] - b[2] * c[1])
+                - a[1] * (b[0] * c[2] - b[2] * c[0])
+                + a[2] * (b[0] * c[1] - b[1] * c[0])) / 6.0
+        self.assertAlmostEqual(volume, 125 * 65 * 120)
+
+
+class BuildGltfTest(TestCase):
+
+    def test_returns_brick_per_node_and_mesh_per_row(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        content = build_gltf(geometry)
+
+        magic, version, length = struct.unpack('<4sII', content[:12])
+        self.assertEqual(magic, b'glTF')
+        self.assertEqual(version, 2)
+        self.assertEqual(length, len(content))
+
+        json_length, = struct.unpack('<I', content[12:16])
+        gltf = json.loads(content[20:20 + json_length])
+        bricks = get_soldier_bricks_amount(geometry) \
+            + sum(int(x.bricks_amount) for x in geometry.rows)
+        # Bricks and the root node.
+        self.assertEqual(len(gltf['nodes']), bricks + 1)
+        self.assertEqual(len(gltf['meshes']), len(geometry.rows) + 1)
+        indices = set(
+            x['primitives'][0]['indices'] for x in gltf['meshes'])
+        self.assertEqual(len(indices), 1)
+
+
+class OptimizeCuttingTest(TestCase):
+
+    def test_cuts_every_piece_once(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        pieces = get_cut_pieces(geometry)
+        cutting_plan = optimize_cutting(geometry)
+
+        planned = sorted(
+            x for brick in cutting_plan['bricks']
+            for lane in brick for x in lane)
+        self.assertEqual(planned, sorted(x[0] for x in pieces))
+        self.assertEqual(
+            cutting_plan['stock_bricks'], len(cutting_plan['bricks']))
+        self.assertLessEqual(
+            cutting_plan['lower_bound'], cutting_plan['stock_bricks'])
+        self.assertGreater(cutting_plan['waste_volume'], 0)
+
+    def test_uses_less_stock_than_brick_per_two_pieces(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        bom = get_bill_of_materials(geometry)
+        cutting_plan = optimize_cutting(geometry)
+
+        self.assertLess(
+            cutting_plan['stock_bricks'],
+            bom['totals']['stock_bricks'] - bom['floor']['stock_bricks'])
+
+    def test_kerf_takes_stock(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+
+        self.assertGreater(
+            optimize_cutting(geometry, kerf=3)['stock_bricks'],
+            optimize_cutting(geometry)['stock_bricks'])
+
+
+class PackRectanglesTest(TestCase):
+
+    def test_packs_without_overlaps(self):
+        sizes = [(120, 250), (60, 250), (70, 250), (120, 60), (120, 60),
+                 (50, 50), (200, 100)]
+        placements = pack_rectangles(sizes, 200, 280, spacing=5)
+
+        self.assertEqual(len(set(x[0] for x in placements)), 3)
+        rectangles = [
+            (page, x, y, x + size[0], y + size[1])
+            for (page, x, y), size in zip(placements, sizes)]
+        for i, a in enumerate(rectangles):
+            self.assertGreaterEqual(a[1], 0)
+            self.assertGreaterEqual(a[2], 0)
+            self.assertLessEqual(a[3], 200)
+            self.assertLessEqual(a[4], 280)
+            for b in rectangles[i + 1:]:
+                overlaps = a[0] == b[0] \
+                    and a[1] < b[3] + 5 and b[1] < a[3] + 5 \
+                    and a[2] < b[4] + 5 and b[2] < a[4] + 5
+                self.assertFalse(overlaps, (a, b))
+
+    def test_raises_if_rectangle_is_too_large(self):
+        with self.assertRaises(ValueError):
+            pack_rectangles([(100, 300)], 200, 280)
+
+
+class BoundsCanvasTest(TestCase):
+
+    def test_collects_bounds(self):
+        bounds_canvas = BoundsCanvas()
+        bounds_canvas.line(10, 20, 50, 5)
+        bounds_canvas.drawString(45, 40, 'A')
+
+        self.assertEqual(bounds_canvas.bounds[:2], (10, 5))
+        self.assertGreater(bounds_canvas.bounds[2], 50)
+        self.assertEqual(bounds_canvas.bounds[3], 52)
+
+
+class RenderTemplatesPdfTest(TestCase):
+
+    def test_imposition_takes_less_pages(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        pages = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for imposition in (False, True):
+                filename = os.path.join(tmp_dir, 'row-templates.pdf')
+                render_templates_pdf(
+                    geometry, filename=filename, imposition=imposition)
+                with open(filename, 'rb') as f:
+                    pages.append(
+                        len(re.findall(rb'/Type /Page\b', f.read())))
+
+        self.assertEqual(pages[0], len(geometry.rows) + 2)
+        self.assertLess(pages[1], pages[0] * 2 / 3)
+
+    def test_page_notes_are_stored_once(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+
+        def render(imposition):
+            pdf = io.BytesIO()
+            render_templates_pdf(
+                geometry, filename=pdf, imposition=imposition)
+            content = pdf.getvalue()
+            streams = b''.join(
+                zlib.decompress(base64.a85decode(x, adobe=True))
+                for x in re.findall(
+                    rb'stream\r?\n(.*?~>)endstream', content,
+                    re.DOTALL))
+            return len(re.findall(rb'/Type /Page\b', content)), streams
+
+        # Sheets of the imposition share the form.
+        pages, streams = render(True)
+        self.assertGreater(pages, 1)
+        self.assertEqual(streams.count(b'Warning: verify size'), 1)
+        self.assertEqual(streams.count(b'/FormXob.page-notes Do'), pages)
+
+        # Notes are on the first page only, the form would cost more.
+        pages, streams = render(False)
+        self.assertEqual(streams.count(b'Warning: verify size'), 1)
+        self.assertNotIn(b'FormXob', streams)
+
+
+class OptimizeBricksAmountsTest(TestCase):
+
+    def test_returns_amounts_within_widths(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        amounts = optimize_bricks_amounts(geometry, minimal_width=40)
+
+        self.assertEqual(len(amounts), len(geometry.rows))
+        for amount, next_amount in zip(amounts, amounts[1:]):
+            self.assertIn(next_amount, (amount, amount / 2))
+
+        geometry = get_dome_geometry(bricks_amounts=amounts)
+        self.assertEqual(
+            [x.bricks_amount for x in geometry.rows], amounts)
+        for template in geometry.rows:
+            self.assertGreaterEqual(template.top_inner_width, 40)
+            self.assertLessEqual(template.bottom_outer_width, 120)
+
+    def test_minimizes_cuts(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        amounts = optimize_bricks_amounts(
+            geometry, minimal_width=20, objective='cuts')
+
+        # Less bricks in the first row would make them wider than stock.
+        self.assertEqual(amounts[0], 32)
+        self.assertLess(amounts[-1], amounts[0])
+
+    def test_raises_if_no_amount_fits(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        with self.assertRaises(ValueError):
+            optimize_bricks_amounts(geometry, first_bricks_amount=20)
+
+    def test_zero_seam(self):
+        geometry = get_dome_geometry(bricks_amount=32, seam=0)
+        amounts = optimize_bricks_amounts(geometry)
+
+        self.assertEqual(len(amounts), len(geometry.rows))
+        self.assertIsNotNone(evaluate_design({'seam': 0}))
+
+
+class SearchDesignsTest(TestCase):
+
+    def test_evaluates_design(self):
+        result = evaluate_design({
+            'brick_width': 250, 'brick_height': 65, 'brick_depth': 120,
+            'surface_inner_radius': 503, 'height': 440,
+            'first_row_height': 125, 'seam': 3})
+
+        self.assertEqual(result['height'], 440)
+        self.assertEqual(len(result['bricks_amounts']) + 1,
+                         result['templates'])
+        self.assertGreater(result['bricks'], 300)
+        self.assertGreater(result['waste_volume'], 0)
+        self.assertLess(result['key_size'], 250)
+
+    def test_returns_none_for_impossible_design(self):
+        result = evaluate_design({
+            'brick_width': 250, 'brick_height': 65, 'brick_depth': 120,
+            'surface_inner_radius': 503, 'height': 440,
+            'first_row_height': 125, 'seam': 3, 'minimal_width': 200})
+
+        self.assertIsNone(result)
+
+    def test_returns_pareto_front(self):
+        results = [
+            {'bricks': 10, 'waste_volume': 5},
+            {'bricks': 12, 'waste_volume': 4},
+            {'bricks': 12, 'waste_volume': 6},
+            {'bricks': 10, 'waste_volume': 5},
+            {'bricks': 9, 'waste_volume': 7},
+        ]
+        front = get_pareto_front(results, keys=('bricks', 'waste_volume'))
+
+        self.assertEqual(
+            front,
+            [{'bricks': 9, 'waste_volume': 7},
+             {'bricks': 10, 'waste_volume': 5},
+             {'bricks': 12, 'waste_volume': 4}])
+
+    def test_searches_catalog(self):
+        front = search_designs(
+            [(250, 65, 120), (230, 65, 114)], 503, [420, 440],
+            processes=1)
+
+        self.assertTrue(front)
+        for design in front:
+            self.assertIn(design['brick_width'], (250, 230))
+
+    def test_parses_cli_values(self):
+        self.assertEqual(parse_values('400:420:10'), [400, 410, 420])
+        self.assertEqual(parse_values('3,4'), [3, 4])
+        self.assertEqual(
+            parse_catalog('250x65x120,230x65x114'),
+            [(250, 65, 120), (230, 65, 114)])
+
+
+class GetLineCrossingDistanceTest(TestCase):
+
+    def test_returns_first_whole_distance_after_crossing(self):
+        point1 = Point('', 0, 0)
+        point2 = Point('', 30, 40)
+        for x in (0, 0.6, 3, 10.5, 29.9):
+            distance = get_line_crossing_distance(point1, point2, x, 500)
+            expected = next(
+                i for i in range(500)
+                if get_point_on_line(point1, point2, distance=i).x >= x)
+            self.assertEqual(distance, expected)
+
+    def test_returns_last_distance_if_not_reached(self):
+        point1 = Point('', 0, 0)
+        point2 = Point('', -30, 40)
+        self.assertEqual(
+            get_line_crossing_distance(point1, point2, 10, 500), 499)
+
+
+class SolveDesignTest(TestCase):
+
+    def test_finds_height_for_rows(self):
+        height, geometry = solve_design(
+            'rows', 12, parameter='height', bricks_amount=32)
+
+        self.assertEqual(get_design_target(geometry, 'rows'), 12)
+        self.assertEqual(geometry.height, height)
+
+    def test_finds_first_row_height_for_key_radius(self):
+        first_row_height, geometry = solve_design(
+            'key_radius', 110, parameter='first_row_height',
+            bricks_amount=32)
+
+        self.assertAlmostEqual(
+            get_design_target(geometry, 'key_radius'), 110, delta=0.5)
+        self.assertEqual(geometry.first_row_height, first_row_height)
+
+    def test_raises_if_target_is_not_reachable(self):
+        with self.assertRaises(ValueError):
+            solve_design('rows', 40, parameter='height', bricks_amount=32)
+
+
+class GetSensitivityTest(TestCase):
+
+    def test_returns_derivatives_of_every_row(self):
+        sensitivity = get_sensitivity(
+            {'bricks_amount': 32}, parameters=('seam', 'height'),
+            processes=1)
+        geometry = get_dome_geometry(bricks_amount=32)
+
+        self.assertEqual(
+            [x['number'] for x in sensitivity],
+            [x.number for x in geometry.rows])
+        row = sensitivity[0]
+        self.assertEqual(
+            row['sizes']['ab'], geometry.rows[0].bottom_outer_width)
+        self.assertEqual(set(row['derivatives']), {'seam', 'height'})
+        # Every mm of seam is taken from the brick width.
+        self.assertAlmostEqual(
+            row['derivatives']['seam']['ab'], -1, delta=0.2)
+        self.assertIn('d/dseam', format_sensitivity(sensitivity))
+
+    def test_base_sizes_are_design_ones(self):
+        design = {'bricks_amounts': [32, 30, 24]}
+        geometry = get_dome_geometry(**design)
+        with patch(
+                'domebricks.get_row_sizes', wraps=get_row_sizes) as sizes_mock:
+            sensitivity = get_sensitivity(design, parameters=('seam',))
+
+        sizes = get_geometry_row_sizes(geometry)
+        self.assertEqual(
+            [x['sizes'] for x in sensitivity],
+            [sizes[x] for x in sorted(sizes)])
+        # Only perturbed designs are solved, starting from the design.
+        self.assertEqual(
+            [(x[0][0]['seam'], x[1]['warm_start'])
+             for x in sizes_mock.call_args_list],
+            [(2.0, geometry.warm_start), (4.0, geometry.warm_start)])
+
+    def test_parameters_default_to_get_dome_geometry_ones(self):
+        sensitivity = get_sensitivity(
+            {'bricks_amount': 32}, parameters=('minimal_width',))
+        self.assertEqual(
+            set(sensitivity[0]['derivatives']), {'minimal_width'})
+
+    def test_rows_after_last_amount_keep_it(self):
+        geometry = get_dome_geometry(bricks_amounts=[32, 30])
+        self.assertEqual(
+            [x.bricks_amount for x in geometry.rows],
+            [32] + [30] * (len(geometry.rows) - 1))
+
+    def test_bevel_angle(self):
+        template = get_dome_geometry(bricks_amount=32).rows[0]
+        length_diff = template.bottom_outer_width - template.top_outer_width
+        self.assertAlmostEqual(
+            template.bevel_angle,
+            math.degrees(math.atan2(65, length_diff / 2)), places=2)
+
+
+class SimulateTolerancesTest(TestCase):
+
+    def test_nominal_values_match_geometry(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        simulation = simulate_tolerances(
+            geometry, samples=1, brick_tolerance=0, seam_tolerance=0,
+            cut_tolerance=0)
+
+        self.assertEqual(len(simulation['rows']), len(geometry.rows))
+        for row, template in zip(simulation['rows'], geometry.rows):
+            nominal, percentiles = row['height']
+            self.assertAlmostEqual(
+                nominal,
+                geometry.surface_circle_center_point.y
+                - template.row.top_outer_point.y)
+            self.assertAlmostEqual(percentiles[50], nominal)
+        self.assertAlmostEqual(
+            simulation['key_size'][0],
+            2 * geometry.rows[-1].horizontal_top_outer_radius, delta=0.1)
+
+    def test_bands_widen_with_tolerance(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        simulation = simulate_tolerances(geometry, samples=500, seed=1)
+
+        first = simulation['rows'][0]['height'][1]
+        last = simulation['rows'][-1]['closure'][1]
+        self.assertLess(first[5], first[50])
+        self.assertLess(first[50], first[95])
+        self.assertGreater(
+            last[95] - last[5],
+            simulation['rows'][0]['closure'][1][95]
+            - simulation['rows'][0]['closure'][1][5])
+        self.assertIn('key size', format_tolerance_simulation(simulation))
+
+    def test_percentiles(self):
+        self.assertEqual(
+            get_percentiles(range(101), (5, 50, 95)), {5: 5, 50: 50, 95: 95})
+        self.assertEqual(get_percentiles([1, 2], (50,)), {50: 1.5})
+
+
+class VerifyRowsTest(TestCase):
+
+    def test_seams_distance(self):
+        self.assertAlmostEqual(
+            get_seams_distance(32, 0.0, 32, math.pi / 32), math.pi / 32)
+        self.assertAlmostEqual(
+            get_seams_distance(32, 0.0, 16, 2 * math.pi / 32), 0.0)
+        self.assertAlmostEqual(
+            get_seams_distance(30, 0.0, 20, math.pi / 60), math.pi / 60)
+
+    def test_rows_are_turned_by_half_of_the_seams_step(self):
+        geometry = get_dome_geometry(
+            bricks_amounts=[32] * 9 + [16] * 10)
+        seams = get_seam_angles(geometry)
+
+        self.assertEqual(
+            [x[1] for x in seams[1:]],
+            [int(x.bricks_amount) for x in geometry.rows])
+        for below, above in zip(seams[1:], seams[2:]):
+            self.assertAlmostEqual(
+                get_seams_distance(*below[1:], *above[1:]),
+                math.pi / max(below[1], above[1]))
+
+    def test_returns_no_violations_for_staggered_rows(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        self.assertEqual(verify_rows(geometry), [])
+        self.assertTrue(format_violations([]).startswith(
+            'All seams are covered and all rings close.\n'))
+        self.assertIn('best angle', format_violations([]))
+
+    def test_large_dome_rounding_is_not_closure_error(self):
+        geometry = get_dome_geometry(
+            surface_inner_radius=5000, height=5000, first_row_height=300,
+            bricks_amount=400)
+        self.assertEqual(verify_rows(geometry), [])
+
+    def test_reports_close_seams(self):
+        geometry = get_dome_geometry(bricks_amounts=[32] + [31] * 20)
+        violations = verify_rows(geometry, minimal_offset=15)
+
+        # 32 and 31 seams can't be more than 2 * pi / 992 apart.
+        self.assertEqual(
+            (violations[0]['number'], violations[0]['kind']), (3, 'seam'))
+        self.assertLess(violations[0]['value'], 2)
+        self.assertIn('#3: seams', format_violations(violations))
+
+    def test_reports_ring_not_closing(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        geometry.rows[0].b_point.x += 3
+        violations = verify_rows(geometry)
+
+        self.assertEqual(
+            [(x['number'], x['kind']) for x in violations],
+            [(2, 'closure')])
+        self.assertAlmostEqual(violations[0]['value'], -102, delta=2)
+
+    def test_closure_is_measured_by_chords(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        template = geometry.rows[0]
+        radius = abs(
+            geometry.dome_circle_center_point.x
+            - template.row.bottom_outer_point.x)
+        chord = template.bottom_outer_width + template.vertical_seam
+        layout = get_seam_layout(geometry)
+
+        self.assertEqual(len(layout), len(geometry.rows))
+        self.assertEqual(len(layout[0]['angles']), 32)
+        self.assertAlmostEqual(
+            layout[0]['closure'],
+            2 * math.pi * radius - 64 * radius * math.asin(
+                chord / (2 * radius)))
+        # Flat bricks take more of the ring than their arc AB.
+        self.assertLess(layout[0]['closure'], 0)
+
+    def test_reports_bad_layout(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        violations = verify_rows(
+            geometry, start_angles=[0.0] * len(geometry.rows))
+
+        self.assertEqual(
+            [(x['number'], x['kind']) for x in violations],
+            [(x.number, 'seam') for x in geometry.rows[1:]])
+        self.assertAlmostEqual(violations[0]['value'], 0.0)
+        self.assertAlmostEqual(
+            get_layout_seams_distance([0.1, 3.0], [1.0, 6.2]),
+            2 * math.pi - 6.2 + 0.1)
+
+
+class GetThrustLineTest(TestCase):
+
+    def test_polygon_centroid(self):
+        self.assertEqual(
+            get_polygon_centroid([(0, 0), (4, 0), (4, 2), (0, 2)]), (2, 1))
+        centroid = get_polygon_centroid([(0, 0), (3, 0), (0, 3)])
+        self.assertAlmostEqual(centroid[0], 1)
+        self.assertAlmostEqual(centroid[1], 1)
+
+    def test_thrust_line_passes_springing_middle(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        thrust_line = get_thrust_line(geometry)
+        rows = thrust_line['rows']
+
+        self.assertGreater(thrust_line['thrust'], 0)
+        self.assertEqual(
+            [x['number'] for x in rows],
+            [1] + [x.number for x in geometry.rows])
+        self.assertAlmostEqual(rows[1]['position'], 0.5)
+        self.assertTrue(rows[1]['inside'])
+        loads = [x['load'] for x in rows]
+        self.assertEqual(loads, sorted(loads, reverse=True))
+        self.assertIn('#2', format_thrust_line(thrust_line))
+
+    def test_load_scales_with_density(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        light = get_thrust_line(geometry, density=1000.0)
+        heavy = get_thrust_line(geometry, density=2000.0)
+
+        self.assertAlmostEqual(heavy['thrust'], 2 * light['thrust'])
+        for x, y in zip(light['rows'], heavy['rows']):
+            self.assertAlmostEqual(y['load'], 2 * x['load'])
+            self.assertAlmostEqual(y['position'], x['position'])
+
+
+class FitDomeTest(TestCase):
+
+    def get_points(self, **params):
+        bottom_z, top_inner, center_z, radius = get_inner_profile(**params)
+        points = [(top_inner[0], z) for z in (0, 20)]
+        start = math.atan2(top_inner[1] - center_z, top_inner[0])
+        for i in range(1, 10):
+            angle = start + (math.pi / 2 - start) * i / 10.0
+            points.append((
+                radius * math.cos(angle),
+                center_z + radius * math.sin(angle)))
+        return points
+
+    def test_profile_matches_dome_geometry(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        profile = get_inner_profile()
+        axis_x = geometry.dome_circle_center_point.x
+        floor_y = geometry.surface_circle_center_point.y
+        for template in geometry.rows:
+            point = template.row.top_inner_point
+            self.assertLess(abs(get_profile_distance(
+                profile, (axis_x - point.x, floor_y - point.y))), 3)
+
+    def test_profile_distance(self):
+        profile = get_inner_profile()
+        for point in self.get_points():
+            self.assertAlmostEqual(get_profile_distance(profile, point), 0)
+        self.assertAlmostEqual(get_profile_distance(profile, (513, 0)), 10)
+        self.assertAlmostEqual(get_profile_distance(profile, (493, 0)), -10)
+
+    def test_finds_params_of_the_profile(self):
+        points = self.get_points(
+            surface_inner_radius=620, height=510, first_row_height=170)
+        params, rms = fit_dome(points)
+
+        self.assertAlmostEqual(params['surface_inner_radius'], 620, places=2)
+        self.assertAlmostEqual(params['height'], 510, places=2)
+        self.assertAlmostEqual(params['first_row_height'], 170, places=1)
+        self.assertLess(rms, 0.01)
+
+    def test_solve_linear(self):
+        self.assertEqual(
+            solve_linear([[0, 2], [4, 0]], [2, 8]), [2.0, 1.0])
+
+    def test_parse_points(self):
+        self.assertEqual(
+            parse_points(['# r,z', '503,0', '', '400;300 # top']),
+            [(503.0, 0.0), (400.0, 300.0)])
+
+
+class LargeDomeTest(TestCase):
+
+    def test_builds_all_rows_of_5m_dome(self):
+        geometry = get_dome_geometry(
+            surface_inner_radius=5000, height=5000, first_row_height=300,
+            bricks_amount=1)
+
+        self.assertGreater(len(geometry.rows), 100)
+        self.assertLessEqual(
+            geometry.rows[-1].horizontal_top_outer_radius, 125)
+
+    def test_finds_center_of_shallow_dome(self):
+        geometry = get_dome_geometry(
+            surface_inner_radius=5000, height=2500, first_row_height=300,
+            bricks_amount=1)
+
+        # Center is more than 6000 1 mm steps under the height.
+        self.assertGreater(
+            geometry.dome_circle_center_point.y
+            - geometry.height_inner_point.y, 6000)
+
+    def test_split_row(self):
+        bricks, vertical_seam = split_row(None, 5000, 120, seam=3)
+
+        self.assertEqual(vertical_seam, 3)
+        self.assertEqual(len(bricks), int(2 * math.pi * 5000 / 123) + 1)
+        self.assertAlmostEqual(
+            sum(bricks) + len(bricks) * 3, 2 * math.pi * 5000, delta=10)
+
+    def test_get_first_index(self):
+        self.assertEqual(get_first_index(0, 10, lambda x: x >= 3), 3)
+        self.assertEqual(get_first_index(0, 10, lambda x: x >= 20), 10)
+        self.assertEqual(get_first_index(5, 10, lambda x: True), 5)
+
+
+class ValidateParamsTest(TestCase):
+
+    def assertInvalid(self, message, **params):
+        with self.assertRaises(ValueError) as context:
+            validate_params(**params)
+        self.assertIn(message, str(context.exception))
+
+    def test_accepts_defaults_and_large_domes(self):
+        validate_params()
+        validate_params(
+            surface_inner_radius=5000, height=5000, first_row_height=300,
+            bricks_amount=400)
+
+    def test_rejects_invalid_sizes(self):
+        self.assertInvalid('Invalid brick_width', brick_width=0)
+        self.assertInvalid('Invalid height', height=-440)
+        self.assertInvalid('Invalid seam. Expecting >= 0', seam=-1)
+        self.assertInvalid('Invalid bricks_amount', bricks_amount=0)
+        self.assertInvalid('Invalid bricks_amounts', bricks_amounts=[32, 0])
+        self.assertInvalid('Invalid minimal_width', minimal_width=-1)
+
+    def test_rejects_seam_larger_than_brick(self):
+        self.assertInvalid(
+            'Invalid seam. Expecting less than brick_height', seam=70)
+
+    def test_rejects_first_row_higher_than_dome(self):
+        self.assertInvalid(
+            'Soldier row top (735.0) must be lower than height (440.0)',
+            first_row_height=800, surface_inner_radius=1500)
+
+    def test_rejects_first_row_too_high_for_radius(self):
+        self.assertInvalid(
+            'Invalid first_row_height. Expecting less than',
+            first_row_height=450, surface_inner_radius=300, height=1000)
+
+    def test_rejects_radius_too_small_for_brick(self):
+        self.assertInvalid(
+            'Expecting more than half of brick_width (125.0)',
+            surface_inner_radius=100, first_row_height=60, height=200)
+
+    def test_geometry_is_not_solved_for_invalid_params(self):
+        with self.assertRaises(ValueError):
+            get_dome_geometry(seam=70, bricks_amount=32)
+        with self.assertRaises(ValueError):
+            build_svg(seam=70, bricks_amount=32)
+
+
+class WarmStartTest(TestCase):
+
+    def get_rows(self, geometry):
+        return [
+            (x.number, x.bottom_outer_width, x.top_inner_width,
+             x.horizontal_top_outer_radius)
+            for x in geometry.rows]
+
+    def test_warm_geometry_is_same_as_cold(self):
+        warm_start = get_dome_geometry(
+            height=440, bricks_amount=32).warm_start
+        for height in (400, 430, 450, 480):
+            cold = get_dome_geometry(height=height, bricks_amount=32)
+            warm = get_dome_geometry(
+                height=height, bricks_amount=32, warm_start=warm_start)
+
+            self.assertEqual(
+                warm.dome_circle_center_point.y,
+                cold.dome_circle_center_point.y)
+            self.assertEqual(
+                warm.first_row.top_outer_point.y,
+                cold.first_row.top_outer_point.y)
+            self.assertEqual(self.get_rows(warm), self.get_rows(cold))
+            self.assertEqual(warm.warm_start, cold.warm_start)
+
+    def test_get_first_index_with_hint(self):
+        for hint in (0, 2, 3, 4, 9, 10, 50):
+            self.assertEqual(
+                get_first_index(0, 10, lambda x: x >= 3, hint=hint), 3)
+
+    def test_get_accumulated_radians(self):
+        radians = get_accumulated_radians(0.25)
+        expected = list(itertools.takewhile(
+            lambda x: x < 2 * math.pi,
+            itertools.accumulate(itertools.repeat(0.25), initial=0.0)))
+
+        self.assertEqual(list(radians), expected)
+        self.assertIs(get_accumulated_radians(0.25), radians)
+
+    def test_accumulated_radians_cache_does_not_grow(self):
+        get_dome_geometry(bricks_amount=32)
+        size = get_accumulated_radians.cache_info().currsize
+        for radius, height in ((480, 420), (520, 450), (560, 470)):
+            get_dome_geometry(
+                surface_inner_radius=radius, height=height,
+                first_row_height=110, bricks_amount=30)
+        self.assertEqual(get_accumulated_radians.cache_info().currsize, size)
+
+    def test_get_snake_product(self):
+        self.assertEqual(
+            list(get_snake_product([0, 1], 'ab', [5])),
+            [(0, 'a', 5), (0, 'b', 5), (1, 'b', 5), (1, 'a', 5)])
+
+    def test_evaluate_designs(self):
+        designs = [
+            {'height': 420, 'seam': 3},
+            {'height': 50, 'seam': 3},
+            {'height': 440, 'seam': 3}]
+        results = evaluate_designs(designs)
+
+        self.assertIsNone(results[1])
+        for design, result in zip(designs, results):
+            self.assertEqual(result, evaluate_design(design))
+
+
+class SurrogateTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = build_surrogate(
+            [(250, 65, 120)], [480, 520], [420, 460], [125, 150],
+            validation_samples=4, seed=1, processes=1)
+
+    def test_predicts_exact_designs_in_grid_nodes(self):
+        surrogate = Surrogate(self.data)
+        result = evaluate_design({
+            'surface_inner_radius': 520, 'height': 420,
+            'first_row_height': 150})
+
+        self.assertEqual(surrogate.predict(520, 420, 150), {
+            'rows': len(result['bricks_amounts']) + 1,
+            'bricks': result['bricks'], 'key_size': result['key_size']})
+
+    def test_interpolates_between_nodes(self):
+        surrogate = Surrogate(self.data)
+        low = surrogate.predict(480, 440, 125)
+        high = surrogate.predict(520, 440, 125)
+
+        self.assertAlmostEqual(
+            surrogate.predict(500, 440, 125)['bricks'],
+            (low['bricks'] + high['bricks']) / 2.0)
+
+    def test_out_of_table(self):
+        surrogate = Surrogate(self.data)
+
+        self.assertIsNone(surrogate.predict(600, 440, 125))
+        self.assertIsNone(surrogate.predict(
+            500, 440, 125, brick_width=230, brick_height=65,
+            brick_depth=114))
+
+    def test_loads_table_from_file(self):
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, 'designs.bin')
+            with open(path, 'wb') as f:
+                f.write(self.data)
+            surrogate = load_surrogate(path)
+
+            self.assertEqual(surrogate.catalog, [(250.0, 65.0, 120.0)])
+            self.assertEqual(
+                surrogate.axes, [[480.0, 520.0], [420.0, 460.0],
+                                 [125.0, 150.0]])
+            self.assertEqual(
+                sorted(surrogate.error), ['bricks', 'key_size', 'rows'])
+            self.assertEqual(
+                surrogate.predict(500, 440, 130),
+                Surrogate(self.data).predict(500, 440, 130))
+
+    def test_rejects_invalid_axes_and_data(self):
+        with self.assertRaises(ValueError):
+            build_surrogate([(250, 65, 120)], [480], [420, 460], [125, 150])
+        with self.assertRaises(ValueError):
+            Surrogate(b'X' * len(self.data))
+
+
+class SweepDesignsTest(TestCase):
+
+    def test_npy_round_trip(self):
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, 'table.npy')
+            with NpyWriter(path, [('a', 'q'), ('b', 'd'), ('c', '?')]) as f:
+                f.write([(1, 0.5, True)])
+                f.write([(2, -1.5, False), (3, 2.0, True)])
+
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.assertEqual(data[:8], b'\x93NUMPY\x01\x00')
+            header_size, = struct.unpack('<H', data[8:10])
+            self.assertEqual((10 + header_size) % 64, 0)
+            self.assertIn(
+                "'descr': [('a', '<i8'), ('b', '<f8'), ('c', '|b1')],"
+                " 'fortran_order': False, 'shape': (3,)",
+                data[10:10 + header_size].decode())
+            self.assertEqual(len(data), 10 + header_size + 3 * 17)
+
+            with NpyTable(path) as table:
+                self.assertEqual(len(table), 3)
+                self.assertEqual(table[1], {'a': 2, 'b': -1.5, 'c': False})
+                self.assertEqual(table[-1]['a'], 3)
+                self.assertEqual(list(table.get_column('b')), [0.5, -1.5, 2])
+                self.assertEqual([x['c'] for x in table], [True, False, True])
+                with self.assertRaises(IndexError):
+                    table[3]
+
+    def test_writes_designs_and_rows(self):
+        with tempfile.TemporaryDirectory() as path:
+            amounts = sweep_designs(
+                path, [(250, 65, 120)], [503], [50, 420, 440],
+                chunksize=2, processes=1)
+
+            with NpyTable(os.path.join(path, 'designs.npy')) as designs, \
+                    NpyTable(os.path.join(path, 'rows.npy')) as rows:
+                self.assertEqual(amounts, (len(designs), len(rows)))
+                self.assertEqual(
+                    sorted(designs.get_column('design')), [0, 1, 2])
+                designs = {x['design']: x for x in designs}
+                self.assertFalse(designs[0]['built'])
+                result = evaluate_design(
+                    {'surface_inner_radius': 503, 'height': 440})
+                self.assertTrue(designs[2]['built'])
+                self.assertEqual(
+                    designs[2]['rows'], len(result['bricks_amounts']) + 1)
+                self.assertEqual(designs[2]['bricks'], result['bricks'])
+                self.assertEqual(
+                    [{k: v for k, v in x.items() if k != 'design'}
+                     for x in rows if x['design'] == 2],
+                    result['row_sizes'])
+
+
+class CancelTokenTest(TestCase):
+
+    def test_check(self):
+        CancelToken().check()
+        CancelToken(timeout=60).check()
+        with self.assertRaises(TimeoutError):
+            CancelToken(timeout=-1).check()
+        token = CancelToken()
+        token.cancel()
+        with self.assertRaises(CancelledError):
+            token.check()
+
+    def test_solvers_check_token(self):
+        with self.assertRaisesRegex(TimeoutError, 'budget of -1 s'):
+            get_dome_geometry(
+                bricks_amount=32, cancel_token=CancelToken(timeout=-1))
+
+    def test_async_timeout(self):
+        with self.assertRaises(TimeoutError):
+            asyncio.run(get_dome_geometry_async(
+                timeout=-1, bricks_amount=32))
+        geometry = asyncio.run(get_dome_geometry_async(
+            timeout=60, bricks_amount=32))
+        self.assertEqual(
+            len(geometry.rows),
+            len(get_dome_geometry(bricks_amount=32).rows))
+
+    def test_render_loops_check_token(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        token = CancelToken()
+        token.cancel()
+        for imposition in (False, True):
+            with self.assertRaises(CancelledError):
+                render_templates_pdf(
+                    geometry, filename=io.BytesIO(), imposition=imposition,
+                    cancel_token=token)
+        with self.assertRaises(CancelledError):
+            render_dome_svg(geometry, cancel_token=token)
+
+    def test_async_build_writes_no_files(self):
+        with tempfile.TemporaryDirectory() as path:
+            cwd = os.getcwd()
+            os.chdir(path)
+            try:
+                outputs = asyncio.run(build_svg_async(bricks_amount=32))
+                self.assertEqual(os.listdir(path), [])
+            finally:
+                os.chdir(cwd)
+        self.assertTrue(outputs['pdf'].startswith(b'%PDF'))
+        self.assertIn('<svg', outputs['svg'])
+
+    def test_build_svg_output_paths(self):
+        with tempfile.TemporaryDirectory() as path:
+            svg_filename = os.path.join(path, 'a.svg')
+            pdf_filename = os.path.join(path, 'a.pdf')
+            svg = build_svg(
+                bricks_amount=32, svg_filename=svg_filename,
+                pdf_filename=pdf_filename)
+            self.assertEqual(sorted(os.listdir(path)), ['a.pdf', 'a.svg'])
+            with open(svg_filename) as f:
+                self.assertEqual(f.read(), svg)
+
+    def test_cancel_stops_worker(self):
+        started = threading.Event()
+        stopped = threading.Event()
+
+        def build(cancel_token):
+            started.set()
+            try:
+                while True:
+                    cancel_token.check()
+            finally:
+                stopped.set()
+
+        async def cancel():
+            task = asyncio.ensure_future(run_cancellable(build))
+            await asyncio.get_running_loop().run_in_executor(
+                None, started.wait)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+        self.assertTrue(stopped.wait(5))
+
+
+class SingleFlightTest(TestCase):
+
+    def test_get_call_key(self):
+        self.assertEqual(
+            get_call_key(build_svg, height=440, bricks_amounts=[30, 24]),
+            get_call_key(
+                build_svg, height=440.0, surface_inner_radius=503,
+                bricks_amounts=(30.0, 24.0), cancel_token=CancelToken()))
+        self.assertNotEqual(
+            get_call_key(build_svg, height=440),
+            get_call_key(build_svg, height=441))
+        self.assertNotEqual(
+            get_call_key(build_svg), get_call_key(get_dome_geometry))
+
+    def test_coalesces_concurrent_threads(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return object()
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(flight.do('key', compute)))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while flight.metrics['requests'] < 4:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(x is results[0] for x in results))
+        self.assertEqual(flight.metrics, {
+            'requests': 4, 'computations': 1, 'coalesced': 3,
+            'in_flight': 0})
+
+    def test_coalesces_concurrent_tasks(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return [value]
+
+        async def run():
+            return await asyncio.gather(
+                flight.do_async('a', compute, 1),
+                flight.do_async('a', compute, 1),
+                flight.do_async('b', compute, 2))
+
+        first, second, third = asyncio.run(run())
+
+        self.assertIs(first, second)
+        self.assertEqual(third, [2])
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(flight.metrics['coalesced'], 1)
+
+    def test_shares_exception(self):
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError('Invalid')
+
+        async def run():
+            return await asyncio.gather(
+                flight.do_async('a', compute), flight.do_async('a', compute),
+                return_exceptions=True)
+
+        errors = asyncio.run(run())
+        self.assertIsInstance(errors[0], ValueError)
+        self.assertIs(errors[0], errors[1])
+
+    def test_cancels_computation_without_waiters(self):
+        flight = SingleFlight()
+        finished = []
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            finished.append(1)
+            return 1
+
+        async def run():
+            first = asyncio.ensure_future(flight.do_async('a', compute))
+            second = asyncio.ensure_future(flight.do_async('a', compute))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            self.assertEqual(await second, 1)
+
+            third = asyncio.ensure_future(flight.do_async('a', compute))
+            await asyncio.sleep(0.01)
+            third.cancel()
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(finished, [1])
+        self.assertEqual(flight.metrics['in_flight'], 0)
+
+    def test_drops_call_when_all_waiters_cancel(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        async def run():
+            first = asyncio.ensure_future(flight.do_async('a', compute))
+            second = asyncio.ensure_future(flight.do_async('a', compute))
+            await asyncio.sleep(0.01)
+            task = flight.async_calls['a']['task']
+            first.cancel()
+            second.cancel()
+            await asyncio.gather(first, second, return_exceptions=True)
+
+            self.assertNotIn('a', flight.async_calls)
+            result = await flight.do_async('a', compute)
+            self.assertTrue(task.cancelled())
+            return result
+
+        self.assertEqual(asyncio.run(run()), 2)
+        self.assertEqual(flight.metrics, {
+            'requests': 3, 'computations': 2, 'coalesced': 1,
+            'in_flight': 0})
+
+    def test_build_svg_async(self):
+        flight = SingleFlight()
+
+        async def run():
+            return await asyncio.gather(
+                flight.build_svg_async(bricks_amount=32, height=440),
+                flight.build_svg_async(bricks_amount=32, height=440.0))
+
+        with tempfile.TemporaryDirectory() as path:
+            cwd = os.getcwd()
+            os.chdir(path)
+            try:
+                first, second = asyncio.run(run())
+                outputs = flight.build_svg(bricks_amount=32)
+                self.assertEqual(os.listdir(path), [])
+            finally:
+                os.chdir(cwd)
+        self.assertIs(first, second)
+        self.assertEqual(flight.metrics['computations'], 2)
+        self.assertEqual(len(outputs['svg']), len(first['svg']))
+        self.assertTrue(outputs['pdf'].startswith(b'%PDF'))
+
+
+class UpdateBuildTest(TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.path = tempfile.TemporaryDirectory()
+        os.chdir(self.path.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.path.cleanup()
+
+    def test_recomputes_affected_stages(self):
+        state = update_build({'bricks_amount': 32})
+        self.assertEqual(
+            state['stages'], ['center', 'geometry', 'rows', 'pdf', 'svg'])
+        self.assertEqual(state['files'], ['row-templates.pdf', 'dome.svg'])
+
+        for params, changed, stages, files in (
+                ({'support_template_step': 2}, ['support_template_step'],
+                 ['svg'], ['dome.svg']),
+                ({'imposition': True}, ['imposition'], ['pdf'],
+                 ['row-templates.pdf']),
+                ({'seam': 4}, ['seam'], ['geometry', 'pdf', 'svg'],
+                 ['row-templates.pdf', 'dome.svg']),
+                ({'bricks_amount': 24}, ['bricks_amount'],
+                 ['rows', 'pdf', 'svg'], ['row-templates.pdf', 'dome.svg']),
+                ({'height': 450}, ['height'],
+                 ['center', 'geometry', 'pdf', 'svg'],
+                 ['row-templates.pdf', 'dome.svg']),
+                ({}, [], [], [])):
+            state = update_build(
+                dict(state['params'], **params), previous=state)
+            self.assertEqual(state['changed'], changed)
+            self.assertEqual(state['stages'], stages)
+            self.assertEqual(state['files'], files)
+
+    def test_output_is_same_as_build_svg(self):
+        state = update_build({'bricks_amount': 32})
+        update_build({'bricks_amount': 24, 'seam': 4}, previous=state)
+        with open('dome.svg') as f:
+            svg = f.read()
+
+        def strip(x):
+            return re.sub('path-[0-9a-f]{32}', '', x)
+
+        self.assertEqual(
+            strip(svg), strip(build_svg(bricks_amount=24, seam=4)))
+
+    def test_seam_reuses_dome_circle(self):
+        state = update_build({'bricks_amount': 32})
+        with patch('domebricks.get_dome_inner_radius') as solve_mock:
+            seam_state = update_build(
+                dict(state['params'], seam=4), previous=state)
+        solve_mock.assert_not_called()
+
+        geometry = get_dome_geometry(bricks_amount=32, seam=4)
+        self.assertEqual(
+            [x.bottom_outer_width for x in seam_state['geometry'].rows],
+            [x.bottom_outer_width for x in geometry.rows])
+        self.assertEqual(state['geometry'].seam, 3)
+
+    def test_previous_geometry_is_not_changed(self):
+        state = update_build({'bricks_amount': 32})
+        rows = state['geometry'].rows
+        update_build(dict(state['params'], bricks_amount=24), previous=state)
+        self.assertIs(state['geometry'].rows, rows)
+
+    def test_invalid_params(self):
+        state = update_build({'bricks_amount': 32})
+        with self.assertRaises(ValueError):
+            update_build({'bricks_amount': 32, 'seam': 80}, previous=state)
+        with self.assertRaises(TypeError):
+            update_build({'bricks_amount': 32, 'radius': 80}, previous=state)
+
+    def test_watch_params(self):
+        with open('params.json', 'w') as f:
+            json.dump({'bricks_amount': 32}, f)
+        with patch('builtins.print') as print_mock:
+            watch_params('params.json', interval=0, iterations=2)
+        self.assertEqual(print_mock.call_count, 1)
+        self.assertTrue(os.path.exists('dome.svg'))
+
+
+class SvgFragmentsTest(TestCase):
+
+    def test_get_bounds(self):
+        self.assertEqual(
+            get_bounds([Point('A', 10, 20), Point('B', 30, 5)], margin=5),
+            (5, 0, 30, 25))
+
+    def test_row_fragment(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        row = geometry.rows[4].row
+        svg, bounds = get_row_svg_fragment(geometry, row.number)
+
+        x, y, width, height = bounds
+        for point in (row.bottom_outer_point, row.top_outer_point,
+                      row.top_inner_point, row.bottom_inner_point):
+            self.assertTrue(x < point.x < x + width)
+            self.assertTrue(y < point.y < y + height)
+        self.assertIn(
+            'viewBox="{} {} {} {}"'.format(
+                *[round(x, 1) for x in bounds]), svg)
+        self.assertIn('width="{}mm"'.format(round(width, 1)), svg)
+        # Soldier row outer height.
+        self.assertIn('125.0', get_row_svg_fragment(geometry, 1)[0])
+        with self.assertRaises(ValueError):
+            get_row_svg_fragment(geometry, 100)
+
+    def test_template_fragment(self):
+        template = get_dome_geometry(bricks_amount=32).rows[4]
+        svg, bounds = get_template_svg_fragment(template)
+
+        # Height is two bricks and half of the brick width with margins.
+        self.assertAlmostEqual(bounds[3], 65 * 2 + 125 + 80)
+        self.assertIn(f'Row #{template.number}', svg)
+        self.assertIn('>{}<'.format(template.bottom_outer_width),
+                      re.sub(r'\s+', '', svg))
+
+    def test_outline_fragments_have_no_text(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        with svg_detail(DETAIL_OUTLINE):
+            svgs = [
+                get_template_svg_fragment(geometry.rows[4])[0],
+                get_row_svg_fragment(geometry, 5)[0]]
+        for svg in svgs:
+            self.assertNotIn('<text', svg)
+            self.assertIn('<path', svg)
+
+    def test_write_svg_fragments(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        with tempfile.TemporaryDirectory() as path:
+            files = write_svg_fragments(geometry, path=path)
+
+            self.assertEqual(len(files), 1 + 2 * len(geometry.rows))
+            self.assertEqual(
+                sorted(os.listdir(path)),
+                sorted(os.path.basename(x) for x in files))
+            self.assertIn(os.path.join(path, 'template-2.svg'), files)
+
+
+class SvgDetailTest(TestCase):
+
+    def test_elements_detail(self):
+        point = Point('A', 10, 20)
+        path = Path(Point('A', 0, 0), Point('B', 30, 40))
+
+        self.assertIn('<circle', point.as_csv())
+        self.assertIn('<textPath', path.as_csv())
+        with svg_detail(DETAIL_DIMENSIONS):
+            self.assertEqual(point.as_csv(), '')
+            self.assertIn('<textPath', path.as_csv())
+        with svg_detail(DETAIL_OUTLINE):
+            self.assertEqual(point.as_csv(), '')
+            self.assertEqual(path.as_csv(opacity=0), '')
+            self.assertEqual(
+                path.as_csv(stroke='red', dasharray=True),
+                '<path stroke-width="2" stroke="red"'
+                ' stroke-dasharray="6" d="M0,0 L30,40" fill="none" />')
+        self.assertIn('<circle', point.as_csv())
+
+    def test_detail_is_local_to_thread(self):
+        results = []
+        with svg_detail(DETAIL_OUTLINE):
+            thread = threading.Thread(
+                target=lambda: results.append(Point('A', 1, 2).as_csv()))
+            thread.start()
+            thread.join()
+        self.assertIn('<circle', results[0])
+
+    def test_render_dome_svg(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        svgs = [
+            render_dome_svg(geometry, detail=x)
+            for x in (DETAIL_OUTLINE, DETAIL_DIMENSIONS, DETAIL_FULL)]
+
+        self.assertNotIn('<text', svgs[0])
+        self.assertNotIn('<circle', svgs[1])
+        self.assertIn('<textPath', svgs[1])
+        self.assertIn('<circle', svgs[2])
+        counts = [x.count('<') for x in svgs]
+        self.assertLess(counts[0] * 5, counts[2])
+        self.assertLess(counts[1], counts[2])
+        # Every row outline is kept.
+        self.assertGreaterEqual(
+            svgs[0].count('stroke="orange"'), 4 * len(geometry.rows))
+
+
+class LabelPlacementTest(TestCase):
+
+    def get_label_boxes(self, svg):
+        return [
+            get_text_box(float(x), float(y), text)
+            for x, y, text in re.findall(
+                r'<text fill="[^"]*" x="([^"]+)" y="([^"]+)">'
+                r'\s*([^<\s]+)', svg)]
+
+    def assertNoOverlaps(self, boxes):
+        placer = LabelPlacer()
+        for box in boxes:
+            self.assertEqual(placer.get_overlaps(box), 0, box)
+            placer.add(box)
+
+    def test_placer(self):
+        placer = LabelPlacer(cell_size=10)
+        placer.add((0, 0, 25, 5))
+
+        self.assertEqual(placer.get_overlaps((20, 4, 30, 8)), 1)
+        self.assertEqual(placer.get_overlaps((25, 0, 30, 5)), 0)
+        self.assertEqual(placer.get_overlaps((-30, -30, 60, 60)), 1)
+        self.assertEqual(
+            placer.place([(1, 1, 2, 2), (30, 0, 40, 5), (40, 0, 50, 5)]), 1)
+        # All overlap, the least overlapping is taken.
+        self.assertEqual(
+            placer.place([(0, 0, 40, 5), (30, 0, 35, 5)]), 1)
+
+    def test_point_labels_do_not_overlap(self):
+        points = [Point(f'P{i}', 100 + i % 3, 100 + i % 2) for i in range(4)]
+        with label_placement():
+            svg = ''.join(x.as_csv() for x in points)
+        boxes = self.get_label_boxes(svg)
+
+        self.assertEqual(len(boxes), 4)
+        self.assertNoOverlaps(boxes)
+        # Without placement every label is at the default position.
+        self.assertIn('x="80" y="90"', points[0].as_csv())
+
+    def test_placer_weights(self):
+        placer = LabelPlacer(cell_size=10)
+        placer.add((0, 0, 10, 10), weight=0.5, key='path')
+        placer.add((10, 0, 20, 10), weight=0.5, key='path')
+        placer.add((0, 20, 10, 30))
+
+        # Boxes of one label are counted once.
+        self.assertEqual(placer.get_overlaps((5, 5, 15, 8)), 0.5)
+        self.assertEqual(
+            placer.place([(5, 25, 8, 28), (5, 5, 15, 8)]), 1)
+
+    def test_point_label_avoids_path_label(self):
+        path = Path(Point('A', 100, 100), Point('B', 300, 100))
+        point = Point('P', 125, 100)
+        with label_placement():
+            svg = path.as_csv() + point.as_csv()
+        path_boxes = get_text_path_boxes(
+            path.p1, path.p2, -16, path.distance)
+
+        self.assertEqual(len(path_boxes), 3)
+        # Text is above the path along its first 42 px.
+        self.assertEqual(path_boxes[0][0], 100)
+        self.assertAlmostEqual(path_boxes[-1][2], 142)
+        self.assertLess(max(x[3] for x in path_boxes), 100)
+        box, = self.get_label_boxes(svg)
+        placer = LabelPlacer()
+        for path_box in path_boxes:
+            placer.add(path_box)
+        self.assertEqual(placer.get_overlaps(box), 0)
+        # The default position is on the path label.
+        self.assertGreater(placer.get_overlaps(get_text_box(105, 90, 'P')), 0)
+
+    def test_render_dome_svg(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        placed = self.get_label_boxes(
+            render_dome_svg(geometry, place_labels=True))
+        default = self.get_label_boxes(render_dome_svg(geometry))
+
+        self.assertEqual(len(placed), len(default))
+        self.assertNoOverlaps(placed)
+        with self.assertRaises(AssertionError):
+            self.assertNoOverlaps(default)
+
+
+class PlotTest(TestCase):
+
+    def test_plot_recording(self):
+        a = Point('A', 0, 0)
+        b = Point('B', 30, 40)
+        with plot_recording() as segments:
+            Path(a, b).as_csv(stroke='red')
+            Path(b, a).as_csv(opacity=0)
+            with svg_detail(DETAIL_OUTLINE):
+                Path(b, a).as_csv()
+        Path(a, b).as_csv()
+
+        self.assertEqual(segments, [
+            ('red', (0, 0), (30, 40)), ('black', (30, 40), (0, 0))])
+
+    def test_merge_segments(self):
+        square = [
+            ((0, 0), (10, 0)), ((10, 0), (10, 10)), ((0, 10), (10, 10)),
+            ((0, 10), (0, 0))]
+        # Collinear parts, one of them repeated in the other direction.
+        line = [
+            ((20, 0), (25, 0)), ((30, 0), (25, 0.001)), ((25, 0), (20, 0))]
+        polylines = merge_segments(square + line)
+
+        self.assertEqual(len(polylines), 2)
+        self.assertIn([(20, 0), (30, 0)], polylines)
+        closed = [x for x in polylines if len(x) == 5][0]
+        self.assertEqual(closed[0], closed[-1])
+        self.assertEqual(
+            sorted(closed[:4]), [(0, 0), (0, 10), (10, 0), (10, 10)])
+
+    def test_merge_segments_goes_straight_through_junctions(self):
+        cross = [
+            ((0, 0), (5, 0)), ((5, 0), (5, 5)), ((5, 0), (10, 0)),
+            ((5, -5), (5, 0))]
+        polylines = merge_segments(cross)
+
+        self.assertEqual(
+            sorted(sorted(x) for x in polylines),
+            [[(0, 0), (10, 0)], [(5, -5), (5, 5)]])
+
+    def test_order_polylines(self):
+        polylines = [
+            [(10, 0), (11, 0)], [(0, 0), (1, 0)], [(3, 0), (2, 0)]]
+        ordered = order_polylines(polylines)
+
+        self.assertEqual(
+            ordered, [[(0, 0), (1, 0)], [(2, 0), (3, 0)], [(10, 0), (11, 0)]])
+        self.assertEqual(get_travel_distance(ordered), 8)
+        self.assertEqual(get_travel_distance(polylines), 23)
+        self.assertEqual(order_polylines([]), [])
+
+    def test_order_polylines_with_coincident_ends(self):
+        # Cells are sized by the distance to the pen, not 1 mm, or the
+        # first search goes through millions of empty cells.
+        polylines = [[(3000, 3000), (3000, 3000)] for _ in range(4)]
+        self.assertEqual(order_polylines(polylines), polylines)
+        self.assertEqual(
+            order_polylines(polylines, start=(3000, 3000)), polylines)
+
+        line = [[(x, 0), (x + 10, 0)] for x in range(3000, 0, -100)]
+        ordered = order_polylines(line)
+        self.assertEqual(ordered, line[::-1])
+        self.assertEqual(get_travel_distance(ordered), 100 + 90 * 29)
+
+    def test_order_polylines_two_opt(self):
+        # Nearest neighbour goes to the middle first and comes back.
+        polylines = [[(x, 0), (x, 1)] for x in (4, 6, -3, 14, 15)]
+        nearest = order_polylines(polylines, start=(5, 0), passes=0)
+        ordered = order_polylines(polylines, start=(5, 0))
+
+        self.assertLess(
+            get_travel_distance(ordered, start=(5, 0)),
+            get_travel_distance(nearest, start=(5, 0)))
+        self.assertEqual(
+            sorted(sorted(x) for x in ordered),
+            sorted(sorted(x) for x in polylines))
+
+    def test_get_plot_segments(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        templates = get_plot_segments(geometry, target='templates')
+
+        self.assertEqual(len(templates), 10 * len(geometry.rows))
+        self.assertEqual(
+            min(min(x[1][1], x[2][1]) for x in templates), 0)
+        self.assertGreater(
+            len(get_plot_segments(geometry, target='dome')),
+            len(get_plot_segments(geometry, target='support')))
+        with self.assertRaises(ValueError):
+            get_plot_segments(geometry, target='roof')
+
+    def test_build_plot(self):
+        geometry = get_dome_geometry(bricks_amount=32)
+        hpgl, report = build_plot(geometry)
+
+        self.assertTrue(hpgl.startswith('IN;\nSP1;\nPU'))
+        self.assertTrue(hpgl.endswith('PU;\nSP0;\n'))
+        self.assertLess(report['polylines'], report['segments'])
+        self.assertLess(report['travel_after'], report['travel_before'] / 2)
+        self.assertIn('optimized', format_plot_report(report))
+        coordinates = [
+            int(x) for x in re.findall(r'-?\d+', hpgl.replace('SP', ''))]
+        self.assertGreaterEqual(min(coordinates), 0)
+
+        gcode, gcode_report = build_plot(geometry, plot_format='gcode')
+        self.assertEqual(gcode_report, report)
+        self.assertEqual(gcode.count('M3'), report['polylines'])
+        self.assertEqual(gcode.count('M5'), report['polylines'] + 1)
+
+        svg, svg_report = build_plot(
+            geometry, target='templates', plot_format='svg')
+        self.assertEqual(svg.count('<path'), svg_report['polylines'])
+        with self.assertRaises(ValueError):
+            build_plot(geometry, plot_format='dxf')
+
+
 def dump_svg(inner_elems):
     scale = 3.78
     scale /= 2